@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+
+'''
+  Benchmark suite for the BG96 and LARA-R2 drivers.
+  ---
+  Runs CellularIoT and UbloxLaraR2 against the pty modem emulator, in a
+  process of its own and with its latency model switched off so only
+  the drivers' own costs are measured, and reports:
+
+    - per-command round-trip latency percentiles and commands per second
+    - CPU time per command in the calling thread
+    - bytes per second through send_data (a file upload) and through
+      HTTP body reads
+    - memory blocks retained per command, and peak bytes allocated (tracemalloc)
+
+  Results can be saved as a JSON baseline and later runs compared with
+  it: the run fails, with exit code 1, if any metric is worse than the
+  baseline by more than the threshold.
+
+  Usage:
+      python3 benchmark.py --save baseline.json
+      python3 benchmark.py --compare baseline.json --threshold 0.25
+      python3 benchmark.py --modem bg96 --commands 2000 --json
+'''
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# The emulator directory goes first so the drivers get its fake RPi.GPIO
+for directory in ("common", "ublox", "bg96", "emulator"):
+    sys.path.insert(0, os.path.join(ROOT, directory))
+
+from modem_emulator import BG96Emulator, LaraR2Emulator
+
+# Whether a higher value of each metric is better; all others are better lower
+HIGHER_IS_BETTER = ("commands_per_second", "send_data_bytes_per_second", "body_bytes_per_second")
+
+# Metrics reported but too noisy to fail a run on
+UNGATED = ("latency_max_ms",)
+
+
+# Emulator process: serves the pty until the benchmark closes its end of 'connection'
+def serve_emulator(modem, body_size, connection):
+    body = (b"0123456789abcdef" * (body_size // 16 + 1))[:body_size]
+    if modem == "bg96":
+        emulator = BG96Emulator(time_scale=0, http_content={"http://bench/body": body})
+    else:
+        emulator = LaraR2Emulator(time_scale=0, http_content={"bench/body": body})
+    connection.send(emulator.start())
+    try:
+        connection.recv()
+    except EOFError:
+        pass
+    emulator.stop()
+
+
+# Function for starting an emulator process and a driver connected to it,
+# with a body of 'body_size' bytes served for every HTTP request
+def open_modem(modem, body_size):
+    connection, remote = multiprocessing.Pipe()
+    emulator = multiprocessing.Process(target=serve_emulator, args=(modem, body_size, remote), daemon=True)
+    emulator.start()
+    port = connection.recv()
+    if modem == "bg96":
+        from cellulariot import CellularIoT
+        from bg96_http_session import BG96HTTPSession
+        driver = CellularIoT(port)
+        session = BG96HTTPSession(driver)
+    else:
+        from ublox_lara_r2 import UbloxLaraR2
+        from lara_http_session import LaraR2HTTPSession
+        driver = UbloxLaraR2(port)
+        session = LaraR2HTTPSession(driver, "super")
+    driver.set_debug(False)
+    driver.send_command("ATE0")
+    return ((emulator, connection), driver, session)
+
+
+# Function for getting the value at 'fraction' of the way through sorted 'values'
+def percentile(values, fraction):
+    index = min(len(values) - 1, max(0, int(round(fraction * (len(values) - 1)))))
+    return values[index]
+
+
+# Function for timing round trips of a short query
+def bench_commands(driver, count, command="AT+CSQ"):
+    latencies = []
+    cpu_start = time.thread_time()
+    wall_start = time.perf_counter()
+    for i in range(count):
+        start = time.perf_counter()
+        result = driver.send_command(command)
+        latencies.append((time.perf_counter() - start) * 1000)
+        if result[0] != "OK":
+            raise RuntimeError(command + " failed: " + repr(result))
+    wall = time.perf_counter() - wall_start
+    cpu = time.thread_time() - cpu_start
+    latencies.sort()
+    return {
+        "latency_p50_ms": percentile(latencies, 0.5),
+        "latency_p90_ms": percentile(latencies, 0.9),
+        "latency_p99_ms": percentile(latencies, 0.99),
+        "latency_max_ms": latencies[-1],
+        "commands_per_second": count / wall,
+        "cpu_us_per_command": cpu / count * 1000000
+    }
+
+
+# Function for counting the memory blocks left allocated per command, and the
+# peak memory allocated over 'count' commands
+def bench_allocations(driver, count, command="AT+CSQ"):
+    # Warm up first so one-off allocations aren't counted
+    for i in range(10):
+        driver.send_command(command)
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        for i in range(count):
+            driver.send_command(command)
+        peak = tracemalloc.get_traced_memory()[1] - base
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    blocks = sum([stat.count_diff for stat in after.compare_to(before, "filename") if stat.count_diff > 0])
+    return {
+        "retained_blocks_per_command": blocks / count,
+        "peak_bytes": peak
+    }
+
+
+# Function for timing an upload of 'size' bytes through send_data
+def bench_send_data(modem, driver, size):
+    if not hasattr(driver, "send_data"):
+        return {}
+    payload = ("0123456789abcdef" * (size // 16 + 1))[:size]
+    if modem == "bg96":
+        command = "AT+QFUPL=\"bench.bin\"," + str(size)
+        prompt = "CONNECT"
+    else:
+        command = "AT+UDWNFILE=\"bench.bin\"," + str(size)
+        prompt = ">"
+    start = time.perf_counter()
+    result = driver.send_command(command, prompt)
+    if result[0] == "OK":
+        result = driver.send_data(payload)
+    elapsed = time.perf_counter() - start
+    if result[0] != "OK":
+        raise RuntimeError("Upload failed: " + repr(result))
+    return {"send_data_bytes_per_second": size / elapsed}
+
+
+# Function for timing HTTP body reads, over 'count' requests
+def bench_body(session, count):
+    url = "http://bench/body"
+    total = 0
+    elapsed = 0
+    for i in range(count):
+        result = session.stream(url)
+        if result[0] != "OK":
+            raise RuntimeError("Request failed: " + repr(result))
+        # Only the body read is timed: the request itself is a command round trip
+        start = time.perf_counter()
+        for block in result[2]:
+            total += len(block)
+        elapsed += time.perf_counter() - start
+    return {"body_bytes_per_second": total / elapsed}
+
+
+# Function for running every benchmark against one modem
+def run(modem, commands, body_size, requests):
+    (emulator, connection), driver, session = open_modem(modem, body_size)
+    try:
+        results = {}
+        results.update(bench_commands(driver, commands))
+        results.update(bench_allocations(driver, min(commands, 200)))
+        results.update(bench_send_data(modem, driver, body_size))
+        results.update(bench_body(session, requests))
+        return results
+    finally:
+        session.close()
+        connection.close()
+        emulator.join(5)
+
+
+# Function for comparing results with a baseline. Returns a list of regressions
+def compare(results, baseline, threshold):
+    regressions = []
+    for modem in results:
+        for metric, value in results[modem].items():
+            previous = baseline.get(modem, {}).get(metric)
+            if previous is None or previous == 0 or metric in UNGATED:
+                continue
+            if metric in HIGHER_IS_BETTER:
+                change = (previous - value) / previous
+            else:
+                change = (value - previous) / previous
+            if change > threshold:
+                regressions.append((modem, metric, previous, value, change))
+    return regressions
+
+
+# Function for printing results as a table
+def print_results(results):
+    for modem in results:
+        print(modem)
+        for metric, value in results[modem].items():
+            print("  " + metric.ljust(32) + format(value, ".3f").rjust(16))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the modem drivers against the emulator")
+    parser.add_argument("--modem", choices=["bg96", "lara-r2", "all"], default="all")
+    parser.add_argument("--commands", type=int, default=1000, help="round trips to time")
+    parser.add_argument("--body-size", type=int, default=65536, help="bytes per upload and HTTP body")
+    parser.add_argument("--requests", type=int, default=20, help="HTTP requests to time")
+    parser.add_argument("--save", help="write the results to this baseline file")
+    parser.add_argument("--compare", help="compare the results with this baseline file")
+    parser.add_argument("--threshold", type=float, default=0.2, help="fractional worsening that fails the run")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    modems = ["bg96", "lara-r2"] if args.modem == "all" else [args.modem]
+    results = {}
+    for modem in modems:
+        results[modem] = run(modem, args.commands, args.body_size, args.requests)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_results(results)
+
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump(results, file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        regressions = compare(results, baseline, args.threshold)
+        for modem, metric, previous, value, change in regressions:
+            print("REGRESSION " + modem + " " + metric + ": " + format(previous, ".3f")
+                  + " -> " + format(value, ".3f") + " (" + format(change * 100, ".0f") + "% worse)")
+        if len(regressions) > 0:
+            sys.exit(1)
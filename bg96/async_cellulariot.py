@@ -0,0 +1,211 @@
+'''
+  asyncio version of the simplified Sixfab RPi Cellular IoT Hat library.
+  ---
+  Every method that talks to the modem is a coroutine, so one event loop
+  can drive the modem alongside other I/O tasks. Pins, modes, bands,
+  timeout tables and the configuration cache come from BG96Profile,
+  which CellularIoT uses too.
+'''
+
+import asyncio
+from bg96_profile import BG96Profile
+from asyncmodem import AsyncCellularModem
+import hardware
+
+
+class AsyncCellularIoT(BG96Profile, AsyncCellularModem):
+
+    # Function for starting the modem, yielding to the loop until it answers.
+    # With 'warm_start', a module that is already powered is used as it is.
+    # Raises asyncio.TimeoutError if it doesn't answer within boot_timeout
+    async def boot(self, warm_start=True):
+        deadline = self.millis() + self.boot_timeout * 1000
+        self.setup_pins()
+        # Open the port while the modem starts
+        await self.transport.open()
+        if not (warm_start and self.is_powered()):
+            await self.power_up()
+        await self.wait_until_ready(deadline)
+
+    # Function for powering BG96 module, yielding to the loop while it starts.
+    # The wait for the STATUS line to fall runs in an executor thread
+    async def power_up(self, timeout=None):
+        if timeout is None:
+            timeout = self.power_up_timeout
+        self.gpio.output(self.BG96_POWERKEY, 1)
+        try:
+            if self.gpio.input(self.STATUS) == 1:
+                await asyncio.get_running_loop().run_in_executor(
+                    None, self.gpio.wait_for_edge, self.STATUS, hardware.FALLING, timeout)
+                if self.gpio.input(self.STATUS) == 1:
+                    raise asyncio.TimeoutError("BG96 did not power up")
+        finally:
+            self.gpio.output(self.BG96_POWERKEY, 0)
+        self.debug_print("Modem powered")
+
+    # Function for saving conf. and reset BG96_AT module
+    async def reset(self):
+        await self.save_config()
+        await asyncio.sleep(0.2)
+        self.disable()
+        await asyncio.sleep(0.2)
+        self.enable()
+        await self.power_up()
+        self.invalidate_config()
+
+    # Function for save configurations that be done in current session.
+    async def save_config(self):
+        await self.command("AT&W")
+        # Read the configuration afresh next time rather than trust the cache
+        self.invalidate_config()
+
+    # Function for reading the modem's network configuration in one round trip.
+    # The result is cached so that the set_* functions only write values that differ
+    async def read_config(self):
+        return self.parse_config(await self.send_batch(self.CONFIG_QUERIES))
+
+    # Function for getting the cached configuration, reading it from the modem if necessary
+    async def get_config(self):
+        if self.config is None:
+            await self.read_config()
+        return self.config
+
+    # Function for setting all three bands; pass a *_NO_CHANGE value to leave one as it is.
+    # Nothing is written if the modem already uses the requested bands
+    async def set_bands(self, gsm_band, catm1_band, nbiot_band):
+        await self.get_config()
+        command, wanted = self.band_command(gsm_band, catm1_band, nbiot_band)
+        if command is None:
+            self.debug_print("Bands unchanged")
+            return ("OK", "")
+        result = await self.command(command)
+        self.update_bands(result, wanted)
+        return result
+
+    # Function for setting GSM Band
+    async def set_gsm_band(self, gsm_band):
+        return await self.set_bands(gsm_band, self.LTE_NO_CHANGE, self.LTE_NO_CHANGE)
+
+    # Function for setting Cat.M1 Band
+    async def set_catm1_band(self, catm1_band):
+        return await self.set_bands(self.GSM_NO_CHANGE, catm1_band, self.LTE_NO_CHANGE)
+
+    # Function for setting NB-IoT Band
+    async def set_nbiot_band(self, nbiot_band):
+        return await self.set_bands(self.GSM_NO_CHANGE, self.LTE_NO_CHANGE, nbiot_band)
+
+    # Function for getting current band settings
+    async def get_band_config(self):
+        return await self.command("AT+QCFG=\"band\"")
+
+    # Function for setting running mode.
+    # Only the settings that differ from the modem's current ones are written,
+    # avoiding a needless network rescan
+    async def set_mode(self, mode):
+        if mode not in self.MODE_SETTINGS:
+            return
+        await self.get_config()
+        commands = self.mode_commands(mode)
+        results = await self.send_batch(commands) if len(commands) > 0 else []
+        self.update_mode(mode, commands, results)
+
+    # Function for setting the APN of a PDP context, if it isn't already set
+    async def set_apn(self, apn, context_id=1):
+        await self.get_config()
+        command = self.apn_command(apn, context_id)
+        if command is None:
+            return ("OK", "")
+        result = await self.command(command)
+        self.update_apn(result, apn, context_id)
+        return result
+
+    # Function for configurating and activating TCP context
+    async def activate_context(self):
+        await self.command("AT+QICSGP=1")
+        await asyncio.sleep(1)
+        return await self.command("AT+QIACT=1", "\r\n")
+
+    # Function for deactivating TCP context
+    async def deactivate_context(self):
+        return await self.command("AT+QIDEACT=1", "\r\n")
+
+    # Function for making an HTTP GET request on an active context.
+    # Returns a tuple: ("OK", HTTP status code, body) or (error state, None, response)
+    async def http_get(self, url):
+        await self.command("AT+QHTTPCFG=\"contextid\",1")
+        await self.command("AT+QHTTPCFG=\"requestheader\",0")
+        result = await self.command("AT+QHTTPURL=" + str(len(url)) + ",80", "CONNECT")
+        if result[0] != "OK":
+            return (result[0], None, result[1])
+        result = await self.send_data(url)
+        if result[0] != "OK":
+            return (result[0], None, result[1])
+
+        # The request is acknowledged at once; the result arrives as a URC,
+        # eg. "+QHTTPGET: 0,200,22323", so the channel is free meanwhile
+        results = self.urc_queue("+QHTTPGET")
+        while not results.empty():
+            results.get_nowait()
+        result = await self.command("AT+QHTTPGET=" + str(self.http_timeout), timeout=self.timeout)
+        if result[0] != "OK":
+            return (result[0], None, result[1])
+        try:
+            urc = await asyncio.wait_for(results.get(), self.http_timeout + self.timeout)
+        except asyncio.TimeoutError:
+            return ("TIMEOUT", None, "")
+        fields = urc.split(": ")[1].split(",")
+        if fields[0] != "0":
+            return ("ERROR", None, urc)
+        status = int(fields[1]) if len(fields) > 1 else None
+        length = int(fields[2]) if len(fields) > 2 else None
+
+        # Read back the body
+        try:
+            body = await self.read_http_body(length)
+        except IOError as exp:
+            return ("ERROR", status, str(exp))
+        return ("OK", status, body.decode('utf-8', errors='ignore'))
+
+    # Function for reading the body of an HTTP response, as bytes. 'length' is the
+    # content length reported by +QHTTPGET; if given, the body is framed on it, as
+    # CellularIoT.read_http_body() does. Raises IOError if the read fails
+    async def read_http_body(self, length=None, wait_time=None):
+        if wait_time is None:
+            wait_time = self.http_timeout
+        timeout = wait_time + self.timeout
+
+        # The modem sends CONNECT<CR><LF><body><CR><LF>OK<CR><LF><CR><LF>+QHTTPREAD: <err>
+        async def read(header):
+            transport = self.transport
+            trailer = None
+            if length is not None:
+                body = await transport.read_bytes(length, timeout)
+                if len(body) < length:
+                    raise TimeoutError("HTTP body read timed out")
+            else:
+                # No length, so the body is framed on the trailer, as for CellularIoT
+                end = b"\r\nOK\r\n\r\n"
+                body = bytearray()
+                while True:
+                    line = await transport.read_line(timeout)
+                    if not line.endswith(b"\n"):
+                        raise TimeoutError("HTTP body read timed out")
+                    if line.startswith(b"+QHTTPREAD:") and body.endswith(end):
+                        del body[-len(end):]
+                        trailer = line
+                        break
+                    body += line
+            while trailer is None:
+                line = await transport.read_line(timeout)
+                if not line.endswith(b"\n"):
+                    raise TimeoutError("HTTP body read timed out")
+                if line.startswith(b"+QHTTPREAD:"):
+                    trailer = line
+            if trailer.split(b":")[1].strip() != b"0":
+                raise IOError("HTTP body read failed: " + trailer.decode('utf-8', errors='ignore').strip())
+            return bytes(body)
+
+        result = await self.read_data("AT+QHTTPREAD=" + str(wait_time), "CONNECT", read, timeout)
+        if result[0] != "OK":
+            raise IOError("AT+QHTTPREAD failed: " + result[1].strip())
+        return result[1]
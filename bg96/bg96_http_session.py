@@ -0,0 +1,135 @@
+'''
+  Persistent PDP context and HTTP session for the BG96.
+  ---
+  Keeps context 1 active between requests, checking it with AT+QIACT?,
+  sets up AT+QHTTPCFG once per context and re-sends AT+QHTTPURL only
+  when the URL changes. Requires the URC dispatcher, which is started
+  if necessary: while a request waits for its result URC the modem is
+  free for other threads' commands.
+'''
+
+import os
+import queue
+import sys
+
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from httpsession import HTTPSession
+
+
+class BG96HTTPSession(HTTPSession):
+
+    context_id = 1
+    content_type = None # AT+QHTTPCFG="contenttype" value last set
+
+    # AT+QHTTPCFG="contenttype" values; other types are sent as application/octet-stream
+    CONTENT_TYPES = {
+        "application/x-www-form-urlencoded": 0,
+        "text/plain": 1,
+        "application/octet-stream": 2,
+        "multipart/form-data": 3
+    }
+
+    # Initializer function
+    def __init__(self, modem, idle_timeout=300, context_id=1):
+        super().__init__(modem, idle_timeout)
+        self.context_id = context_id
+        self.results = {"+QHTTPGET": modem.urc_queue("+QHTTPGET"),
+                        "+QHTTPPOST": modem.urc_queue("+QHTTPPOST")}
+
+    # Function for checking the context with a single query, eg. +QIACT: 1,1,1,"10.0.0.1"
+    def context_active(self):
+        result = self.modem.send_command("AT+QIACT?")
+        return result[0] == "OK" and result[1].find("+QIACT: " + str(self.context_id) + ",1") != -1
+
+    # Function for activating the context
+    def open_context(self):
+        result = self.modem.send_command("AT+QIACT=" + str(self.context_id))
+        return result[0] == "OK"
+
+    # Function for deactivating the context
+    def close_context(self):
+        self.modem.send_command("AT+QIDEACT=" + str(self.context_id))
+
+    # Function for pointing the HTTP stack at the context, with no custom headers
+    def configure(self):
+        self.modem.send_batch(["AT+QHTTPCFG=\"contextid\"," + str(self.context_id),
+                               "AT+QHTTPCFG=\"requestheader\",0"])
+        self.content_type = None
+
+    # Function for sending the URL, only if it has changed. Returns ("OK", None, "") on success
+    def set_url(self, url):
+        if url != self.url:
+            # No other thread's command may come between the prompt and the data
+            with self.modem.lock:
+                result = self.modem.send_command("AT+QHTTPURL=" + str(len(url)) + ",80", "CONNECT")
+                if result[0] != "OK":
+                    return (result[0], None, result[1])
+                result = self.modem.send_data(url)
+            if result[0] != "OK":
+                return (result[0], None, result[1])
+            self.url = url
+        return ("OK", None, "")
+
+    # Function for making a GET request
+    def request(self, url):
+        result = self.set_url(url)
+        if result[0] != "OK":
+            return result
+
+        # Make the request and wait for the result, eg. "+QHTTPGET: 0,200,22323"
+        self.clear_results("+QHTTPGET")
+        result = self.modem.send_command("AT+QHTTPGET=" + str(self.modem.http_timeout))
+        return self.wait_for_result(result, "+QHTTPGET")
+
+    # Function for making a POST request. The modem prompts for the body with CONNECT
+    # and reports the result, eg. "+QHTTPPOST: 0,200", once the server has answered
+    def request_post(self, url, body, content_type):
+        result = self.set_url(url)
+        if result[0] != "OK":
+            return result
+        value = self.CONTENT_TYPES.get(content_type, 2)
+        if value != self.content_type:
+            result = self.modem.send_command("AT+QHTTPCFG=\"contenttype\"," + str(value))
+            if result[0] != "OK":
+                return (result[0], None, result[1])
+            self.content_type = value
+        self.clear_results("+QHTTPPOST")
+        with self.modem.lock:
+            result = self.modem.send_command("AT+QHTTPPOST=" + str(len(body)) + ",80," + str(self.modem.http_timeout), "CONNECT")
+            if result[0] != "OK":
+                return (result[0], None, result[1])
+            result = self.modem.send_data(body)
+        result = self.wait_for_result(result, "+QHTTPPOST")
+        return result if result[0] != "OK" else ("OK", result[1], "")
+
+    # Function for discarding result URCs left over from an earlier request
+    def clear_results(self, prefix):
+        while not self.results[prefix].empty():
+            self.results[prefix].get_nowait()
+
+    # Function for waiting, without holding the modem, for the result URC of a
+    # request the modem has accepted with 'result', eg. "+QHTTPGET: 0,200,22323"
+    def wait_for_result(self, result, prefix):
+        if result[0] != "OK":
+            return (result[0], None, result[1])
+        try:
+            urc = self.results[prefix].get(timeout=self.modem.http_timeout + self.modem.timeout)
+        except queue.Empty:
+            return ("TIMEOUT", None, "")
+        return self.parse_result(("OK", urc), prefix + ": ")
+
+    # Function for parsing a request's result URC, eg. "+QHTTPGET: 0,200,22323", into
+    # ("OK", HTTP status code, content length or None) or (error state, None, response)
+    def parse_result(self, result, prefix):
+        if result[0] != "OK":
+            return (result[0], None, result[1])
+        fields = result[1][result[1].find(prefix) + len(prefix):].split("\r\n")[0].split(",")
+        if fields[0] != "0" or len(fields) < 2:
+            return ("ERROR", None, result[1])
+        status = int(fields[1])
+        length = int(fields[2]) if len(fields) > 2 else None
+        return ("OK", status, length)
+
+    # Function for streaming the body with AT+QHTTPREAD
+    def read_body(self, length, block_size):
+        return self.modem.read_http_body(length, block_size)
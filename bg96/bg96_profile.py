@@ -0,0 +1,257 @@
+'''
+  BG96 profile shared by the blocking and asyncio Cellular IoT Hat drivers.
+  ---
+  The BG96's dialect, pins, modes and bands, and the cache of its network
+  configuration. The cache decides which commands a setting needs, so
+  the set_* functions of both drivers write only values that differ from
+  the modem's, and is updated from the results of those commands.
+'''
+
+import os
+import sys
+
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from modemprofile import ModemProfile
+
+
+class BG96Profile(ModemProfile):
+
+    http_timeout = 60 # Seconds, matches the AT+QHTTPGET default response time
+    power_up_timeout = 30 # Seconds
+    config = None # cached modem configuration, see parse_config()
+
+    DEFAULT_SERIAL_PORT = "/dev/ttyS0"
+
+    # Baud rates negotiate_link() tries, fastest first
+    BAUDRATES = (921600, 460800, 230400, 115200)
+
+    # Pins
+    BG96_ENABLE = 17
+    BG96_POWERKEY = 24
+    STATUS = 23
+
+    # Cellular Modes
+    AUTO_MODE = 0
+    GSM_MODE = 1
+    CATM1_MODE = 2
+    CATNB1_MODE = 3
+
+    # LTE Bands
+    LTE_B1 = "1"
+    LTE_B2 = "2"
+    LTE_B3 = "4"
+    LTE_B4 = "8"
+    LTE_B5 = "10"
+    LTE_B8 = "80"
+    LTE_B12 = "800"
+    LTE_B13 = "1000"
+    LTE_B18 = "20000"
+    LTE_B19 = "40000"
+    LTE_B20 = "80000"
+    LTE_B26 = "2000000"
+    LTE_B28 = "8000000"
+    LTE_B39 = "4000000000" # catm1 only
+    LTE_CATM1_ANY = "400A0E189F"
+    LTE_CATNB1_ANY = "A0E189F"
+    LTE_NO_CHANGE = "0"
+
+    # GSM Bands
+    GSM_NO_CHANGE = "0"
+    GSM_900 = "1"
+    GSM_1800 = "2"
+    GSM_850 = "4"
+    GSM_1900 = "8"
+    GSM_ANY = "F"
+
+    # AT+QCFG values for each mode
+    MODE_SETTINGS = {
+        AUTO_MODE: {"nwscanseq": "00", "nwscanmode": "0", "iotopmode": "2"},
+        GSM_MODE: {"nwscanseq": "01", "nwscanmode": "1", "iotopmode": "2"},
+        CATM1_MODE: {"nwscanseq": "02", "nwscanmode": "3", "iotopmode": "0"},
+        CATNB1_MODE: {"nwscanseq": "03", "nwscanmode": "3", "iotopmode": "1"}
+    }
+
+    # Queries whose results make up the configuration cache, sent as one batch
+    CONFIG_QUERIES = ("AT+QCFG=\"band\"", "AT+QCFG=\"nwscanseq\"", "AT+QCFG=\"nwscanmode\"",
+                      "AT+QCFG=\"iotopmode\"", "AT+CGDCONT?")
+
+    # Special Characters
+    CTRL_Z = '\x1A'
+
+    # Commands that must not be chained into one command line: they prompt for
+    # data, wait for a URC or take long enough to be worth handling on their own
+    NO_CHAIN_COMMANDS = ("AT+QHTTPURL", "AT+QHTTPGET", "AT+QHTTPPOST", "AT+QHTTPREAD", "AT+QIACT",
+                         "AT+QIDEACT", "AT+QIOPEN", "AT+QISEND", "AT+QIRD", "AT+QISWTMD", "AT+CMGS",
+                         "AT+COPS")
+
+    # Commands that must not be re-sent after a timeout: each repeat would make
+    # another request, send more data or open another connection
+    NO_RETRY_COMMANDS = ("AT+QHTTPURL", "AT+QHTTPGET", "AT+QHTTPPOST", "AT+QHTTPREAD", "AT+QIOPEN",
+                         "AT+QISEND", "AT+QIRD", "AT+QISWTMD", "AT+QFUPL", "AT+CMGS", "AT+QPOWD")
+
+    # Unsolicited result codes
+    URC_PREFIXES = ("+CMTI", "+QIURC", "+QIOPEN", "+QHTTPGET", "+QHTTPPOST", "+QHTTPREAD",
+                    "+QIND", "+CREG", "+CGREG", "+CEREG", "RDY", "POWERED DOWN")
+
+    # Maximum response times, in seconds, taken from the BG96 AT Commands Manual.
+    # Commands not listed here use self.timeout
+    COMMAND_TIMEOUTS = {
+        "AT": 0.3,
+        "ATE0": 0.3,
+        "ATE1": 0.3,
+        "ATH": 90,
+        "ATZ": 0.3,
+        "ATQ0": 0.3,
+        "AT&W": 0.3,
+        "AT+IPR": 0.3,
+        "AT+IFC": 0.3,
+        "AT+CMGF": 0.3,
+        "AT+CMGR": 0.3,
+        "AT+CMGL": 5,
+        "AT+CMGD": 5,
+        "AT+CMGS": 120,
+        "AT+COPS": 180,
+        "AT+CSQ": 0.3,
+        "AT+CGDCONT": 0.3,
+        "AT+QCFG": 0.3,
+        "AT+QNWINFO": 0.3,
+        "AT+QICSGP": 0.3,
+        "AT+QIACT": 150,
+        "AT+QIDEACT": 40,
+        "AT+QHTTPCFG": 0.3,
+        "AT+QHTTPURL": 30,
+        "AT+QICLOSE": 10
+    }
+
+    # Commands whose response time is bounded by self.http_timeout
+    HTTP_COMMANDS = ("AT+QHTTPGET", "AT+QHTTPPOST", "AT+QHTTPREAD")
+
+    # Function for setting up GPIO and enabling the board
+    def setup_pins(self):
+        self.gpio.setup_output(self.BG96_ENABLE)
+        self.gpio.setup_output(self.BG96_POWERKEY)
+        self.gpio.setup_input(self.STATUS)
+        self.enable()
+
+    # Function for checking the STATUS line, which is low once the module has started.
+    # Without GPIO, eg. on USB, the modem is assumed to be powered
+    def is_powered(self):
+        return self.gpio.input(self.STATUS) != 1
+
+    # Function to enable BG96 module
+    def enable(self):
+        self.gpio.output(self.BG96_ENABLE, 0)
+        self.debug_print("Modem enabled")
+
+    # Function for powering down BG96 module and all peripherals from voltage regulator
+    def disable(self):
+        self.gpio.output(self.BG96_ENABLE, 1)
+        self.debug_print("Modem disabled")
+
+    # Function for building the configuration cache from the results of CONFIG_QUERIES.
+    # Returns the configuration, or None if any query failed
+    def parse_config(self, results):
+        config = {"apn": {}}
+        for result in results:
+            if result[0] != "OK":
+                self.config = None
+                return None
+            for line in result[1].split("\r\n"):
+                if line.startswith("+QCFG: "):
+                    fields = line[7:].split(",")
+                    name = fields[0].strip("\"")
+                    if name == "band":
+                        config[name] = [int(value, 16) for value in fields[1:4]]
+                    elif len(fields) > 1:
+                        config[name] = fields[1].strip()
+                elif line.startswith("+CGDCONT: "):
+                    fields = line[10:].split(",")
+                    if len(fields) > 2:
+                        config["apn"][fields[0].strip()] = fields[2].strip("\"")
+        self.config = config
+        return config
+
+    # Function for discarding the cached configuration
+    def invalidate_config(self):
+        self.config = None
+
+    # Function for getting the command setting all three bands, and the bands it sets
+    # as read back from the modem. A *_NO_CHANGE value leaves a band as it is. Returns
+    # (None, bands) if the cache shows the modem already uses them
+    def band_command(self, gsm_band, catm1_band, nbiot_band):
+        wanted = None
+        if self.config is not None and "band" in self.config:
+            wanted = [int(str(band), 16) for band in (gsm_band, catm1_band, nbiot_band)]
+            wanted = [wanted[i] if wanted[i] != 0 else self.config["band"][i] for i in range(3)]
+            if wanted == self.config["band"]:
+                return (None, wanted)
+        return ("AT+QCFG=\"band\"," + str(gsm_band) + "," + str(catm1_band) + "," + str(nbiot_band), wanted)
+
+    # Function for updating the cache with the result of a band command
+    def update_bands(self, result, wanted):
+        if result[0] == "OK" and wanted is not None and self.config is not None:
+            self.config["band"] = wanted
+        else:
+            self.invalidate_config()
+
+    # Function for getting the commands that set a mode: only the settings that differ
+    # from the cached ones, avoiding a needless network rescan
+    def mode_commands(self, mode):
+        if mode not in self.MODE_SETTINGS:
+            return []
+        wanted = self.MODE_SETTINGS[mode]
+        commands = []
+        for name in ("nwscanseq", "nwscanmode", "iotopmode"):
+            if self.config is not None and self.is_config_value(self.config.get(name), wanted[name], name == "nwscanseq"):
+                continue
+            commands.append("AT+QCFG=\"" + name + "\"," + wanted[name] + ",1")
+        return commands
+
+    # Function for updating the cache with the results of a mode's commands
+    def update_mode(self, mode, commands, results):
+        if len(commands) == 0:
+            self.debug_print("Modem configuration unchanged")
+        elif self.config is not None:
+            wanted = self.MODE_SETTINGS[mode]
+            for index in range(len(commands)):
+                name = commands[index].split("\"")[1]
+                if results[index][0] == "OK":
+                    self.config[name] = wanted[name]
+                else:
+                    self.invalidate_config()
+                    break
+
+        if mode == self.AUTO_MODE:
+            self.debug_print("Modem configuration : AUTO_MODE")
+            self.debug_print("*Priority Table (Cat.M1 -> Cat.NB1 -> GSM)")
+        elif mode == self.GSM_MODE:
+            self.debug_print("Modem configuration : GSM_MODE")
+        elif mode == self.CATM1_MODE:
+            self.debug_print("Modem configuration : CATM1_MODE")
+        elif mode == self.CATNB1_MODE:
+            self.debug_print("Modem configuration : CATNB1_MODE ( NB-IoT )")
+
+    # Function for comparing a configuration value read from the modem with a wanted one.
+    # Scan sequences read back in full, eg. "020301", so match on the requested prefix
+    def is_config_value(self, current, wanted, is_sequence=False):
+        if current is None:
+            return False
+        if is_sequence:
+            if wanted == "00":
+                return current in ("00", "020301")
+            return current.startswith(wanted)
+        return current.lstrip("0") == wanted.lstrip("0")
+
+    # Function for getting the command setting the APN of a PDP context, or None
+    # if the cache shows it is already set
+    def apn_command(self, apn, context_id=1):
+        if self.config is not None and self.config["apn"].get(str(context_id)) == apn:
+            return None
+        return "AT+CGDCONT=" + str(context_id) + ",\"IP\",\"" + apn + "\""
+
+    # Function for updating the cache with the result of an APN command
+    def update_apn(self, result, apn, context_id=1):
+        if result[0] == "OK" and self.config is not None:
+            self.config["apn"][str(context_id)] = apn
+        else:
+            self.invalidate_config()
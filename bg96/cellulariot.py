@@ -7,252 +7,120 @@
 '''
 
 
-import time
-import serial
-import RPi.GPIO as GPIO
+import os
+import sys
 
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from cellularmodem import CellularModem
+from bg96_profile import BG96Profile
+import hardware
 
-class CellularIoT:
 
-    uart = None
-    debug = True
-    
+class CellularIoT(BG96Profile, CellularModem):
+
     ip_address = "" # ip address
     domain_name = "" # domain name
     port_number = "" # port number
-    timeout = 3 # Seconds
-
-    response = "" # variable for modem responses
-    compose = "" # variable for command strings
-
-    # Pins
-    BG96_ENABLE = 17
-    BG96_POWERKEY = 24
-    STATUS = 23
-
-    # Cellular Modes
-    AUTO_MODE = 0
-    GSM_MODE = 1
-    CATM1_MODE = 2
-    CATNB1_MODE = 3
-
-    # LTE Bands
-    LTE_B1 = "1"
-    LTE_B2 = "2"
-    LTE_B3 = "4"
-    LTE_B4 = "8"
-    LTE_B5 = "10"
-    LTE_B8 = "80"
-    LTE_B12 = "800"
-    LTE_B13 = "1000"
-    LTE_B18 = "20000"
-    LTE_B19 = "40000"
-    LTE_B20 = "80000"
-    LTE_B26 = "2000000"
-    LTE_B28 = "8000000"
-    LTE_B39 = "4000000000" # catm1 only
-    LTE_CATM1_ANY = "400A0E189F"
-    LTE_CATNB1_ANY = "A0E189F"
-    LTE_NO_CHANGE = "0"
-
-    # GSM Bands
-    GSM_NO_CHANGE = "0"
-    GSM_900 = "1"
-    GSM_1800 = "2"
-    GSM_850 = "4"
-    GSM_1900 = "8"
-    GSM_ANY = "F"
-
-    # Special Characters
-    CTRL_Z = '\x1A'
-
-    # Initializer function
-    def __init__(self, serial_port="/dev/ttyS0", serial_baudrate=115200, rtscts=False, dsrdtr=False):
-        self.uart = serial.Serial()
-        self.uart.port = serial_port
-        self.uart.baudrate = serial_baudrate
-        self.uart.parity = serial.PARITY_NONE
-        self.uart.stopbits = serial.STOPBITS_ONE
-        self.uart.bytesize = serial.EIGHTBITS
-        self.uart.rtscts = rtscts
-        self.uart.dsrdtr = dsrdtr
-        self.debug_print("CellularIoT class instantiated")
-
-    def __del__(self):
-        GPIO.cleanup()
-
-    def boot(self):
-        # Setup GPIO
-        GPIO.setmode(GPIO.BCM)
-        GPIO.setup(self.BG96_ENABLE, GPIO.OUT)
-        GPIO.setup(self.BG96_POWERKEY, GPIO.OUT)
-        GPIO.setup(self.STATUS, GPIO.IN)
-
-        # Enable board and power up
-        self.enable()
-        self.power_up()
-
-    # Function to enable BG96 module
-    def enable(self):
-        GPIO.output(self.BG96_ENABLE, 0)
-        self.debug_print("Modem enabled")
+    sockets = None # open BG96Sockets by connect ID, see open_socket()
 
-    # Function for powering down BG96 module and all peripherals from voltage regulator
-    def disable(self):
-        GPIO.output(self.BG96_ENABLE, 1)
-        self.debug_print("Modem disabled")
+    # Function for powering the module on as part of boot()
+    def power_on(self, deadline):
+        self.power_up((deadline - self.millis()) / 1000.0)
 
-    # Function for powering BG96 module
-    def power_up(self):
-        GPIO.output(self.BG96_POWERKEY, 1)
-        while GPIO.input(self.STATUS):
-            pass
-        GPIO.output(self.BG96_POWERKEY, 0)
+    # Function for powering BG96 module.
+    # Sleeps until the STATUS line falls, or 'timeout' seconds pass, opening the
+    # serial port meanwhile. Raises TimeoutError if the module doesn't start
+    def power_up(self, timeout=None):
+        if timeout is None:
+            timeout = self.power_up_timeout
+        self.gpio.output(self.BG96_POWERKEY, 1)
+        try:
+            if self.uart.isOpen() is False:
+                self.uart.open()
+            if self.gpio.input(self.STATUS) == 1:
+                self.gpio.wait_for_edge(self.STATUS, hardware.FALLING, timeout)
+                # Check the level too, in case the edge came before the wait began
+                if self.gpio.input(self.STATUS) == 1:
+                    raise TimeoutError("BG96 did not power up")
+        finally:
+            self.gpio.output(self.BG96_POWERKEY, 0)
         self.debug_print("Modem powered")
 
     # Function for saving conf. and reset BG96_AT module
     def reset(self):
         self.save_config()
-        delay(200)
+        self.delay(200)
         self.disable()
-        delay(200)
+        self.delay(200)
         self.enable()
         self.power_up()
+        self.invalidate_config()
 
-    # Function for sending a comamand or data to module
-    def send(self, command, is_command=True):
-        if self.uart.isOpen() is False:
-            self.uart.open()
-        self.compose = str(command)
-        if is_command:
-            self.compose += "\r"
-        self.uart.reset_input_buffer()
-        self.uart.write(self.compose.encode())
-
-    # Function for sending at command to BG96_AT.
-    def send_command(self, command, desired_response="OK\r\n", timeout=None):
-        if timeout is None:
-            timeout = self.timeout
-        self.response = ""
-        self.send(command)
-        timer = self.millis()
-        while True:
-            if self.millis() - timer > timeout:
-                # Re-issue command on timeout
-                # TODO or return an error?
-                self.response = ""
-                self.send(command)
-                timer = self.millis()
-            while self.uart.in_waiting > 0:
-                try:
-                    self.response += self.uart.read(self.uart.in_waiting).decode('utf-8', errors='ignore')
-                    self.delay(100)
-                except Exception as exp:
-                    self.debug_print(exp.Message)
-            if self.response.find(desired_response) != -1:
-                self.debug_print(self.response)
-                return ("OK", self.response)
-            if self.response.find("ERROR") != -1:
-                self.debug_print(self.response)
-                return ("ERROR", self.response)
-                break
-
-    # Function for sending data to BG96_AT.
-    def send_data(self, data, desired_response="OK\r\n", timeout=None):
-        if timeout is None:
-            timeout = self.timeout
-        self.response = ""
-        self.send(data, False)
-        timer = self.millis()
-        while True:
-            if self.millis() - timer > timeout:
-                self.response = ""
-                self.send(data, False)
-                timer = self.millis()
-                self.response = ""
-            while self.uart.in_waiting > 0:
-                self.response += self.uart.read(self.uart.in_waiting).decode('utf-8', errors='ignore')
-            if self.response.find(desired_response) != -1 or self.response.find("ERROR") != -1:
-                self.debug_print(self.response)
-                break
-
-    # Function for printing debug message
-    def debug_print(self, message):
-        if self.debug:
-            print(message)
-    
-    # Function for getting time in miliseconds
-    def millis(self):
-        return int(time.time())
-
-    # Function for delay in miliseconds
-    def delay(self, ms):
-        time.sleep(float(ms / 1000.0))
-        
     # Function for save configurations that be done in current session.
     def save_config(self):
         self.send_command("AT&W")
+        # Read the configuration afresh next time rather than trust the cache
+        self.invalidate_config()
+
+    # Function for reading the modem's network configuration in one round trip.
+    # The result is cached so that the set_* functions only write values that differ
+    def read_config(self):
+        return self.parse_config(self.send_batch(self.CONFIG_QUERIES))
+
+    # Function for getting the cached configuration, reading it from the modem if necessary
+    def get_config(self):
+        if self.config is None:
+            self.read_config()
+        return self.config
+
+    # Function for setting all three bands; pass a *_NO_CHANGE value to leave one as it is.
+    # Nothing is written if the modem already uses the requested bands
+    def set_bands(self, gsm_band, catm1_band, nbiot_band):
+        self.get_config()
+        command, wanted = self.band_command(gsm_band, catm1_band, nbiot_band)
+        if command is None:
+            self.debug_print("Bands unchanged")
+            return ("OK", "")
+        result = self.send_command(command)
+        self.update_bands(result, wanted)
+        return result
 
     # Function for setting GSM Band
     def set_gsm_band(self, gsm_band):
-        self.compose = "AT+QCFG=\"band\","
-        self.compose += str(gsm_band)
-        self.compose += ","
-        self.compose += str(self.LTE_NO_CHANGE)
-        self.compose += ","
-        self.compose += str(self.LTE_NO_CHANGE)
-        self.send_command(self.compose)
-        self.compose = ""
+        return self.set_bands(gsm_band, self.LTE_NO_CHANGE, self.LTE_NO_CHANGE)
 
     # Function for setting Cat.M1 Band
     def set_catm1_band(self, catm1_band):
-        self.compose = "AT+QCFG=\"band\","
-        self.compose += str(self.GSM_NO_CHANGE)
-        self.compose += ","
-        self.compose += str(catm1_band)
-        self.compose += ","
-        self.compose += str(self.LTE_NO_CHANGE)
-        self.send_command(self.compose)
-        self.compose = ""
+        return self.set_bands(self.GSM_NO_CHANGE, catm1_band, self.LTE_NO_CHANGE)
 
     # Function for setting NB-IoT Band
     def set_nbiot_band(self, nbiot_band):
-        self.compose = "AT+QCFG=\"band\","
-        self.compose += str(self.GSM_NO_CHANGE)
-        self.compose += ","
-        self.compose += str(self.LTE_NO_CHANGE)
-        self.compose += ","
-        self.compose += str(nbiot_band)
-        self.send_command(self.compose)
-        self.compose = ""
+        return self.set_bands(self.GSM_NO_CHANGE, self.LTE_NO_CHANGE, nbiot_band)
 
     # Function for getting current band settings
     def get_band_config(self):
         return self.send_command("AT+QCFG=\"band\"")
 
     # Function for setting running mode.
+    # Only the settings that differ from the modem's current ones are written,
+    # avoiding a needless network rescan
     def set_mode(self, mode):
-        if mode == self.AUTO_MODE:
-            self.send_command("AT+QCFG=\"nwscanseq\",00,1")
-            self.send_command("AT+QCFG=\"nwscanmode\",0,1")
-            self.send_command("AT+QCFG=\"iotopmode\",2,1")
-            self.debug_print("Modem configuration : AUTO_MODE")
-            self.debug_print("*Priority Table (Cat.M1 -> Cat.NB1 -> GSM)")
-        elif mode == self.GSM_MODE:
-            self.send_command("AT+QCFG=\"nwscanseq\",01,1")
-            self.send_command("AT+QCFG=\"nwscanmode\",1,1")
-            self.send_command("AT+QCFG=\"iotopmode\",2,1")
-            self.debug_print("Modem configuration : GSM_MODE")
-        elif mode == self.CATM1_MODE:
-            self.send_command("AT+QCFG=\"nwscanseq\",02,1")
-            self.send_command("AT+QCFG=\"nwscanmode\",3,1")
-            self.send_command("AT+QCFG=\"iotopmode\",0,1")
-            self.debug_print("Modem configuration : CATM1_MODE")
-        elif mode == self.CATNB1_MODE:
-            self.send_command("AT+QCFG=\"nwscanseq\",03,1")
-            self.send_command("AT+QCFG=\"nwscanmode\",3,1")
-            self.send_command("AT+QCFG=\"iotopmode\",1,1")
-            self.debug_print("Modem configuration : CATNB1_MODE ( NB-IoT )")
+        if mode not in self.MODE_SETTINGS:
+            return
+        self.get_config()
+        commands = self.mode_commands(mode)
+        results = self.send_batch(commands) if len(commands) > 0 else []
+        self.update_mode(mode, commands, results)
+
+    # Function for setting the APN of a PDP context, if it isn't already set
+    def set_apn(self, apn, context_id=1):
+        self.get_config()
+        command = self.apn_command(apn, context_id)
+        if command is None:
+            return ("OK", "")
+        result = self.send_command(command)
+        self.update_apn(result, apn, context_id)
+        return result
 
     # Function for configurating and activating TCP context
     def activate_context(self):
@@ -260,10 +128,86 @@ class CellularIoT:
         self.delay(1000)
         self.send_command("AT+QIACT=1", "\r\n")
 
+    # Function for reading the body of an HTTP response in blocks, yielding each as bytes.
+    # 'length' is the content length reported by +QHTTPGET; if given, the body is framed
+    # on it rather than on the text around it. Raises IOError if the read fails.
+    # The modem is held for this thread from the first block until the body has been
+    # read, so read it to the end or close() the generator, eg. with contextlib.closing()
+    def read_http_body(self, length=None, block_size=1024, wait_time=None):
+        if wait_time is None:
+            wait_time = self.http_timeout
+        timeout = wait_time + self.timeout
+        self.hold_input("AT+QHTTPREAD")
+        try:
+            # The modem sends CONNECT<CR><LF><body><CR><LF>OK<CR><LF><CR><LF>+QHTTPREAD: <err>
+            result = self.send_command("AT+QHTTPREAD=" + str(wait_time), "CONNECT", timeout)
+            if result[0] != "OK":
+                raise IOError("AT+QHTTPREAD failed: " + result[1].strip())
+            trailer = None
+            if length is not None:
+                remaining = length
+                while remaining > 0:
+                    block = self.read_bytes(min(block_size, remaining), timeout)
+                    if len(block) == 0:
+                        raise TimeoutError("HTTP body read timed out")
+                    remaining -= len(block)
+                    yield block
+            else:
+                # No length, so the body is framed on the trailer: it ends at the
+                # <CR><LF>OK<CR><LF><CR><LF> followed by the +QHTTPREAD line, so an
+                # OK line within the body doesn't end it
+                end = b"\r\nOK\r\n\r\n"
+                pending = bytearray()
+                while True:
+                    line = self.read_until(b"\n", timeout)
+                    if len(line) == 0:
+                        raise TimeoutError("HTTP body read timed out")
+                    if line.startswith(b"+QHTTPREAD:") and pending.endswith(end):
+                        del pending[-len(end):]
+                        trailer = line.decode('utf-8', errors='ignore')
+                        break
+                    pending += line
+                    if len(pending) > block_size + len(end):
+                        yield bytes(pending[:-len(end)])
+                        del pending[:-len(end)]
+                if len(pending) > 0:
+                    yield bytes(pending)
+            while trailer is None:
+                line = self.read_line(timeout)
+                if len(line) == 0:
+                    raise TimeoutError("HTTP body read timed out")
+                if line.startswith("+QHTTPREAD:"):
+                    trailer = line
+            if trailer.split(":")[1].strip() != "0":
+                raise IOError("HTTP body read failed: " + trailer.strip())
+        finally:
+            self.release_input()
+
     # Function for deactivating TCP context
     def deactivate_context(self):
         self.send_command("AT+QIDEACT=1", "\r\n")
-        
+
+    # Function for getting an HTTP session that keeps the context open between requests
+    def http_session(self, apn=None, idle_timeout=300):
+        from bg96_http_session import BG96HTTPSession
+        if apn is not None:
+            self.set_apn(apn)
+        return BG96HTTPSession(self, idle_timeout)
+
+    # Function for opening a TCP or UDP connection on context 'context_id', which must
+    # be active. 'host' and 'port' default to self.domain_name, or self.ip_address, and
+    # self.port_number. Returns a BG96Socket. Raises IOError if the connection fails.
+    # The first connection turns the modem's echo off (ATE0), see modem_socket
+    def open_socket(self, host=None, port=None, protocol="TCP", context_id=1, timeout=150):
+        from modem_socket import BG96Socket
+        if host is None:
+            host = self.domain_name or self.ip_address
+        if port is None:
+            port = self.port_number
+        connection = BG96Socket(self, context_id)
+        connection.connect(host, port, protocol, timeout)
+        return connection
+
     # Function for getting self.ip_address
     def get_ip_address(self):
         return self.ip_address
@@ -287,15 +231,3 @@ class CellularIoT:
     # Function for setting port
     def set_port(self, port):
         self.port_number = port
-
-    # Function for getting timout in ms
-    def get_timeout(self):
-        return self.timeout
-
-    # Function for setting timeout in ms
-    def set_timeout(self, new_timeout):
-        self.timeout = new_timeout
-
-    # Function to set debug state
-    def set_debug(self, state=True):
-        self.debug = state
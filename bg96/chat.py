@@ -0,0 +1,55 @@
+'''
+  Dial a PPP connection by running a chat script, as pppd's connect program.
+  ---
+  Takes the place of /usr/sbin/chat: pppd runs it with the modem's port as
+  its standard input and output, and starts PPP when it exits with 0. The
+  port is used as pppd set it up, its speed and flow control unchanged. The
+  exit codes are chat's: 0 connected, 2 failed, 3 timed out, and 4 onwards
+  for the first ABORT string onwards. Lines matching REPORT strings and,
+  with -v, each step's timing go to standard error, which pppd logs.
+
+  Usage, in a pppd options file, eg. ppp/twilio:
+      connect "python3 /home/pi/cellular-iot/bg96/chat.py -v -f /etc/chatscripts/twilio"
+'''
+
+from cellulariot import *
+import chatscript
+import argparse
+import sys
+
+# The modem's port is standard output, so anything printed goes to standard error instead
+sys.stdout = sys.stderr
+
+parser = argparse.ArgumentParser(description="Run a chat script on the BG96")
+parser.add_argument("-f", dest="file", required=True, help="chat script to run")
+parser.add_argument("-t", dest="timeout", type=float, help="timeout, in seconds, until the script sets one")
+parser.add_argument("-v", dest="verbose", action="store_true", help="report each step's timing")
+parser.add_argument("port", nargs="?", default="fd://0", help="modem's port; by default pppd's, on standard input")
+args = parser.parse_args()
+
+script = chatscript.load(args.file)
+if args.timeout is not None:
+    script.timeout = args.timeout
+
+# Set up the modem. It is already running, as pppd has opened its port
+modem = CellularIoT(args.port)
+modem.set_debug(False)
+try:
+    state, response = script.run(modem)
+except Exception as exp:
+    print("chat.py:", exp)
+    sys.exit(2)
+
+for line in script.reports:
+    print(line)
+if args.verbose:
+    for command, result, ms in script.steps:
+        print(command.ljust(32), result.ljust(8), str(ms).rjust(6), "ms")
+
+if state == "OK":
+    sys.exit(0)
+if state == "TIMEOUT":
+    print("chat.py: timed out:", response.strip())
+    sys.exit(3)
+print("chat.py: aborted:", response.strip())
+sys.exit(4 + script.aborted if script.aborted is not None else 2)
@@ -1,29 +1,25 @@
 from cellulariot import *
+from outbox import Outbox
 import time
 import sys
+import os
 import json
 
 
-# Process the ISS data: lat and long
-def process_iss_data(modem_response):
-    # 'modem_response' is a string, eg. "+QHTTPGET: 0,200,22323"
-    # Check for HTTP error code, the
-    response = modem_response.split(": ")
-    response = response[1].split(",")
-
-    if response[0] == "0":
-        # Got a good response from the server,
-        # so read it back from the modem
-        result = modem.send_command("AT+QHTTPREAD", "OK")
-        if result[0] == "OK":
-            received_data = result[1].split("\r\n")[2]
-            iss_data = json.loads(received_data)
-            if iss_data["message"] == "success":
-                print("ISS is at",iss_data["iss_position"]["longitude"],",",iss_data["iss_position"]["latitude"])
-                return
+# Process the ISS data: lat and long. Returns a record of the reading for the outbox
+def process_iss_data(result):
+    # 'result' is the session's response, eg. ("OK", 200, "{...}")
+    # Check for HTTP error code
+    if result[0] == "OK" and result[1] == 200:
+        # Got a good response from the server
+        iss_data = json.loads(result[2])
+        if iss_data["message"] == "success":
+            print("ISS is at",iss_data["iss_position"]["longitude"],",",iss_data["iss_position"]["latitude"])
+            return {"time": time.time(), "position": iss_data["iss_position"]}
 
     # Display error message
     print("ISS location not retrieved")
+    return {"time": time.time(), "error": result[0]}
 
 
 # Set up the modem
@@ -35,39 +31,28 @@ modem.send_command("ATE0")
 
 # URL of the data source
 source_url = "http://api.open-notify.org/iss-now.json"
-conn_open = False
-
-while True:
-    try:
-        # Open a data connection
-        modem.activate_context()
-        conn_open = True
 
-        # Assemble the HTTP request
-        # 1. Set the PDP Context ID
-        modem.send_command("AT+QHTTPCFG=\"contextid\",1")
+# Keep the data connection open between requests;
+# close it only if it goes unused for five minutes
+session = modem.http_session(idle_timeout=300)
 
-        # 2. Choose no custom headers
-        modem.send_command("AT+QHTTPCFG=\"requestheader\",0")
-
-        # 3. Set the URL parameters: length and timeout
-        modem.send_command("AT+QHTTPURL=" + str(len(source_url)) + ",80", "CONNECT", 30)
-
-        # 4. Set the URL as data
-        modem.send_data(source_url)
+# Queue the readings on disk; if $ISS_UPLOAD_URL is set, they are
+# posted there in batches, and kept while the upload fails
+outbox = Outbox(os.path.join(os.path.expanduser("~"), ".cellular-iot", "outbox"))
+upload_url = os.environ.get("ISS_UPLOAD_URL")
 
+while True:
+    try:
         # Make the GET request and parse the result
-        result = modem.send_command("AT+QHTTPGET", "+QHTTPGET", 120)
-        if result[0] == "OK":
-            process_iss_data(result[1])
+        outbox.put(json.dumps(process_iss_data(session.get(source_url))))
 
-        # Close the data connection
-        modem.deactivate_context()
-        conn_open = False
+        # Send whatever is queued
+        if upload_url is not None:
+            print("Uploaded",session.upload(outbox, upload_url),"readings")
 
         # Pause 1 minute
-        time.sleep(60)
+        session.wait(60)
     except KeyboardInterrupt:
-        if conn_open:
-            modem.deactivate_context()
+        session.close()
+        outbox.close()
         sys.exit()
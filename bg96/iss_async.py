@@ -0,0 +1,46 @@
+from async_cellulariot import *
+import asyncio
+import json
+
+
+# Fetch the ISS position once a minute without blocking the event loop
+async def main():
+    # Set up the modem
+    modem = AsyncCellularIoT()
+    await modem.boot()
+    modem.set_debug(False)
+    # Turn off echoing (easier to parse responses)
+    await modem.command("ATE0")
+
+    # URL of the data source
+    source_url = "http://api.open-notify.org/iss-now.json"
+
+    try:
+        while True:
+            # Open a data connection
+            await modem.activate_context()
+
+            # Make the GET request and parse the result
+            result = await modem.http_get(source_url)
+            iss_data = None
+            if result[0] == "OK" and result[1] == 200:
+                iss_data = json.loads(result[2])
+            if iss_data is not None and iss_data["message"] == "success":
+                print("ISS is at",iss_data["iss_position"]["longitude"],",",iss_data["iss_position"]["latitude"])
+            else:
+                print("ISS location not retrieved")
+
+            # Close the data connection
+            await modem.deactivate_context()
+
+            # Pause 1 minute
+            await asyncio.sleep(60)
+    finally:
+        await modem.deactivate_context()
+        modem.close()
+
+
+try:
+    asyncio.run(main())
+except KeyboardInterrupt:
+    pass
@@ -0,0 +1,358 @@
+'''
+  TCP and UDP connections for the BG96.
+  ---
+  A socket-like, file-like connection over AT+QIOPEN, AT+QISEND,
+  AT+QIRD and AT+QICLOSE. Writes are buffered up to the largest block
+  AT+QISEND takes; when the modem reports data with +QIURC: "recv",
+  reads fetch all it holds, in the largest blocks AT+QIRD returns. Up
+  to twelve connections may be open at once, each on its own connect
+  ID. A connection opens in buffer access mode and can be switched to
+  transparent access, where the serial port carries its data directly,
+  and back. The first connection turns the modem's echo off, if it is
+  on, as echoed data would be mistaken for the modem's; it stays off for
+  every other user of the modem.
+
+  Usage:
+      connection = modem.open_socket("telemetry.example.com", 7000)
+      connection.write(b"reading=42\n")
+      connection.flush()
+      print(connection.readline(timeout=10))
+      connection.close()
+'''
+
+import os
+import sys
+import threading
+
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from responsebuffer import ResponseBuffer
+
+
+class BG96Socket:
+
+    modem = None
+    connect_id = None
+    context_id = 1
+    protocol = "TCP"
+    transparent = False # see set_transparent()
+    closed = True
+    remote_closed = False # set by +QIURC: "closed"
+    send_timeout = 10 # Seconds, for SEND OK
+
+    # Largest blocks AT+QISEND takes and AT+QIRD returns
+    MAX_SEND_SIZE = 1460
+    MAX_READ_SIZE = 1500
+
+    # Number of connect IDs
+    MAX_CONNECTIONS = 12
+
+    # Seconds of silence needed either side of the +++ that leaves transparent access
+    ESCAPE_GUARD = 1
+
+    # Initializer function
+    def __init__(self, modem, context_id=1):
+        self.modem = modem
+        self.context_id = context_id
+        self.tx_buffer = bytearray()
+        self.rx_buffer = ResponseBuffer()
+        # Set when the modem reports data waiting, or the connection closing
+        self.readable = threading.Event()
+        # Set by the +QIOPEN URC, whose result is kept in open_error
+        self.opened = threading.Event()
+        self.open_error = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    # Function for opening a connection to 'host', a name or an address.
+    # 'protocol' is "TCP" or "UDP". Raises IOError if the connection fails and
+    # TimeoutError if the modem doesn't report the result within 'timeout' seconds
+    def connect(self, host, port, protocol="TCP", timeout=150):
+        self.protocol = protocol.upper()
+        self.register()
+        result = self.modem.send_command("AT+QIOPEN=" + str(self.context_id) + "," + str(self.connect_id)
+                                         + ",\"" + self.protocol + "\",\"" + host + "\"," + str(port) + ",0,0")
+        if result[0] != "OK":
+            self.unregister()
+            raise IOError("AT+QIOPEN failed: " + result[1].strip())
+        if not self.opened.wait(timeout) or self.open_error != 0:
+            # The connect ID must be closed even though it never opened
+            self.modem.send_command("AT+QICLOSE=" + str(self.connect_id))
+            self.unregister()
+            if self.open_error is None:
+                raise TimeoutError("No +QIOPEN from modem")
+            raise IOError("Connection to " + host + ":" + str(port) + " failed: error " + str(self.open_error))
+        self.closed = False
+        self.remote_closed = False
+        self.modem.debug_print("Connection " + str(self.connect_id) + " open to " + host + ":" + str(port))
+
+    # Function for claiming the lowest free connect ID and routing its URCs here
+    def register(self):
+        modem = self.modem
+        with modem.lock:
+            if modem.sockets is None:
+                modem.sockets = {}
+                modem.on_urc("+QIURC", lambda line: route_urc(modem, line))
+                modem.on_urc("+QIOPEN", lambda line: route_urc(modem, line))
+                # Echoed data would be taken for the modem's responses, so echo is
+                # turned off if it is on. This is for the modem, not just this socket
+                if modem.send_command("AT")[1].lstrip().startswith("AT"):
+                    modem.send_command("ATE0")
+            free = [index for index in range(self.MAX_CONNECTIONS) if index not in modem.sockets]
+            if len(free) == 0:
+                raise IOError("No free connect ID")
+            self.connect_id = free[0]
+            modem.sockets[self.connect_id] = self
+        self.opened.clear()
+        self.open_error = None
+
+    # Function for giving up the connect ID
+    def unregister(self):
+        with self.modem.lock:
+            if self.modem.sockets is not None and self.modem.sockets.get(self.connect_id) is self:
+                del self.modem.sockets[self.connect_id]
+
+    # Function for handling a URC for this connection: called on the URC dispatcher's thread,
+    # so it only records what happened
+    def handle_urc(self, kind, fields):
+        if kind == "+QIOPEN":
+            self.open_error = int(fields[1]) if len(fields) > 1 else -1
+            self.opened.set()
+        elif kind == "recv":
+            self.readable.set()
+        elif kind in ("closed", "pdpdeact"):
+            self.remote_closed = True
+            self.readable.set()
+
+    # Function for writing data, str or bytes. TCP data is buffered until a full
+    # block can be sent or flush() is called; each UDP write is sent at once as
+    # one datagram. Returns the number of bytes written
+    def write(self, data):
+        self.check_open()
+        if isinstance(data, str):
+            data = data.encode()
+        if self.transparent:
+            self.modem.trace.tx(data)
+            self.modem.uart.write(data)
+            return len(data)
+        if self.protocol == "UDP":
+            self.send_block(bytes(data))
+            return len(data)
+        self.tx_buffer += data
+        while len(self.tx_buffer) >= self.MAX_SEND_SIZE:
+            self.send_block(bytes(self.tx_buffer[:self.MAX_SEND_SIZE]))
+            del self.tx_buffer[:self.MAX_SEND_SIZE]
+        return len(data)
+
+    # Function for writing all of 'data', eg. a whole message, and sending it at once
+    def sendall(self, data):
+        self.write(data)
+        self.flush()
+
+    # Function for sending any buffered data
+    def flush(self):
+        if len(self.tx_buffer) > 0 and not self.transparent:
+            self.send_block(bytes(self.tx_buffer))
+            self.tx_buffer = bytearray()
+
+    # Function for sending one block with AT+QISEND. Raises IOError if it fails
+    def send_block(self, block):
+        while len(block) > 0:
+            chunk = block[:self.MAX_SEND_SIZE]
+            block = block[self.MAX_SEND_SIZE:]
+            # Nothing else may reach the modem between the prompt and the data
+            with self.modem.lock:
+                result = self.modem.send_command("AT+QISEND=" + str(self.connect_id) + "," + str(len(chunk)), ">")
+                if result[0] != "OK":
+                    raise IOError("AT+QISEND failed: " + result[1].strip())
+                # The result is SEND OK, or SEND FAIL if the modem's send buffer is full
+                result = self.modem.send_data(chunk, "SEND", self.send_timeout)
+            if result[0] != "OK" or result[1].find("SEND OK") == -1:
+                raise IOError("Send failed: " + result[1].strip())
+
+    # Function for reading up to 'size' bytes, waiting up to 'timeout' seconds, or
+    # for ever if None, for some to arrive. Returns b"" once the connection has
+    # closed and everything received has been read. Raises TimeoutError if nothing arrives
+    def recv(self, size=MAX_READ_SIZE, timeout=None):
+        deadline = None if timeout is None else self.modem.millis() + int(timeout * 1000)
+        if len(self.rx_buffer) == 0 and not self.receive(deadline):
+            return b""
+        return self.rx_buffer.take(size)
+
+    # Function for reading 'size' bytes, or with a negative size everything until
+    # the connection closes. Fewer bytes are returned if the connection closes or,
+    # once some have arrived, the timeout (in seconds) expires first. Raises
+    # TimeoutError if nothing arrives in time
+    def read(self, size=-1, timeout=None):
+        deadline = None if timeout is None else self.modem.millis() + int(timeout * 1000)
+        while size < 0 or len(self.rx_buffer) < size:
+            try:
+                if not self.receive(deadline):
+                    break
+            except TimeoutError:
+                if len(self.rx_buffer) == 0:
+                    raise
+                break
+        return self.rx_buffer.take_all() if size < 0 else self.rx_buffer.take(size)
+
+    # Function for reading a line, up to and including its '\n'. The rest of the
+    # data is returned if the connection closes first
+    def readline(self, timeout=None):
+        deadline = None if timeout is None else self.modem.millis() + int(timeout * 1000)
+        while True:
+            line = self.rx_buffer.take_until(b"\n")
+            if line is not None:
+                return line
+            if not self.receive(deadline):
+                return self.rx_buffer.take_all()
+
+    # Function for adding more received data to the buffer, waiting until the
+    # deadline (from millis()), or for ever if it is None, for some to arrive.
+    # Returns False at the end of the stream. Raises TimeoutError if the deadline passes
+    def receive(self, deadline):
+        while True:
+            remaining = None if deadline is None else max(0, deadline - self.modem.millis()) / 1000.0
+            if self.transparent:
+                data = self.modem.read_bytes(1, remaining)
+                if len(data) == 0:
+                    raise TimeoutError("Socket read timed out")
+                data += self.modem.read_bytes(self.MAX_READ_SIZE, 0)
+                # The modem leaves transparent access by itself if the connection closes
+                if data.endswith(b"\r\nNO CARRIER\r\n"):
+                    data = data[:-14]
+                    self.leave_transparent()
+                    self.remote_closed = True
+                self.rx_buffer.append(data)
+                return len(data) > 0 or not self.remote_closed
+            if self.readable.is_set():
+                if self.fetch() > 0:
+                    return True
+                continue
+            if self.remote_closed or self.closed:
+                return False
+            if remaining is not None and remaining <= 0:
+                raise TimeoutError("Socket read timed out")
+            self.readable.wait(remaining)
+
+    # Function for reading everything the modem holds for the connection into the
+    # receive buffer, with AT+QIRD. Returns the number of bytes read
+    def fetch(self):
+        # Cleared first, so a +QIURC arriving meanwhile isn't missed
+        self.readable.clear()
+        command = "AT+QIRD=" + str(self.connect_id) + "," + str(self.MAX_READ_SIZE)
+        timeout = self.modem.get_command_timeout(command)
+        total = 0
+        while True:
+            self.modem.hold_input(command)
+            try:
+                # The modem sends +QIRD: <length><CR><LF><data><CR><LF><CR><LF>OK<CR><LF>
+                result = self.modem.send_command(command, "+QIRD:")
+                if result[0] != "OK" and self.remote_closed:
+                    # Nothing is left to read from a closed connection
+                    return total
+                if result[0] != "OK":
+                    raise IOError("AT+QIRD failed: " + result[1].strip())
+                # UDP reads add the sender's address after the length
+                length = int(result[1][result[1].find("+QIRD: ") + 7:].split("\r\n")[0].split(",")[0])
+                data = self.modem.read_bytes(length, timeout) if length > 0 else b""
+                if len(data) < length:
+                    raise TimeoutError("Socket read timed out")
+                while True:
+                    line = self.modem.read_line(timeout)
+                    if len(line) == 0:
+                        raise TimeoutError("Socket read timed out")
+                    if line.strip() == "OK":
+                        break
+            finally:
+                self.modem.release_input()
+            if length == 0:
+                return total
+            self.rx_buffer.append(data)
+            total += length
+
+    # Function for switching between buffer access (False), where data goes through
+    # AT+QISEND and AT+QIRD, and transparent access (True), where the serial port
+    # carries the connection's data directly. While transparent, the modem takes no
+    # commands, so this thread keeps it until transparent access is left
+    def set_transparent(self, state=True):
+        self.check_open()
+        if state == self.transparent:
+            return
+        if state:
+            # Send what is buffered; data the modem holds follows CONNECT
+            self.flush()
+            self.modem.hold_input("AT+QISWTMD")
+            try:
+                result = self.modem.send_command("AT+QISWTMD=" + str(self.connect_id) + ",2", "CONNECT")
+            except Exception:
+                self.modem.release_input()
+                raise
+            if result[0] != "OK":
+                self.modem.release_input()
+                raise IOError("AT+QISWTMD failed: " + result[1].strip())
+            self.transparent = True
+        else:
+            self.modem.delay(self.ESCAPE_GUARD * 1000)
+            self.modem.trace.tx(b"+++")
+            self.modem.uart.write(b"+++")
+            # Data received before the escape is the connection's
+            data = self.modem.read_until(b"\r\nOK\r\n", self.ESCAPE_GUARD + self.modem.timeout)
+            if data.endswith(b"\r\nOK\r\n"):
+                data = data[:-6]
+            self.rx_buffer.append(data)
+            self.leave_transparent()
+            self.modem.send_command("AT+QISWTMD=" + str(self.connect_id) + ",0")
+
+    # Function for handing the modem back after transparent access
+    def leave_transparent(self):
+        self.transparent = False
+        self.modem.release_input()
+        # Data that arrives now waits in the modem, which may not report it
+        self.readable.set()
+
+    # Function for closing the connection, sending any buffered data first
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self.transparent:
+                self.set_transparent(False)
+            if not self.remote_closed:
+                self.flush()
+        finally:
+            self.closed = True
+            self.modem.send_command("AT+QICLOSE=" + str(self.connect_id))
+            self.unregister()
+            self.readable.set()
+
+    # Function for checking the connection can be written to
+    def check_open(self):
+        if self.closed or self.remote_closed:
+            raise IOError("Connection closed")
+
+
+# Function for passing a +QIURC or +QIOPEN URC to the connection it is for, eg.
+# '+QIURC: "recv",1', '+QIURC: "closed",1', '+QIURC: "pdpdeact",1' or '+QIOPEN: 1,0'
+def route_urc(modem, line):
+    name, values = line.split(": ", 1)
+    fields = [field.strip().strip("\"") for field in values.split(",")]
+    if name == "+QIOPEN":
+        kind = name
+        connect_id = fields[0]
+    elif len(fields) > 1:
+        kind = fields[0]
+        connect_id = fields[1]
+    else:
+        return
+    sockets = modem.sockets or {}
+    if kind == "pdpdeact":
+        # Every connection on the context is closed
+        targets = [item for item in list(sockets.values()) if str(item.context_id) == connect_id]
+    else:
+        targets = [sockets.get(int(connect_id))] if connect_id.isdigit() else []
+    for target in targets:
+        if target is not None:
+            target.handle_urc(kind, fields)
@@ -0,0 +1,38 @@
+from cellulariot import *
+import subprocess
+import time
+import sys
+
+# Set up the modem
+modem = CellularIoT()
+modem.boot()
+modem.set_debug(False)
+
+# Multiplex the serial port: PPP runs on channel 1, through the link named
+# in ppp/twilio-cmux, and this script's AT commands on channel 2
+mux = modem.start_mux(links={modem.MUX_DATA_CHANNEL: "/dev/ttyCMUX1"})
+
+# Turn off echoing (easier to parse responses) on the new channel
+modem.send_command("ATE0")
+
+# Bring up the PPP link (ppp/twilio-cmux copied to /etc/ppp/peers)
+subprocess.call(["pon", "twilio-cmux"])
+
+while True:
+    try:
+        # The modem still answers AT commands while the link is up
+        result = modem.send_command("AT+CSQ")
+        if result[0] == "OK":
+            print(result[1].split("\r\n")[1])
+        result = modem.send_command("AT+QNWINFO")
+        if result[0] == "OK":
+            print(result[1].split("\r\n")[1])
+        channel = mux.channels[modem.MUX_DATA_CHANNEL]
+        print("PPP bytes in:",channel.bytes_in,"out:",channel.bytes_out)
+
+        # Pause 1 minute
+        time.sleep(60)
+    except KeyboardInterrupt:
+        subprocess.call(["poff", "twilio-cmux"])
+        modem.stop_mux()
+        sys.exit()
@@ -0,0 +1,109 @@
+'''
+  asyncio AT command transport shared by the cellular modem drivers.
+  ---
+  The asyncio counterpart of CellularModem: sends commands and data and
+  routes URCs through an AsyncATTransport, without blocking the event
+  loop. Each driver combines AsyncCellularModem with its modem's profile
+  (see modemprofile), which declares the dialect and pins, so the sync
+  and asyncio drivers share their tables and configuration logic but not
+  their methods. Every method that talks to the modem is a coroutine.
+'''
+
+import asyncio
+import atbatch
+from modemprofile import ModemProfile
+from asynctransport import AsyncATTransport
+
+
+class AsyncCellularModem(ModemProfile):
+
+    transport_device = None # see transport
+
+    # Initializer function
+    # The arguments are as for ModemProfile: neither the port nor the GPIO library
+    # is touched until first used
+    def __init__(self, serial_port=None, serial_baudrate=None, rtscts=None, dsrdtr=False, gpio_backend=None):
+        super().__init__(serial_port, serial_baudrate, rtscts, dsrdtr, gpio_backend)
+        self.debug_print(self.__class__.__name__ + " class instantiated")
+
+    # The AsyncATTransport, created with the serial port when first used
+    @property
+    def transport(self):
+        if self.transport_device is None:
+            self.transport_device = AsyncATTransport(self.create_serial(), self.URC_PREFIXES, self.debug_print, self.trace)
+        return self.transport_device
+
+    # Function for closing the serial port and releasing the pins this instance claimed
+    def close(self):
+        if self.transport_device is not None:
+            self.transport_device.close()
+        self.release_pins()
+
+    # Function for sending an AT command and awaiting the response.
+    # Returns ("OK", response), ("ERROR", response) or ("TIMEOUT", response)
+    async def command(self, command, desired_response="OK\r\n", timeout=None):
+        if timeout is None:
+            timeout = self.get_command_timeout(command)
+        return await self.transport.command(command, desired_response, timeout)
+
+    # Function for sending an AT command; an alias of command()
+    async def send_command(self, command, desired_response="OK\r\n", timeout=None):
+        return await self.command(command, desired_response, timeout)
+
+    # Function for sending data, eg. after a CONNECT or '>' prompt, and awaiting the response
+    async def send_data(self, data, desired_response="OK\r\n", timeout=None):
+        if timeout is None:
+            timeout = self.timeout
+        return await self.transport.send_data(data, desired_response, timeout)
+
+    # Function for sending a command whose response carries data after the line
+    # containing 'header', which 'reader', a coroutine function, reads from the
+    # transport. See AsyncATTransport.read_data()
+    async def read_data(self, command, header, reader, timeout=None):
+        if timeout is None:
+            timeout = self.get_command_timeout(command)
+        return await self.transport.read_data(command, header, reader, timeout)
+
+    # Function for waiting until the modem answers AT, eg. while it starts, polling
+    # until the deadline (from millis()). Raises asyncio.TimeoutError if it doesn't
+    async def wait_until_ready(self, deadline):
+        while True:
+            result = await self.command("AT")
+            if result[0] == "OK":
+                return
+            if self.millis() > deadline:
+                raise asyncio.TimeoutError(self.__class__.__name__ + " did not respond")
+            await asyncio.sleep(0.1)
+
+    # Function for sending several AT commands in as few round trips as possible,
+    # as CellularModem.send_batch() does. Returns one result per command, in order
+    async def send_batch(self, commands):
+        results = []
+        for group in atbatch.group_commands(commands, self.NO_CHAIN_COMMANDS, self.MAX_LINE_LENGTH):
+            if len(group) == 1:
+                if isinstance(group[0], str):
+                    results.append(await self.command(group[0]))
+                else:
+                    results.append(await self.command(*group[0]))
+                continue
+            timeout = sum([self.get_command_timeout(command) for command in group])
+            result = await self.command(atbatch.join_commands(group), timeout=timeout)
+            if result[0] == "OK":
+                results.extend(atbatch.split_response(group, result[1]))
+            else:
+                # The modem stops at the first failing command, so send the group one by one
+                for command in group:
+                    results.append(await self.command(command))
+        return results
+
+    # Function for awaiting a URC, eg. "+CMTI". Returns None on timeout
+    async def wait_for_urc(self, prefix, timeout=None):
+        return await self.transport.wait_for_urc(prefix, timeout)
+
+    # Function for getting an asyncio.Queue that receives every URC with the given prefix
+    def urc_queue(self, prefix):
+        return self.transport.urc_queue(prefix)
+
+    # Function for registering a callback for a URC
+    def on_urc(self, prefix, callback):
+        self.transport.on_urc(prefix, callback)
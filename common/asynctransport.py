@@ -0,0 +1,316 @@
+'''
+  Non-blocking AT command transport for asyncio.
+  ---
+  Registers the modem's serial port with the event loop so bytes are read
+  only when the port is readable, then frames them into lines which are
+  passed to the command in flight or, for unsolicited result codes (URCs),
+  to awaiting coroutines, queues and callbacks. Responses that carry data,
+  eg. a file or an HTTP body, are read as raw bytes with read_data().
+'''
+
+import asyncio
+import time
+from responsebuffer import ResponseBuffer
+
+
+class AsyncATTransport:
+
+    port = None
+    loop = None
+    raw = False # whether input is held as bytes for read_data()'s reader
+    raw_header = None # line that switches the input to raw, see read_data()
+
+    # Data prompts, which arrive without a line ending
+    PROMPTS = (b">",)
+
+    # Most URCs a urc_queue() holds: when it is full the oldest is dropped
+    QUEUE_SIZE = 32
+
+    # Initializer function
+    # 'port' is a configured, but not necessarily open, pyserial port. 'trace' is
+    # a wiretrace.WireTrace to record the traffic in, if any
+    def __init__(self, port, prefixes=(), log=None, trace=None):
+        self.port = port
+        self.prefixes = list(prefixes)
+        self.log = log
+        self.trace = trace
+        self.buffer = ResponseBuffer()
+        self.lines = None
+        self.command_name = None
+        self.desired_response = b"OK\r\n"
+        self.lock = None
+        self.readable = None
+        self.callbacks = {}
+        self.queues = {}
+        self.waiters = {}
+
+    # Function for opening the port and attaching it to the running event loop
+    async def open(self):
+        if self.loop is not None:
+            return
+        self.loop = asyncio.get_running_loop()
+        self.lines = asyncio.Queue()
+        self.lock = asyncio.Lock()
+        self.readable = asyncio.Event()
+        if self.port.isOpen() is False:
+            self.port.open()
+        # Never block the loop on a read
+        self.port.timeout = 0
+        self.port.reset_input_buffer()
+        self.loop.add_reader(self.port.fileno(), self.on_readable)
+
+    # Function for detaching the port from the event loop and closing it
+    def close(self):
+        if self.loop is not None:
+            self.loop.remove_reader(self.port.fileno())
+            self.loop = None
+        if self.port.isOpen():
+            self.port.close()
+
+    # Function for getting time in milliseconds from the monotonic clock
+    def millis(self):
+        return int(time.monotonic() * 1000)
+
+    # Function for sending an AT command and awaiting its result code.
+    # Returns ("OK", response), ("ERROR", response) or ("TIMEOUT", response).
+    # Cancelling the awaiting task releases the channel for the next command
+    async def command(self, command, desired_response="OK\r\n", timeout=3):
+        return await self.transact(str(command) + "\r", command, desired_response, timeout)
+
+    # Function for sending raw data, eg. after a CONNECT prompt, and awaiting the result.
+    # Bytes are written as they are; anything else is sent as text
+    async def send_data(self, data, desired_response="OK\r\n", timeout=3):
+        if not isinstance(data, (bytes, bytearray)):
+            data = str(data)
+        return await self.transact(data, None, desired_response, timeout)
+
+    # Function for writing a command or data and collecting response lines until
+    # the desired response, an error or the deadline is reached
+    async def transact(self, data, command, desired_response, timeout):
+        await self.open()
+        async with self.lock:
+            self.begin_command(command, desired_response)
+            state = "TIMEOUT"
+            if self.trace is not None:
+                self.trace.begin()
+            try:
+                self.write(data)
+                state, lines = await self.collect(desired_response, timeout)
+            finally:
+                self.command_name = None
+                if self.trace is not None:
+                    self.trace.end(state)
+            # Decode the response once, now it is complete; it is in the trace
+            response = b"".join(lines).decode('utf-8', errors='ignore')
+            return (state, response)
+
+    # Function for sending a command whose response carries data after the line
+    # containing 'header', eg. "CONNECT". Input after that line is held as raw bytes
+    # for 'reader', a coroutine function called with the line that reads the data
+    # with read_bytes() and read_line(). Returns ("OK", what reader returns), or
+    # ("ERROR", response) or ("TIMEOUT", response) if the header doesn't arrive
+    async def read_data(self, command, header, reader, timeout=3):
+        await self.open()
+        async with self.lock:
+            self.begin_command(command, header)
+            self.raw_header = header.encode()
+            state = "TIMEOUT"
+            if self.trace is not None:
+                self.trace.begin()
+            try:
+                self.write(str(command) + "\r")
+                state, lines = await self.collect(header, timeout)
+                if state != "OK":
+                    return (state, b"".join(lines).decode('utf-8', errors='ignore'))
+                try:
+                    return ("OK", await reader(lines[-1]))
+                except Exception:
+                    state = "ERROR"
+                    raise
+            finally:
+                self.command_name = None
+                self.raw_header = None
+                self.raw = False
+                if self.trace is not None:
+                    self.trace.end(state)
+                # Whatever the reader left is framed into lines again
+                self.process_buffer()
+
+    # Function for reading 'count' raw bytes in read_data()'s reader.
+    # Returns fewer bytes if 'timeout' seconds pass first
+    async def read_bytes(self, count, timeout=3):
+        deadline = self.millis() + int(timeout * 1000)
+        while len(self.buffer) < count and await self.wait_readable(deadline):
+            pass
+        return self.buffer.take(count)
+
+    # Function for reading a raw line, up to and including its line feed, in
+    # read_data()'s reader. Returns what has arrived if 'timeout' seconds pass first
+    async def read_line(self, timeout=3):
+        deadline = self.millis() + int(timeout * 1000)
+        while True:
+            line = self.buffer.take_until(b"\n")
+            if line is not None:
+                return line
+            if not await self.wait_readable(deadline):
+                return self.buffer.take_all()
+
+    # Function for waiting until the deadline (from millis()) for more raw input.
+    # Returns False if none arrives in time
+    async def wait_readable(self, deadline):
+        remaining = deadline - self.millis()
+        if remaining <= 0:
+            return False
+        self.readable.clear()
+        try:
+            await asyncio.wait_for(self.readable.wait(), remaining / 1000.0)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    # Function for writing a command or data, str or bytes, for the command in flight
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        if self.trace is not None:
+            self.trace.tx(data)
+        self.port.write(data)
+
+    # Function for collecting response lines until one contains 'desired_response',
+    # one contains ERROR or 'timeout' seconds pass. Returns (state, lines)
+    async def collect(self, desired_response, timeout):
+        lines = []
+        deadline = self.millis() + int(timeout * 1000)
+        desired = desired_response.encode()
+        while True:
+            remaining = deadline - self.millis()
+            if remaining <= 0:
+                return ("TIMEOUT", lines)
+            try:
+                line = await asyncio.wait_for(self.lines.get(), remaining / 1000.0)
+            except asyncio.TimeoutError:
+                continue
+            lines.append(line)
+            if line.find(desired) != -1:
+                return ("OK", lines)
+            if line.find(b"ERROR") != -1:
+                return ("ERROR", lines)
+
+    # Function for discarding stale lines and recording the command in flight
+    def begin_command(self, command, desired_response="OK\r\n"):
+        while not self.lines.empty():
+            self.lines.get_nowait()
+        self.desired_response = desired_response.encode()
+        self.command_name = ""
+        if command is not None:
+            name = str(command).strip().upper().split("=")[0].split("?")[0]
+            if name.startswith("AT+"):
+                self.command_name = name[2:]
+
+    # Function for awaiting a URC with the given prefix.
+    # Returns the URC line, or None if 'timeout' seconds pass first
+    async def wait_for_urc(self, prefix, timeout=None):
+        await self.open()
+        self.add_prefix(prefix)
+        waiter = self.loop.create_future()
+        self.waiters.setdefault(prefix, []).append(waiter)
+        try:
+            return await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            if waiter in self.waiters.get(prefix, []):
+                self.waiters[prefix].remove(waiter)
+
+    # Function for getting an asyncio.Queue that receives every URC with the given
+    # prefix. It holds the latest QUEUE_SIZE of them
+    def urc_queue(self, prefix):
+        self.add_prefix(prefix)
+        if prefix not in self.queues:
+            self.queues[prefix] = asyncio.Queue(maxsize=self.QUEUE_SIZE)
+        return self.queues[prefix]
+
+    # Function for registering a callback, called on the event loop, for a URC prefix
+    def on_urc(self, prefix, callback):
+        self.add_prefix(prefix)
+        self.callbacks.setdefault(prefix, []).append(callback)
+
+    # Function for adding a URC prefix to watch for
+    def add_prefix(self, prefix):
+        if prefix not in self.prefixes:
+            self.prefixes.append(prefix)
+
+    # Event loop reader callback: called only when the port has data
+    def on_readable(self):
+        try:
+            data = self.port.read(max(1, self.port.in_waiting))
+        except Exception as exp:
+            self.print_log(exp)
+            return
+        if self.trace is not None and len(data) > 0:
+            self.trace.rx(data)
+        self.buffer.append(data)
+        self.process_buffer()
+
+    # Function for passing the complete lines in the buffer on, or, in raw mode,
+    # waking read_data()'s reader
+    def process_buffer(self):
+        while not self.raw:
+            line = self.buffer.take_until(b"\n")
+            if line is None:
+                break
+            self.process_line(line)
+        if self.raw:
+            self.readable.set()
+            return
+        # Data prompts arrive without a line ending
+        if self.command_name is not None and self.desired_response in self.PROMPTS and len(self.buffer) > 0:
+            pending = self.buffer.take_all()
+            if pending.find(self.desired_response) != -1:
+                self.process_line(pending)
+            else:
+                self.buffer.append(pending)
+
+    # Function for routing a complete line to the command in flight and/or URC listeners
+    def process_line(self, line):
+        in_command = self.command_name is not None
+        prefix = None
+        stripped = line.strip()
+        for candidate in self.prefixes:
+            if stripped.startswith(candidate.encode()):
+                prefix = candidate
+                break
+        if prefix is not None:
+            solicited = in_command and len(self.command_name) > 0 and prefix == self.command_name
+            if not solicited:
+                self.dispatch(prefix, stripped.decode('utf-8', errors='ignore'))
+        if in_command:
+            self.lines.put_nowait(line)
+            if self.raw_header is not None and line.find(self.raw_header) != -1:
+                # The rest is data, held for read_data()'s reader
+                self.raw = True
+                self.command_name = None
+            elif line.find(self.desired_response) != -1 or line.find(b"ERROR") != -1:
+                # Final result: anything after this is unsolicited
+                self.command_name = None
+
+    # Function for passing a URC to its waiters, queues and callbacks
+    def dispatch(self, prefix, line):
+        self.print_log("URC: " + line)
+        for waiter in self.waiters.pop(prefix, []):
+            if not waiter.done():
+                waiter.set_result(line)
+        if prefix in self.queues:
+            if self.queues[prefix].full():
+                self.queues[prefix].get_nowait()
+            self.queues[prefix].put_nowait(line)
+        for callback in list(self.callbacks.get(prefix, [])):
+            try:
+                callback(line)
+            except Exception as exp:
+                self.print_log(exp)
+
+    # Function for outputting log messages
+    def print_log(self, message):
+        if self.log is not None:
+            self.log(message)
@@ -0,0 +1,102 @@
+'''
+  AT command chaining helpers for the cellular modem drivers.
+  ---
+  Extended-syntax commands can be concatenated into a single command
+  line, eg. 'AT+QCFG="nwscanseq",00,1;+QCFG="iotopmode",2,1', which the
+  modem executes in order, returning one final result code. These
+  helpers group a list of commands into such lines and split the modem's
+  combined response back into per-command results.
+'''
+
+# Default maximum length of a chained command line, including the 'AT' prefix
+MAX_LINE_LENGTH = 256
+
+
+# Function for getting the name of a command, eg. '+QCFG' from 'AT+QCFG="band"'
+def command_name(command):
+    name = str(command).strip().upper()
+    if name.startswith("AT"):
+        name = name[2:]
+    for separator in "=?":
+        name = name.split(separator)[0]
+    return name
+
+
+# Function for getting the key used to match information lines to a command:
+# its name plus its first parameter when that is a quoted string, so that
+# '+QCFG: "band",...' is matched to 'AT+QCFG="band"' and not 'AT+QCFG="iotopmode"'
+def command_key(command):
+    name = command_name(command)
+    parameters = str(command).split("=", 1)
+    if len(parameters) > 1 and parameters[1].startswith("\""):
+        return name + ": " + parameters[1].split(",")[0]
+    return name
+
+
+# Function for checking whether a command may be chained with others
+def is_chainable(command, excluded=()):
+    if not isinstance(command, str):
+        return False
+    text = command.strip().upper()
+    if not text.startswith("AT+"):
+        return False
+    return command_name(text) not in [command_name(item) for item in excluded]
+
+
+# Function for grouping commands into lists that can each be sent as one line.
+# Order is preserved; unchainable commands form groups of one
+def group_commands(commands, excluded=(), max_length=MAX_LINE_LENGTH):
+    groups = []
+    group = []
+    for command in commands:
+        if is_chainable(command, excluded):
+            if len(group) > 0 and len(join_commands(group + [command])) > max_length:
+                groups.append(group)
+                group = []
+            group.append(command.strip())
+        else:
+            if len(group) > 0:
+                groups.append(group)
+                group = []
+            groups.append([command])
+    if len(group) > 0:
+        groups.append(group)
+    return groups
+
+
+# Function for joining a group of chainable commands into one command line
+def join_commands(group):
+    return "AT" + ";".join([command.strip()[2:] for command in group])
+
+
+# Function for splitting the response to a successful chained command line
+# into one ("OK", response) tuple per command in the group
+def split_response(group, response):
+    keys = [command_key(command) for command in group]
+    names = [command_name(command) for command in group]
+    lines = [[] for command in group]
+    current = 0
+    for line in response.split("\r\n"):
+        text = line.strip()
+        if len(text) == 0 or text == "OK":
+            continue
+        # Information lines go to the first command, from the current one on,
+        # whose key (or failing that, name) they start with
+        index = None
+        for candidates in (keys, names):
+            for i in range(current, len(group)):
+                if text.startswith(candidates[i]):
+                    index = i
+                    break
+            if index is not None:
+                break
+        if index is not None:
+            current = index
+        lines[current].append(text)
+    results = []
+    for entry in lines:
+        text = "\r\n"
+        if len(entry) > 0:
+            text += "\r\n".join(entry) + "\r\n\r\n"
+        results.append(("OK", text + "OK\r\n"))
+    return results
@@ -0,0 +1,710 @@
+'''
+  AT command transport shared by the cellular modem drivers.
+  ---
+  Owns the serial port and everything about talking to the modem that
+  doesn't depend on its command set: sending commands and data, framing
+  and matching responses, per-command timeouts, chaining, URC routing,
+  sharing the port between threads in priority order (see
+  commandscheduler), multiplexing it (see cmux) and tracing the traffic
+  on it (see wiretrace). Each driver combines CellularModem with its
+  modem's profile (see modemprofile), which declares the dialect and
+  pins, and adds its PDP and HTTP recipes.
+'''
+
+import time
+import hardware
+from modemprofile import ModemProfile
+from urcdispatcher import URCDispatcher
+from responsebuffer import ResponseBuffer
+from retrypolicy import RetryPolicy, CircuitBreaker
+from linksettings import LinkSettings
+from commandscheduler import PriorityLock, CommandScheduler
+import atbatch
+import commandscheduler
+
+
+class CellularModem(ModemProfile):
+
+    serial_device = None # see uart
+
+    response = "" # variable for modem responses
+    raw_response = b"" # modem responses as received
+    compose = "" # variable for command strings
+    urc_dispatcher = None # background reader, see start_urc_dispatcher()
+    scheduler = None # runs submitted commands, see submit()
+    mux = None # 27.010 multiplexer, see start_mux()
+    holding_input = False # see hold_input()
+    retry_policy = None # see send_and_wait()
+    circuit_breaker = None # see send_and_wait()
+    recovering = False # see recover()
+    boot_timings = None # milliseconds per phase of the last boot()
+
+    # Commands turning RTS/CTS flow control on and off in both directions
+    FLOW_CONTROL_ON = "AT+IFC=2,2"
+    FLOW_CONTROL_OFF = "AT+IFC=0,0"
+
+    # Command repeated on one line by echo_test(): it must be chainable and harmless
+    ECHO_TEST_COMMAND = "+CGMI"
+
+    # Multiplexer channels: PPP data on one, this instance's AT commands on the other
+    MUX_DATA_CHANNEL = 1
+    MUX_AT_CHANNEL = 2
+
+    # AT+CMUX <port_speed> values, by baud rate
+    MUX_PORT_SPEEDS = {9600: 1, 19200: 2, 38400: 3, 57600: 4, 115200: 5, 230400: 6, 460800: 7, 921600: 8}
+
+    # Priorities of commands that shouldn't wait behind others for the port, eg. quick
+    # queries and SMS handling. Commands not listed here use commandscheduler.NORMAL
+    COMMAND_PRIORITIES = {
+        "AT+CSQ": commandscheduler.HIGH,
+        "AT+CREG": commandscheduler.HIGH,
+        "AT+CEREG": commandscheduler.HIGH,
+        "AT+CMGR": commandscheduler.HIGH,
+        "AT+CMGL": commandscheduler.HIGH,
+        "AT+CMGD": commandscheduler.HIGH
+    }
+
+    # Data prompts, which arrive without a line ending, eg. '>' from AT+QISEND
+    PROMPTS = (">",)
+
+    # Slack (seconds) allowed between the port's read timeout and the time left
+    # before fill_rx_buffer() is to give up, see there
+    READ_TIMEOUT_MARGIN = 0.05
+
+    # Initializer function
+    # The arguments are as for ModemProfile: neither the port nor the GPIO library
+    # is touched until first used
+    def __init__(self, serial_port=None, serial_baudrate=None, rtscts=None, dsrdtr=False, gpio_backend=None):
+        super().__init__(serial_port, serial_baudrate, rtscts, dsrdtr, gpio_backend)
+        self.rx_buffer = ResponseBuffer()
+        # Held for the whole of each exchange, so threads can share the modem.
+        # Threads waiting for it are served in priority order
+        self.lock = PriorityLock()
+        self.retry_policy = RetryPolicy()
+        self.circuit_breaker = CircuitBreaker()
+        self.debug_print(self.__class__.__name__ + " class instantiated")
+
+    # The serial port, created when first used
+    @property
+    def uart(self):
+        if self.serial_device is None:
+            self.serial_device = self.create_serial()
+        return self.serial_device
+
+    # Function for closing the serial port and releasing the pins this instance claimed
+    def close(self):
+        if self.scheduler is not None:
+            self.scheduler.stop()
+            self.scheduler = None
+        self.stop_mux()
+        self.stop_urc_dispatcher()
+        if self.serial_device is not None and self.serial_device.isOpen():
+            self.serial_device.close()
+        self.release_pins()
+
+    # Function for starting the modem and waiting until it answers, within
+    # 'timeout' seconds. With 'warm_start', a modem that is already powered and
+    # answering is used as it is. Returns the time in milliseconds taken by each
+    # phase, also kept in self.boot_timings. Raises TimeoutError if the modem
+    # doesn't answer in time
+    def boot(self, warm_start=True, timeout=None):
+        if timeout is None:
+            timeout = self.boot_timeout
+        start = self.millis()
+        deadline = start + int(timeout * 1000)
+        self.boot_timings = {}
+        self.setup_pins()
+        self.boot_timings["pins"] = self.millis() - start
+        state = None
+        if warm_start and self.is_powered():
+            mark = self.millis()
+            state = self.check_running()
+            self.boot_timings["warm_check"] = self.millis() - mark
+        if state is None:
+            mark = self.millis()
+            self.power_on(deadline)
+            self.boot_timings["power_on"] = self.millis() - mark
+            mark = self.millis()
+            # A modem reset to its factory settings no longer uses the saved baud rate
+            if not self.wait_until_ready(deadline) and (not self.link_saved or self.find_baudrate() is None):
+                raise TimeoutError(self.__class__.__name__ + " did not respond")
+            self.boot_timings["first_response"] = self.millis() - mark
+        self.boot_timings["total"] = self.millis() - start
+        self.debug_print("Modem " + (state or "started") + ": " + ", ".join(
+            [name + " " + str(ms) + "ms" for name, ms in self.boot_timings.items()]))
+        return self.boot_timings
+
+    # Function for powering the modem on, before the deadline (from millis()): override in profiles.
+    # The serial port should be opened while the modem starts
+    def power_on(self, deadline):
+        if self.uart.isOpen() is False:
+            self.uart.open()
+
+    # Function for checking whether the modem is already running.
+    # Returns "registered", "powered" if it answers but isn't registered, or None
+    def check_running(self):
+        if self.probe("AT")[0] != "OK":
+            return None
+        result = self.probe("AT+CEREG?")
+        if result[0] == "OK" and self.is_registered(result[1]):
+            return "registered"
+        return "powered"
+
+    # Function for checking a +CEREG, +CGREG or +CREG response for registration
+    # on the home network (1) or roaming (5)
+    def is_registered(self, response):
+        for line in response.split("\r\n"):
+            if line.startswith("+CEREG: ") or line.startswith("+CGREG: ") or line.startswith("+CREG: "):
+                fields = line.split(": ")[1].split(",")
+                if len(fields) > 1 and fields[1].strip() in ("1", "5"):
+                    return True
+        return False
+
+    # Function for polling the modem with AT until it answers or the deadline
+    # (from millis()) passes. Returns True if it answered
+    def wait_until_ready(self, deadline):
+        while self.millis() < deadline:
+            if self.probe("AT")[0] == "OK":
+                return True
+            self.delay(min(100, max(0, deadline - self.millis())))
+        return False
+
+    # Function for sending a command once, with no retries and without counting
+    # towards the circuit breaker, eg. to see whether the modem is there at all
+    def probe(self, command, timeout=None):
+        if timeout is None:
+            timeout = self.get_command_timeout(command)
+        with self.lock:
+            try:
+                state, lines = self.exchange(command, True, "OK\r\n", timeout)
+            finally:
+                if self.urc_dispatcher is not None and not self.holding_input:
+                    self.urc_dispatcher.end_command()
+            return self.make_response(state, lines)
+
+    # Function for finding the fastest link the modem and the serial port carry
+    # reliably, and switching both to it. 'rates' are the baud rates to try and
+    # default to BAUDRATES. 'flow_control' is True if RTS and CTS are wired, False
+    # if not, or None to find out. Each rate faster than the current one is checked
+    # with echo_test() and, if the check fails, abandoned for the next. With
+    # 'persist', the result is kept by the modem and the host; see save_link().
+    # Programs that open the port themselves, eg. pppd, must be given the new
+    # settings: linksettings.py prints them as pppd options.
+    # Returns the (baudrate, rtscts) in use. Raises TimeoutError if the modem
+    # doesn't answer at the start
+    def negotiate_link(self, rates=None, flow_control=None, persist=True):
+        with self.lock:
+            if self.probe("AT")[0] != "OK":
+                raise TimeoutError(self.__class__.__name__ + " did not respond")
+            rtscts = self.set_flow_control(flow_control)
+            current = self.uart.baudrate
+            for rate in sorted(set(rates or self.BAUDRATES), reverse=True):
+                if rate <= current or self.switch_baudrate(rate):
+                    break
+            if persist:
+                self.save_link()
+            self.debug_print("Link: " + str(self.uart.baudrate) + " baud, flow control " + ("on" if rtscts else "off"))
+            return (self.uart.baudrate, rtscts)
+
+    # Function for turning RTS/CTS flow control on (True) or off (False) in the
+    # modem and the serial port. With None, it is turned on only if the modem
+    # asserts CTS once asked to use it, ie. if the line is wired, and the link
+    # then passes echo_test(); otherwise it is turned off again.
+    # Returns True if flow control is on
+    def set_flow_control(self, state=None):
+        if state is not False and self.probe(self.FLOW_CONTROL_ON)[0] == "OK":
+            detect = state is None
+            if detect:
+                try:
+                    state = self.uart.cts
+                except Exception as exp:
+                    # Ptys and some USB adaptors have no modem control lines
+                    self.debug_print(exp)
+                    state = False
+            if state:
+                self.uart.rtscts = True
+                # A floating CTS line may read high, so check that data flows
+                if not detect or self.echo_test():
+                    return True
+                self.debug_print("Link unreliable with flow control, turning it off")
+        self.probe(self.FLOW_CONTROL_OFF)
+        self.uart.rtscts = False
+        return False
+
+    # Function for moving the modem and the serial port to a new baud rate and
+    # checking the link there. If the serial port can't use the rate, or the check
+    # fails, both go back to the old rate. Returns True if the new rate is in use
+    def switch_baudrate(self, rate):
+        previous = self.uart.baudrate
+        try:
+            # Make sure the port can use the rate before the modem is asked to
+            self.uart.baudrate = rate
+            self.uart.baudrate = previous
+        except (ValueError, IOError, OSError) as exp:
+            self.debug_print(exp)
+            self.uart.baudrate = previous
+            return False
+        if self.probe("AT+IPR=" + str(rate))[0] != "OK":
+            return False
+        # The modem answers at the old rate, then changes
+        self.delay(50)
+        self.uart.baudrate = rate
+        self.delay(50)
+        if self.echo_test():
+            return True
+        self.debug_print("Link unreliable at " + str(rate) + " baud, returning to " + str(previous))
+        self.restore_baudrate(previous)
+        return False
+
+    # Function for bringing the modem, which may be at any rate, back to 'rate'
+    # after a failed switch. Returns True if it answers there
+    def restore_baudrate(self, rate):
+        # The link is unreliable, so the request may need repeating
+        for i in range(3):
+            if self.probe("AT+IPR=" + str(rate))[0] == "OK":
+                break
+        self.delay(50)
+        self.uart.baudrate = rate
+        if self.probe("AT")[0] == "OK":
+            return True
+        found = self.find_baudrate()
+        if found is None:
+            self.uart.baudrate = rate
+            return False
+        if found != rate and self.probe("AT+IPR=" + str(rate))[0] == "OK":
+            self.delay(50)
+            self.uart.baudrate = rate
+        return self.probe("AT")[0] == "OK"
+
+    # Function for finding the baud rate the modem is using, by trying each of
+    # BAUDRATES and DEFAULT_BAUDRATE in turn. The serial port is left at the rate
+    # found. Returns the rate, or None if the modem answers at none of them
+    def find_baudrate(self):
+        original = self.uart.baudrate
+        rates = [original] + [rate for rate in self.BAUDRATES + (self.DEFAULT_BAUDRATE,) if rate != original]
+        for rate in sorted(set(rates), key=rates.index):
+            try:
+                self.uart.baudrate = rate
+            except (ValueError, IOError, OSError):
+                continue
+            # The first try may only clear out bytes garbled at the wrong rate
+            for i in range(2):
+                if self.probe("AT", 0.3)[0] == "OK":
+                    self.debug_print("Modem found at " + str(rate) + " baud")
+                    return rate
+        self.uart.baudrate = original
+        return None
+
+    # Function for checking the link at its current settings: with echo on, a
+    # command line as long as the modem accepts must come back byte for byte, and
+    # be answered, 'rounds' times. The echo setting is restored afterwards.
+    # Returns True if every round passed
+    def echo_test(self, rounds=3):
+        result = self.probe("AT")
+        if result[0] != "OK":
+            return False
+        echoing = result[1].startswith("AT")
+        if not echoing and self.probe("ATE1")[0] != "OK":
+            return False
+        count = max(1, (self.MAX_LINE_LENGTH - 2) // (len(self.ECHO_TEST_COMMAND) + 1))
+        line = "AT" + ";".join([self.ECHO_TEST_COMMAND] * count)
+        passed = True
+        for i in range(rounds):
+            result = self.probe(line, self.timeout)
+            if result[0] != "OK" or not result[1].startswith(line + "\r"):
+                passed = False
+                break
+        if not echoing and self.probe("ATE0")[0] != "OK":
+            passed = False
+        return passed
+
+    # Function for keeping the link settings: in the modem's profile (AT&W), so it
+    # starts with them after a power cycle, and on the host (see linksettings), so
+    # the next driver for the port does too
+    def save_link(self):
+        self.probe("AT&W")
+        LinkSettings().save(self.serial_settings[0], self.uart.baudrate, self.uart.rtscts)
+        self.link_saved = True
+
+    # Function for sending a command, with a carriage return, or data, without one.
+    # Data may be bytes, eg. for a socket, and is then written as it is. Input that
+    # hasn't been read is discarded first unless 'discard_input' is False, eg. when
+    # a chat script expects the echo of what it sends
+    def send(self, command, is_command=True, discard_input=True):
+        if self.uart.isOpen() is False:
+            self.uart.open()
+        if isinstance(command, (bytes, bytearray)):
+            data = bytes(command) + (b"\r" if is_command else b"")
+        else:
+            self.compose = str(command)
+            if is_command:
+                self.compose += "\r"
+            data = self.compose.encode()
+        if self.urc_dispatcher is None and discard_input:
+            # Discard stale input; the dispatcher keeps URCs instead
+            self.uart.reset_input_buffer()
+            self.rx_buffer.take_all()
+        # Traced first, as the reply may be read on another thread before write() returns
+        self.trace.tx(data)
+        self.uart.write(data)
+
+    # Function for sending an AT command and waiting for the response.
+    # Returns ("OK", response), ("ERROR", response) or ("TIMEOUT", response)
+    def send_command(self, command, desired_response="OK\r\n", timeout=None):
+        return self.send_and_wait(command, True, desired_response, timeout)
+
+    # Function for queueing an AT command to be sent by the scheduler's threads.
+    # 'priority' defaults to the command's; 'deadline' is a time from millis() by
+    # which the command must have been sent. Returns a concurrent.futures.Future
+    # whose result is as for send_command()
+    def submit(self, command, desired_response="OK\r\n", timeout=None, priority=None, deadline=None):
+        with self.lock:
+            if self.scheduler is None:
+                self.scheduler = CommandScheduler(self)
+        return self.scheduler.submit(command, desired_response, timeout, priority, deadline)
+
+    # Function for sending data, eg. after a CONNECT or '>' prompt, and waiting for the response
+    def send_data(self, data, desired_response="OK\r\n", timeout=None):
+        return self.send_and_wait(data, False, desired_response, timeout)
+
+    # Function for writing a command or data and blocking until the response arrives.
+    # The reader sleeps in the serial driver until a line is complete, so no CPU
+    # is used while the modem is busy, and returns as soon as a result code is seen.
+    # A command that times out is re-sent, with backoff, only if the retry policy
+    # says it is safe to repeat. Returns ("OK", response), ("ERROR", response) or
+    # ("TIMEOUT", response); the last at once while the circuit breaker is open.
+    # 'priority' sets the command's place in the queue for the port, see
+    # get_command_priority(). If 'deadline', a time from millis(), passes before
+    # the port is free the command isn't sent and ("TIMEOUT", "") is returned
+    def send_and_wait(self, command, is_command=True, desired_response="OK\r\n", timeout=None, priority=None, deadline=None):
+        if timeout is None:
+            timeout = self.get_command_timeout(command) if is_command else self.timeout
+        if priority is None:
+            priority = self.get_command_priority(command) if is_command else self.lock.get_priority()
+        wait = None if deadline is None else (deadline - self.millis()) / 1000.0
+        if (wait is not None and wait <= 0) or not self.lock.acquire(priority, wait):
+            self.debug_print("Modem busy past the deadline, not sending " + str(command).strip())
+            return ("TIMEOUT", "")
+        try:
+            if not self.recovering and not self.circuit_breaker.allow():
+                self.debug_print("Modem not responding, not sending " + str(command).strip())
+                return ("TIMEOUT", "")
+            attempt = 1
+            try:
+                while True:
+                    state, lines = self.exchange(command, is_command, desired_response, timeout)
+                    if state != "TIMEOUT":
+                        self.circuit_breaker.record_success()
+                        return self.make_response(state, lines)
+                    if attempt >= self.retry_policy.max_attempts or not is_command \
+                            or not self.retry_policy.is_safe(command, self.NO_RETRY_COMMANDS):
+                        break
+                    self.delay(self.retry_policy.backoff(attempt) * 1000)
+                    attempt += 1
+            finally:
+                if self.urc_dispatcher is not None and not self.holding_input:
+                    self.urc_dispatcher.end_command()
+            result = self.make_response("TIMEOUT", lines)
+            if self.circuit_breaker.record_failure() and not self.recovering:
+                self.recover()
+            return result
+        finally:
+            self.lock.release()
+
+    # Function for making one attempt at a command: writing it and reading response
+    # lines until the desired response, an error or the timeout (in seconds).
+    # The result and latency are traced. Returns ("OK"/"ERROR"/"TIMEOUT", lines)
+    def exchange(self, command, is_command, desired_response, timeout):
+        self.trace.begin()
+        state = "ERROR"
+        try:
+            state, lines = self.read_response(command, is_command, desired_response, timeout)
+        finally:
+            self.trace.end(state)
+        return (state, lines)
+
+    # Function for writing a command and reading its response, see exchange()
+    def read_response(self, command, is_command, desired_response, timeout):
+        # Prompts have no line ending, so read up to the prompt itself
+        terminator = desired_response.encode() if desired_response in self.PROMPTS else b"\n"
+        desired = desired_response.encode()
+        lines = []
+        self.begin_command(command if is_command else None)
+        self.send(command, is_command)
+        deadline = self.millis() + int(timeout * 1000)
+        while True:
+            remaining = deadline - self.millis()
+            if remaining <= 0:
+                return ("TIMEOUT", lines)
+            # Lines are kept as bytes and checked one at a time as they complete
+            line = self.read_until(terminator, remaining / 1000.0)
+            if len(line) == 0:
+                continue
+            if terminator != b"\n" and self.urc_dispatcher is not None:
+                # Lines read with a prompt may include a URC that came before it
+                for part in line.split(b"\n")[:-1]:
+                    self.urc_dispatcher.process_line(part + b"\n", False)
+            lines.append(line)
+            if line.find(desired) != -1:
+                return ("OK", lines)
+            if line.find(b"ERROR") != -1:
+                return ("ERROR", lines)
+
+    # Function for trying to bring back a modem that has stopped responding:
+    # called when the circuit breaker trips. If the modem answers afterwards the
+    # breaker closes; if not, commands fail fast until the recovery period is over
+    def recover(self):
+        self.debug_print("Modem not responding, resetting")
+        try:
+            self.dump_trace()
+        except (IOError, OSError) as exp:
+            self.debug_print(exp)
+        self.recovering = True
+        try:
+            self.reset()
+            self.send_command("AT")
+        except Exception as exp:
+            self.debug_print(exp)
+        finally:
+            self.recovering = False
+        self.circuit_breaker.restart()
+
+    # Function for resetting the modem: override in profiles
+    def reset(self):
+        pass
+
+    # Function for sending several AT commands in as few round trips as possible.
+    # Consecutive extended commands are chained into one line, eg. AT+X=1;+Y=2;
+    # others are sent on their own. Items may be command strings or
+    # (command, desired_response, timeout) tuples, which are never chained.
+    # Returns one ("OK"/"ERROR", response) tuple per command, in order
+    def send_batch(self, commands):
+        results = []
+        for group in atbatch.group_commands(commands, self.NO_CHAIN_COMMANDS, self.MAX_LINE_LENGTH):
+            if len(group) == 1:
+                if isinstance(group[0], str):
+                    results.append(self.send_command(group[0]))
+                else:
+                    results.append(self.send_command(*group[0]))
+                continue
+            timeout = sum([self.get_command_timeout(command) for command in group])
+            result = self.send_command(atbatch.join_commands(group), timeout=timeout)
+            if result[0] == "OK":
+                results.extend(atbatch.split_response(group, result[1]))
+            else:
+                # The modem stops at the first failing command, and the result
+                # code doesn't say which it was, so send the group one by one
+                for command in group:
+                    results.append(self.send_command(command))
+        return results
+
+    # Function for building the result of a command from its response lines.
+    # The raw bytes are kept in self.raw_response; the text is decoded once.
+    # The response itself is in the trace, see wiretrace
+    def make_response(self, state, lines):
+        self.raw_response = b"".join(lines)
+        self.response = self.raw_response.decode('utf-8', errors='ignore')
+        return (state, self.response)
+
+    # Function for telling the URC dispatcher, if running, that a command is in flight
+    def begin_command(self, command):
+        if self.urc_dispatcher is not None and not self.holding_input:
+            self.urc_dispatcher.begin_command(command)
+
+    # Function for reading a single line from the modem.
+    # Blocks until a line terminator arrives or the timeout (in seconds) expires,
+    # in which case any partial line received so far is returned
+    def read_line(self, timeout):
+        return self.read_until(b"\n", timeout).decode('utf-8', errors='ignore')
+
+    # Function for reading raw input from the modem up to and including 'terminator'.
+    # Returns whatever has arrived if the timeout (in seconds) expires first
+    def read_until(self, terminator, timeout):
+        if self.urc_dispatcher is not None:
+            return self.urc_dispatcher.read_until(terminator, timeout)
+        deadline = self.millis() + int(timeout * 1000)
+        while True:
+            data = self.rx_buffer.take_until(terminator)
+            if data is not None:
+                return data
+            if not self.fill_rx_buffer(deadline):
+                return self.rx_buffer.take_all()
+
+    # Function for reading 'count' raw bytes from the modem.
+    # Returns fewer bytes if the timeout (in seconds) expires first. No more is
+    # read from the port than is needed, so what follows stays there
+    def read_bytes(self, count, timeout):
+        if self.urc_dispatcher is not None:
+            return self.urc_dispatcher.read_bytes(count, timeout)
+        deadline = self.millis() + int(timeout * 1000)
+        while len(self.rx_buffer) < count:
+            if not self.fill_rx_buffer(deadline, count - len(self.rx_buffer)):
+                break
+        return self.rx_buffer.take(count)
+
+    # Function for waiting until the deadline (from millis()) for more input, reading
+    # at most 'limit' bytes if given. Returns False if none arrives in time
+    def fill_rx_buffer(self, deadline, limit=None):
+        while True:
+            remaining = deadline - self.millis()
+            if remaining <= 0:
+                return False
+            try:
+                # Setting pyserial's timeout reconfigures the port, so it is changed only
+                # if it would overrun the deadline or make the wait spin; a shorter one
+                # just means another pass round this loop
+                wanted = remaining / 1000.0
+                current = self.uart.timeout
+                if current is None or current > wanted + self.READ_TIMEOUT_MARGIN or current < min(wanted, self.READ_TIMEOUT_MARGIN):
+                    self.uart.timeout = wanted
+                # Blocks until at least one byte arrives, then takes all that are waiting
+                waiting = self.uart.in_waiting
+                data = self.uart.read(max(1, waiting if limit is None else min(waiting, limit)))
+            except Exception as exp:
+                self.debug_print(exp)
+                return False
+            if len(data) > 0:
+                break
+        self.trace.rx(data)
+        self.rx_buffer.append(data)
+        return True
+
+    # Function for keeping the modem, and its input, for this thread across several
+    # commands and reads, eg. while streaming data, rather than handing the input back
+    # to the URC dispatcher after each command. Call release_input() when done
+    def hold_input(self, command=None):
+        self.lock.acquire(self.get_command_priority(command) if command is not None else None)
+        self.begin_command(command)
+        self.holding_input = True
+
+    # Function for handing the input back to the URC dispatcher and the modem to other threads
+    def release_input(self):
+        self.holding_input = False
+        if self.urc_dispatcher is not None:
+            self.urc_dispatcher.end_command()
+        self.lock.release()
+
+    # Function for starting the background reader that owns the serial port.
+    # Once running, URCs are no longer discarded between commands but passed
+    # to the callbacks and queues registered with on_urc() and urc_queue()
+    def start_urc_dispatcher(self):
+        with self.lock:
+            if self.urc_dispatcher is None:
+                if self.uart.isOpen() is False:
+                    self.uart.open()
+                self.urc_dispatcher = URCDispatcher(self.uart, self.URC_PREFIXES, self.debug_print, self.trace)
+                self.urc_dispatcher.start()
+        return self.urc_dispatcher
+
+    # Function for stopping the background reader
+    def stop_urc_dispatcher(self):
+        with self.lock:
+            if self.urc_dispatcher is not None:
+                self.urc_dispatcher.stop()
+                self.urc_dispatcher = None
+
+    # Function for registering a callback for a URC, eg. on_urc("+CMTI", handler)
+    def on_urc(self, prefix, callback):
+        self.start_urc_dispatcher().register(prefix, callback)
+
+    # Function for getting a queue that receives every URC with the given prefix,
+    # keeping the latest URCDispatcher.QUEUE_SIZE
+    def urc_queue(self, prefix):
+        return self.start_urc_dispatcher().subscribe(prefix)
+
+    # Function for waiting up to 'timeout' seconds for a URC arriving after the call.
+    # Returns None on timeout
+    def wait_for_urc(self, prefix, timeout=None):
+        return self.start_urc_dispatcher().wait_for(prefix, timeout)
+
+    # Function for switching the port to 27.010 multiplexing, so that PPP can run on one
+    # channel while AT commands carry on, over another, without interrupting it. Opens
+    # channels 1 to 'channels', each relayed to a pty; 'links' maps channels to symlinks
+    # to create to them, eg. {modem.MUX_DATA_CHANNEL: "/var/run/modem-ppp"} for pppd.
+    # This instance then sends its commands over MUX_AT_CHANNEL, keeping its URC
+    # listeners; each channel starts with the modem's saved settings, so eg. ATE0
+    # may need sending again. Returns the Multiplexer. Raises IOError if the modem
+    # doesn't switch
+    def start_mux(self, channels=2, frame_size=127, links=None):
+        from cmux import Multiplexer
+        with self.lock:
+            if self.mux is not None:
+                return self.mux
+            physical = self.uart
+            speed = self.MUX_PORT_SPEEDS.get(physical.baudrate, 5)
+            result = self.send_command("AT+CMUX=0,0," + str(speed) + "," + str(frame_size))
+            if result[0] != "OK":
+                raise IOError("AT+CMUX failed: " + result[1].strip())
+            dispatcher = self.urc_dispatcher
+            if dispatcher is not None:
+                # The multiplexer reads the port from now on
+                dispatcher.stop()
+            mux = Multiplexer(physical, range(1, channels + 1), frame_size, links, self.debug_print)
+            try:
+                mux.start()
+            except IOError:
+                # The modem drops out of multiplexing by itself if no channel opens
+                if dispatcher is not None:
+                    dispatcher.start()
+                raise
+            self.mux = mux
+            self.serial_device = hardware.create_serial(mux.channel_path(self.MUX_AT_CHANNEL), physical.baudrate)
+            self.serial_device.open()
+            if dispatcher is not None:
+                dispatcher.port = self.serial_device
+                dispatcher.start()
+            self.debug_print("Multiplexing started")
+        return self.mux
+
+    # Function for closing the multiplexer's channels, including any PPP link on them,
+    # and going back to AT commands on the port itself
+    def stop_mux(self):
+        with self.lock:
+            if self.mux is None:
+                return
+            dispatcher = self.urc_dispatcher
+            if dispatcher is not None:
+                dispatcher.stop()
+            self.serial_device.close()
+            self.mux.stop()
+            self.serial_device = self.mux.port
+            self.mux = None
+            if dispatcher is not None:
+                dispatcher.port = self.serial_device
+                dispatcher.start()
+            self.debug_print("Multiplexing stopped")
+
+    # Function for activating the PDP context: override in profiles
+    def activate_context(self):
+        pass
+
+    # Function for deactivating the PDP context: override in profiles
+    def deactivate_context(self):
+        pass
+
+    # Function for getting an HTTPSession for this modem: override in profiles
+    def http_session(self, apn=None, idle_timeout=300):
+        raise NotImplementedError(self.__class__.__name__ + " has no HTTP session")
+
+    # Function for getting an SMSInbox, which handles waiting messages in batches.
+    # The modem must be in text mode (AT+CMGF=1)
+    def sms_inbox(self):
+        from smsinbox import SMSInbox
+        return SMSInbox(self)
+
+    # Function for delay in miliseconds
+    def delay(self, ms):
+        time.sleep(float(ms / 1000.0))
+
+    # Function for setting the priority of the commands this thread sends within a
+    # 'with' block, overriding COMMAND_PRIORITIES, eg.
+    #     with modem.priority(commandscheduler.LOW):
+    #         session.upload(outbox, url)
+    def priority(self, level):
+        return self.lock.priority(level)
+
+    # Function for getting the priority of a command: the thread's, if set with
+    # priority(), or the command's in COMMAND_PRIORITIES
+    def get_command_priority(self, command):
+        name = str(command).strip().split("=", 1)[0].split("?", 1)[0].upper()
+        return self.lock.get_priority(self.COMMAND_PRIORITIES.get(name, commandscheduler.NORMAL))
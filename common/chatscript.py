@@ -0,0 +1,316 @@
+'''
+  Chat script runner for dialling PPP connections.
+  ---
+  Runs scripts written for the chat program, eg. bg96/ppp/twilio-chatscript,
+  on a CellularModem's port. Understands ABORT, CLR_ABORT, REPORT,
+  CLR_REPORT, TIMEOUT and SAY, expect-send pairs, sub-expects, eg.
+  "OK-AT-OK", and chat's escapes. Unlike chat, it skips commands whose
+  setting the modem already has, eg. ATE0 when the modem isn't echoing.
+  It waits as long for each command as the modem's profile allows; the
+  script's TIMEOUT applies only to commands the profile doesn't list. It
+  records how long each step took.
+
+  Usage:
+      script = chatscript.load("/etc/chatscripts/twilio")
+      state, response = script.run(modem)
+      for command, state, ms in script.steps:
+          print(command, state, ms)
+'''
+
+import sys
+import time
+
+
+# Keywords, each taking the token that follows
+KEYWORDS = ("ABORT", "CLR_ABORT", "REPORT", "CLR_REPORT", "TIMEOUT", "SAY", "ECHO", "HANGUP")
+
+# Escapes and the characters they stand for. \c, \d and \p are handled separately
+ESCAPES = {"b": "\b", "n": "\n", "N": "\0", "r": "\r", "s": " ", "t": "\t", "\\": "\\", "'": "'", "\"": "\"", "-": "-"}
+
+
+# Function for splitting a script into tokens: words, or strings in single or
+# double quotes, with their escapes left in. Lines starting with '#' are comments
+def tokenize(text):
+    tokens = []
+    for line in text.splitlines():
+        line = line.strip()
+        if len(line) == 0 or line[0] == "#":
+            continue
+        index = 0
+        while index < len(line):
+            if line[index].isspace():
+                index += 1
+                continue
+            quote = line[index] if line[index] in "\"'" else None
+            start = index + 1 if quote is not None else index
+            index = start
+            while index < len(line):
+                if line[index] == "\\":
+                    index += 2
+                    continue
+                if (quote is not None and line[index] == quote) or (quote is None and line[index].isspace()):
+                    break
+                index += 1
+            tokens.append(line[start:index])
+            index += 1
+    return tokens
+
+
+# Function for replacing the escapes in an expect string, eg. "\r\n" or "^C"
+def unescape(token):
+    return "".join([part for part in expand(token) if isinstance(part, str)])
+
+
+# Function for expanding the escapes in a token. Returns a list of strings and
+# delays, in seconds, from \d and \p; \c is dropped, see ChatScript.send()
+def expand(token):
+    parts = []
+    text = ""
+    index = 0
+    while index < len(token):
+        char = token[index]
+        index += 1
+        if char == "^" and index < len(token):
+            text += chr(ord(token[index]) & 0x1F)
+            index += 1
+            continue
+        if char != "\\" or index == len(token):
+            text += char
+            continue
+        char = token[index]
+        index += 1
+        if char in ESCAPES:
+            text += ESCAPES[char]
+        elif char in "dp":
+            parts.extend([text, 1.0 if char == "d" else 0.1])
+            text = ""
+        elif char in "01234567":
+            # Up to three octal digits
+            end = index - 1
+            while end < len(token) and end < index + 2 and token[end] in "01234567":
+                end += 1
+            text += chr(int(token[index - 1:end], 8))
+            index = end
+        # \c, \K and \q have no equivalent here
+    parts.append(text)
+    return [part for part in parts if part != ""]
+
+
+# Function for splitting an expect string into alternating expect and send strings
+# at the dashes, eg. "OK-AT-OK" into ["OK", "AT", "OK"]. Escaped dashes are kept
+def split_expect(token):
+    parts = [""]
+    index = 0
+    while index < len(token):
+        if token[index] == "\\" and index + 1 < len(token):
+            parts[-1] += token[index:index + 2]
+            index += 2
+            continue
+        if token[index] == "-":
+            parts.append("")
+        else:
+            parts[-1] += token[index]
+        index += 1
+    return parts
+
+
+# Function for reading a script from a file
+def load(path):
+    with open(path) as file:
+        return ChatScript(file.read())
+
+
+class ChatScript:
+
+    timeout = 45 # Seconds, chat's default until the script sets TIMEOUT
+    echo = None # whether the modem echoes commands, or None if not known
+    result_codes = False # whether the modem has been seen sending result codes
+    aborted = None # index of the ABORT string that ended the last run, if one did
+
+    # Initializer function
+    # 'text' is the script. Keywords and expect-send pairs become a list of
+    # (keyword, token) items, "EXPECT" and "SEND" standing for the pairs
+    def __init__(self, text):
+        self.items = []
+        expecting = True
+        tokens = tokenize(text)
+        index = 0
+        while index < len(tokens):
+            token = tokens[index]
+            index += 1
+            if expecting and token in KEYWORDS and index < len(tokens):
+                self.items.append((token, tokens[index]))
+                index += 1
+                continue
+            self.items.append(("EXPECT" if expecting else "SEND", token))
+            expecting = not expecting
+        self.aborts = []
+        self.report_strings = []
+        self.reports = []
+        self.steps = []
+
+    # Function for running the script on 'modem', a CellularModem, which is held
+    # for this thread until the script ends. Each step is recorded in self.steps
+    # as (command, state, milliseconds), state being "OK", "SKIPPED", "ERROR" or
+    # "TIMEOUT". Lines containing REPORT strings are kept in self.reports.
+    # Returns ("OK", response), ("TIMEOUT", response) or ("ERROR", response) if an
+    # ABORT string arrived, the string's index being kept in self.aborted
+    def run(self, modem):
+        self.aborts = []
+        self.report_strings = []
+        self.reports = []
+        self.steps = []
+        self.echo = None
+        self.result_codes = False
+        self.aborted = None
+        timeout = self.timeout
+        command = None
+        skip = False
+        started = 0
+        received = ""
+        modem.hold_input()
+        try:
+            for position in range(len(self.items)):
+                keyword, token = self.items[position]
+                if keyword == "ABORT":
+                    self.aborts.append(unescape(token))
+                elif keyword == "CLR_ABORT":
+                    self.aborts = [text for text in self.aborts if text != unescape(token)]
+                elif keyword == "REPORT":
+                    self.report_strings.append(unescape(token))
+                elif keyword == "CLR_REPORT":
+                    self.report_strings = [text for text in self.report_strings if text != unescape(token)]
+                elif keyword == "TIMEOUT":
+                    timeout = float(token)
+                elif keyword == "SAY":
+                    sys.stderr.write(unescape(token))
+                elif keyword == "SEND":
+                    # Nothing need be sent after the last expect, eg. CONNECT ""
+                    if token == "" and position == len(self.items) - 1:
+                        break
+                    command = unescape(token).strip()
+                    started = modem.millis()
+                    skip = self.is_satisfied(modem, command, timeout)
+                    if not skip:
+                        self.send(modem, token)
+                elif keyword == "EXPECT":
+                    if skip:
+                        self.steps.append((command, "SKIPPED", modem.millis() - started))
+                        command = None
+                        skip = False
+                        continue
+                    limit = timeout if command is None else modem.get_command_timeout(command, timeout)
+                    state, received = self.expect(modem, token, limit)
+                    if command is not None:
+                        self.steps.append((command, state, modem.millis() - started))
+                        self.update_state(command, state, received)
+                    command = None
+                    if state != "OK":
+                        if state == "ERROR":
+                            self.aborted = self.find_abort(received)
+                        return (state, received)
+            if command is not None:
+                self.steps.append((command, "SKIPPED" if skip else "OK", modem.millis() - started))
+        finally:
+            modem.release_input()
+        return ("OK", received)
+
+    # Function for sending a send string: a carriage return is added unless it ends
+    # with \c, and \d and \p pause for a second and a tenth of one. The text between
+    # pauses goes in one write, and input isn't discarded, so the echo can be seen
+    def send(self, modem, token):
+        end = "" if token.endswith("\\c") else "\r"
+        if end == "":
+            token = token[:-2]
+        parts = expand(token)
+        if len(parts) > 0 and isinstance(parts[-1], str):
+            parts[-1] += end
+        else:
+            parts.append(end)
+        for part in parts:
+            if isinstance(part, float):
+                time.sleep(part)
+            elif len(part) > 0:
+                modem.send(part.encode('latin-1'), False, discard_input=False)
+
+    # Function for waiting up to 'timeout' seconds for an expect string. Sub-expects,
+    # eg. "OK-AT-OK", send the string between the dashes and wait again if the one
+    # before it doesn't arrive. Returns (state, text received)
+    def expect(self, modem, token, timeout):
+        alternatives = split_expect(token)
+        for index in range(0, len(alternatives), 2):
+            if index > 0:
+                self.send(modem, alternatives[index - 1])
+            state, received = self.wait_for(modem, unescape(alternatives[index]), timeout)
+            if state != "TIMEOUT" or index + 1 >= len(alternatives):
+                return (state, received)
+
+    # Function for reading from the modem until 'expected' or an ABORT string has
+    # arrived, or 'timeout' seconds have passed. Returns ("OK", text received),
+    # ("ERROR", text received) or ("TIMEOUT", text received). Like chat, it reads a
+    # byte at a time and stops at the end of the string, so what follows, eg. the
+    # first PPP frames after CONNECT, is left unread for pppd
+    def wait_for(self, modem, expected, timeout):
+        received = ""
+        deadline = modem.millis() + int(timeout * 1000)
+        while True:
+            if self.find_abort(received) is not None:
+                state = "ERROR"
+                break
+            if received.endswith(expected):
+                state = "OK"
+                break
+            remaining = deadline - modem.millis()
+            if remaining <= 0:
+                state = "TIMEOUT"
+                break
+            received += modem.read_bytes(1, remaining / 1000.0).decode('latin-1')
+        for line in received.splitlines():
+            for text in self.report_strings:
+                if line.find(text) != -1 and line.strip() not in self.reports:
+                    self.reports.append(line.strip())
+        return (state, received)
+
+    # Function for getting the index of the first ABORT string in 'received', or None
+    def find_abort(self, received):
+        for index in range(len(self.aborts)):
+            if received.find(self.aborts[index]) != -1:
+                return index
+        return None
+
+    # Function for checking whether the modem already has the setting 'command' makes,
+    # so it needn't be sent. Only what has been seen while running, and settings that
+    # can be read back, are trusted
+    def is_satisfied(self, modem, command, timeout):
+        name = command.upper()
+        if name == "ATE0":
+            return self.echo is False
+        if name == "ATE1":
+            return self.echo is True
+        if name == "ATQ0":
+            return self.result_codes
+        if name.startswith("AT+CGDCONT="):
+            # Rewriting a context the modem already has may make it detach
+            self.send(modem, "AT+CGDCONT?")
+            state, received = self.wait_for(modem, "OK", modem.get_command_timeout("AT+CGDCONT?", timeout))
+            setting = "+CGDCONT: " + command[11:]
+            for line in received.splitlines():
+                if state == "OK" and (line == setting or line.startswith(setting + ",")):
+                    return True
+        return False
+
+    # Function for noting the modem's settings from a command's response
+    def update_state(self, command, state, received):
+        if state != "OK":
+            return
+        name = command.upper()
+        if name.startswith("ATZ"):
+            # The stored profile may change any setting
+            self.echo = None
+        elif name == "ATE0" or name == "ATE1":
+            self.echo = name == "ATE1"
+        else:
+            self.echo = received.lstrip().startswith(command)
+        if received.find("OK") != -1:
+            self.result_codes = True
+
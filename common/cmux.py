@@ -0,0 +1,447 @@
+'''
+  3GPP 27.010 (GSM 07.10) multiplexer for the cellular modem drivers.
+  ---
+  Once the modem has accepted AT+CMUX, the serial port carries frames
+  for several virtual channels (DLCIs) rather than one stream. The
+  Multiplexer owns the port from then on: it opens the control channel
+  (DLCI 0) and each data channel, and relays every data channel to a
+  pty of its own, so a PPP link can run on one channel while AT commands
+  keep working on another. Basic option only, with UIH frames.
+
+  Usage:
+      modem.send_command("AT+CMUX=0,0,5,127")
+      mux = Multiplexer(modem.uart, channels=(1, 2))
+      mux.start()
+      # pppd on mux.channel_path(1), AT commands on mux.channel_path(2)
+      mux.stop()
+'''
+
+import os
+import select
+import threading
+import tty
+
+# Frame delimiter
+FLAG = 0xF9
+
+# Frame types, in the control field, with the poll/final bit clear
+SABM = 0x2F
+UA = 0x63
+DM = 0x0F
+DISC = 0x43
+UIH = 0xEF
+UI = 0x03
+POLL_FINAL = 0x10
+FRAME_TYPES = (SABM, UA, DM, DISC, UIH, UI)
+
+# Address field bits
+EA = 0x01
+CR = 0x02
+
+# Control channel message types, as commands, and the bit cleared in a response
+MSC = 0xE3
+CLD = 0xC3
+TEST = 0x23
+FCON = 0xA3
+FCOFF = 0x63
+COMMAND = 0x02
+
+# V.24 signals sent with MSC: EA, RTC, RTR and DV
+SIGNALS = 0x8D
+# Flow control bit in a peer's V.24 signals: set while the peer can't take data
+SIGNAL_FC = 0x02
+
+# Longest information field the basic option allows
+MAX_FRAME_SIZE = 32768
+
+
+# Function for building the FCS lookup table: CRC-8, polynomial x^8 + x^2 + x + 1,
+# reflected, as given in 27.010 annex B
+def make_table():
+    table = []
+    for value in range(256):
+        for bit in range(8):
+            value = (value >> 1) ^ 0xE0 if value & 1 else value >> 1
+        table.append(value)
+    return table
+
+
+FCS_TABLE = make_table()
+
+
+# Function for calculating the FCS of a frame's address, control and length fields
+def fcs(data):
+    value = 0xFF
+    for byte in data:
+        value = FCS_TABLE[value ^ byte]
+    return 0xFF - value
+
+
+# Function for checking a received FCS: run over the fields and the FCS, the CRC is 0xCF
+def check_fcs(data, received):
+    value = 0xFF
+    for byte in data:
+        value = FCS_TABLE[value ^ byte]
+    return FCS_TABLE[value ^ received] == 0xCF
+
+
+# Function for encoding a length field: one byte up to 127, two beyond
+def encode_length(length):
+    if length <= 127:
+        return bytes([(length << 1) | EA])
+    return bytes([(length & 0x7F) << 1, length >> 7])
+
+
+# Function for building a frame. 'command' sets the C/R bit as the initiator, ie.
+# the host, sets it on commands; the modem's responses carry the same value
+def encode_frame(dlci, control, info=b"", command=True):
+    header = bytes([(dlci << 2) | (CR if command else 0) | EA, control]) + encode_length(len(info))
+    return bytes([FLAG]) + header + bytes(info) + bytes([fcs(header)]) + bytes([FLAG])
+
+
+# Function for building a control channel message, eg. MSC, to send in a UIH frame on DLCI 0
+def encode_message(kind, values=b""):
+    return bytes([kind]) + encode_length(len(values)) + bytes(values)
+
+
+# Function for splitting the information field of a control channel frame into
+# (type, values) messages
+def decode_messages(info):
+    messages = []
+    while len(info) >= 2:
+        kind = info[0]
+        length = info[1] >> 1
+        offset = 2
+        if not info[1] & EA:
+            if len(info) < 3:
+                break
+            length |= info[2] << 7
+            offset = 3
+        messages.append((kind, bytes(info[offset:offset + length])))
+        info = info[offset + length:]
+    return messages
+
+
+class FrameDecoder:
+
+    # Initializer function
+    # Frames whose information field is longer than 'max_size' are treated as noise
+    def __init__(self, max_size=MAX_FRAME_SIZE):
+        self.max_size = max_size
+        self.buffer = bytearray()
+        # Statistics
+        self.frames = 0
+        self.errors = 0
+
+    # Function for adding received bytes. Returns the frames completed, as
+    # (dlci, control, info, C/R bit set) tuples; the poll/final bit is cleared.
+    # A frame with a bad FCS or no closing flag is dropped and the stream resynchronised
+    def feed(self, data):
+        self.buffer += data
+        frames = []
+        while True:
+            start = self.buffer.find(FLAG)
+            if start == -1:
+                self.buffer.clear()
+                break
+            # Adjacent flags close one frame and open the next, or are fill
+            while start + 1 < len(self.buffer) and self.buffer[start + 1] == FLAG:
+                start += 1
+            del self.buffer[:start]
+            if len(self.buffer) < 6:
+                break
+            # Check the header looks like one before trusting its length field
+            if not self.buffer[1] & EA or self.buffer[2] & ~POLL_FINAL not in FRAME_TYPES:
+                self.errors += 1
+                del self.buffer[0]
+                continue
+            length = self.buffer[3] >> 1
+            header = 3
+            if not self.buffer[3] & EA:
+                length |= self.buffer[4] << 7
+                header = 4
+            if length > self.max_size:
+                self.errors += 1
+                del self.buffer[0]
+                continue
+            end = 1 + header + length
+            if len(self.buffer) < end + 2:
+                break
+            if self.buffer[end + 1] != FLAG or not check_fcs(self.buffer[1:1 + header], self.buffer[end]):
+                self.errors += 1
+                del self.buffer[0]
+                continue
+            address = self.buffer[1]
+            frames.append((address >> 2, self.buffer[2] & ~POLL_FINAL, bytes(self.buffer[1 + header:end]), bool(address & CR)))
+            self.frames += 1
+            # Keep the closing flag, which may open the next frame
+            del self.buffer[:end + 1]
+        return frames
+
+
+class Channel:
+
+    path = None # the pty's name, for the program using the channel
+    link = None # symlink to the pty, if any
+    is_open = False # whether the modem has accepted SABM
+
+    # Initializer function
+    def __init__(self, dlci):
+        self.dlci = dlci
+        self.master, self.slave = os.openpty()
+        # No echo or line editing: the channel carries raw bytes both ways
+        tty.setraw(self.slave)
+        os.set_blocking(self.master, False)
+        self.path = os.ttyname(self.slave)
+        # Set while the modem can take data on this channel, see MSC
+        self.clear_to_send = threading.Event()
+        self.clear_to_send.set()
+        self.thread = None
+        # Statistics
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.dropped_bytes = 0
+
+    # Function for closing the pty and removing the link
+    def close(self):
+        for fd in (self.master, self.slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        if self.link is not None:
+            try:
+                os.remove(self.link)
+            except OSError:
+                pass
+
+
+class Multiplexer:
+
+    running = False
+    frame_size = 127 # the N1 given to AT+CMUX
+    timeout = 3 # Seconds to wait for the modem to answer SABM, DISC or CLD
+
+    # Initializer function
+    # 'port' is the open pyserial port, already switched over with AT+CMUX.
+    # 'channels' lists the DLCIs to open. 'links' maps DLCIs to symlinks to
+    # create to their ptys, eg. {1: "/var/run/modem-ppp"} for pppd's options
+    def __init__(self, port, channels=(1, 2), frame_size=127, links=None, log=None):
+        self.port = port
+        self.frame_size = frame_size
+        self.links = links if links is not None else {}
+        self.log = log
+        self.decoder = FrameDecoder(max(frame_size, 127))
+        self.channels = {}
+        for dlci in channels:
+            self.channels[dlci] = Channel(dlci)
+        self.write_lock = threading.Lock()
+        self.condition = threading.Condition()
+        # Replies awaited from the modem, by (dlci, frame type or message type)
+        self.replies = {}
+        self.thread = None
+
+    # Function for getting the pty of a channel
+    def channel_path(self, dlci):
+        channel = self.channels[dlci]
+        return channel.link if channel.link is not None else channel.path
+
+    # Function for opening the control channel and every data channel, then relaying
+    # them. Raises IOError if the modem doesn't accept one
+    def start(self):
+        if self.running:
+            return
+        self.port.timeout = 0.5
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="cmux-reader", daemon=True)
+        self.thread.start()
+        try:
+            for dlci in [0] + sorted(self.channels.keys()):
+                if self.request(dlci, SABM, UA) is not True:
+                    raise IOError("CMUX channel " + str(dlci) + " not opened")
+                if dlci == 0:
+                    continue
+                channel = self.channels[dlci]
+                channel.is_open = True
+                # Tell the modem the host is ready: some won't send data until they know
+                self.send_control(encode_message(MSC, bytes([(dlci << 2) | CR | EA, SIGNALS])))
+                if dlci in self.links:
+                    if os.path.lexists(self.links[dlci]):
+                        os.remove(self.links[dlci])
+                    os.symlink(channel.path, self.links[dlci])
+                    channel.link = self.links[dlci]
+                channel.thread = threading.Thread(target=self.relay, args=(channel,), name="cmux-" + str(dlci), daemon=True)
+                channel.thread.start()
+        except Exception:
+            self.stop()
+            raise
+
+    # Function for closing the channels and ending multiplexing with CLD, after
+    # which the modem takes AT commands on the port again
+    def stop(self):
+        if not self.running:
+            return
+        for channel in self.channels.values():
+            if channel.is_open:
+                channel.is_open = False
+                self.request(channel.dlci, DISC, UA)
+        self.request(0, UIH, CLD & ~COMMAND, encode_message(CLD))
+        self.close_channels()
+
+    # Function for ending the relays and closing the channels' ptys once multiplexing
+    # has ended, by stop() or by the modem
+    def close_channels(self):
+        self.running = False
+        for channel in self.channels.values():
+            channel.is_open = False
+            channel.clear_to_send.set()
+            if channel.thread is not None and channel.thread is not threading.current_thread():
+                channel.thread.join()
+            channel.close()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+        self.thread = None
+
+    # Function for sending a frame and waiting for the modem's reply, a frame type or,
+    # on DLCI 0, a control message type. Returns True, False if the modem refused
+    # with DM, or None on timeout
+    def request(self, dlci, control, reply, info=b""):
+        key = (dlci, reply)
+        event = threading.Event()
+        with self.condition:
+            self.replies[key] = event
+            self.replies[(dlci, DM)] = event
+        self.write_frame(encode_frame(dlci, control | (POLL_FINAL if control != UIH else 0), info))
+        answered = event.wait(self.timeout)
+        with self.condition:
+            self.replies.pop(key, None)
+            refused = self.replies.pop((dlci, DM), None) is None
+        if not answered:
+            self.print_log("CMUX: no reply on channel " + str(dlci))
+            return None
+        return not refused
+
+    # Function for sending a control channel message in a UIH frame on DLCI 0
+    def send_control(self, message, command=True):
+        self.write_frame(encode_frame(0, UIH, message, command))
+
+    # Function for writing a frame to the port, whole
+    def write_frame(self, frame):
+        with self.write_lock:
+            self.port.write(frame)
+
+    # Reader thread main loop: frames from the modem go to their channels' ptys
+    def run(self):
+        while self.running:
+            try:
+                data = self.port.read(max(1, self.port.in_waiting))
+            except Exception as exp:
+                self.print_log(exp)
+                break
+            if len(data) == 0:
+                continue
+            for dlci, control, info, command in self.decoder.feed(data):
+                self.handle_frame(dlci, control, info)
+
+    # Function for acting on a frame from the modem
+    def handle_frame(self, dlci, control, info):
+        if control == UIH:
+            if dlci == 0:
+                for kind, values in decode_messages(info):
+                    self.handle_message(kind, values)
+                return
+            channel = self.channels.get(dlci)
+            if channel is not None and channel.is_open:
+                channel.bytes_in += len(info)
+                self.deliver(channel, info)
+            return
+        if control == DM:
+            # A refusal: clear the DM entry to tell request() so, then wake it
+            with self.condition:
+                event = self.replies.pop((dlci, DM), None)
+            if event is not None:
+                event.set()
+            return
+        if control == DISC:
+            # The modem closing a channel, or the whole multiplexer on DLCI 0
+            self.write_frame(encode_frame(dlci, UA | POLL_FINAL, command=False))
+            if dlci == 0:
+                self.print_log("CMUX: closed by the modem")
+                self.close_channels()
+            elif dlci in self.channels:
+                self.channels[dlci].is_open = False
+            return
+        self.reply_received(dlci, control)
+
+    # Function for acting on a control channel message from the modem
+    def handle_message(self, kind, values):
+        if kind & COMMAND:
+            if kind == MSC and len(values) >= 2:
+                channel = self.channels.get(values[0] >> 2)
+                if channel is not None:
+                    if values[1] & SIGNAL_FC:
+                        channel.clear_to_send.clear()
+                    else:
+                        channel.clear_to_send.set()
+            elif kind == FCOFF:
+                for channel in self.channels.values():
+                    channel.clear_to_send.clear()
+            elif kind == FCON:
+                for channel in self.channels.values():
+                    channel.clear_to_send.set()
+            # Every command is acknowledged with the same message as a response
+            self.send_control(encode_message(kind & ~COMMAND, values), False)
+            return
+        self.reply_received(0, kind)
+
+    # Function for waking a request() waiting for this reply
+    def reply_received(self, dlci, reply):
+        with self.condition:
+            event = self.replies.get((dlci, reply))
+        if event is not None:
+            event.set()
+
+    # Function for writing data from the modem to a channel's pty. If the program
+    # using the channel doesn't read it for 'timeout' seconds, the rest is dropped,
+    # rather than holding up the other channels
+    def deliver(self, channel, data):
+        while len(data) > 0:
+            if len(select.select([], [channel.master], [], self.timeout)[1]) == 0:
+                channel.dropped_bytes += len(data)
+                self.print_log("CMUX: channel " + str(channel.dlci) + " not read, data dropped")
+                return
+            try:
+                data = data[os.write(channel.master, data):]
+            except BlockingIOError:
+                continue
+            except OSError:
+                return
+
+    # Channel thread main loop: what the program using the pty writes is sent in UIH frames
+    def relay(self, channel):
+        while self.running and channel.is_open:
+            # Wake periodically so that stop() is honoured promptly
+            if len(select.select([channel.master], [], [], 0.5)[0]) == 0:
+                continue
+            try:
+                data = os.read(channel.master, self.frame_size)
+            except BlockingIOError:
+                continue
+            except OSError:
+                break
+            if len(data) == 0:
+                break
+            channel.clear_to_send.wait()
+            if not self.running:
+                break
+            channel.bytes_out += len(data)
+            try:
+                self.write_frame(encode_frame(channel.dlci, UIH, data))
+            except Exception as exp:
+                self.print_log(exp)
+                break
+
+    # Function for outputting log messages
+    def print_log(self, message):
+        if self.log is not None:
+            self.log(message)
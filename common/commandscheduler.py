@@ -0,0 +1,185 @@
+'''
+  Priority scheduling of the modem's serial port between threads.
+  ---
+  The modem runs one command at a time, so threads sharing it queue for
+  the port. PriorityLock hands the port to the most urgent waiter first,
+  and to waiters of equal priority in the order they arrived, so a signal
+  query or an SMS read isn't stuck behind a queue of bulk transfers. It
+  is reentrant, so a thread holding the port can run several commands in
+  a row, and a waiter can give up once a time limit passes. Commands that
+  take long, eg. HTTP requests, hold the port only until the modem has
+  accepted them, and wait for their result URC without it.
+
+  CommandScheduler runs commands on behalf of other threads, returning a
+  concurrent.futures.Future for each.
+
+  Usage:
+      future = modem.submit("AT+CSQ", priority=commandscheduler.HIGH)
+      state, response = future.result()
+'''
+
+import contextlib
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import Future
+
+
+# Priority levels: lower values are served first
+URGENT = 0
+HIGH = 1
+NORMAL = 2
+LOW = 3
+
+
+class PriorityLock:
+
+    owner = None # ident of the thread holding the lock
+    count = 0 # times the owner has acquired it
+
+    # Initializer function
+    def __init__(self):
+        self.condition = threading.Condition(threading.Lock())
+        # Heap of [priority, ticket] lists, one per waiting thread
+        self.waiting = []
+        self.tickets = itertools.count()
+        self.local = threading.local()
+        # Statistics
+        self.granted = 0
+        self.expired = 0
+
+    # Function for taking the lock, after any more urgent waiter and any of the same
+    # priority that arrived first. 'priority' defaults to the thread's, see priority().
+    # Returns False if 'timeout' seconds pass first; None waits indefinitely
+    def acquire(self, priority=None, timeout=None):
+        me = threading.get_ident()
+        if priority is None:
+            priority = self.get_priority()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.condition:
+            if self.owner == me:
+                self.count += 1
+                return True
+            entry = [priority, next(self.tickets)]
+            heapq.heappush(self.waiting, entry)
+            while self.owner is not None or self.waiting[0] is not entry:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    self.waiting.remove(entry)
+                    heapq.heapify(self.waiting)
+                    # Whoever is now first may be able to go
+                    self.condition.notify_all()
+                    self.expired += 1
+                    return False
+                self.condition.wait(remaining)
+            heapq.heappop(self.waiting)
+            self.owner = me
+            self.count = 1
+            self.granted += 1
+            return True
+
+    # Function for releasing the lock, once for each acquire()
+    def release(self):
+        with self.condition:
+            if self.owner != threading.get_ident():
+                raise RuntimeError("cannot release un-acquired lock")
+            self.count -= 1
+            if self.count == 0:
+                self.owner = None
+                self.condition.notify_all()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+    # Function for getting the number of threads waiting for the lock
+    def queue_length(self):
+        with self.condition:
+            return len(self.waiting)
+
+    # Function for setting the priority of the requests this thread makes
+    # within a 'with' block, eg. with modem.priority(commandscheduler.LOW): ...
+    @contextlib.contextmanager
+    def priority(self, level):
+        previous = getattr(self.local, "priority", None)
+        self.local.priority = level
+        try:
+            yield
+        finally:
+            self.local.priority = previous
+
+    # Function for getting the priority set by priority() for this thread, or NORMAL
+    def get_priority(self, default=NORMAL):
+        level = getattr(self.local, "priority", None)
+        return default if level is None else level
+
+
+class CommandScheduler:
+
+    running = False
+
+    # Initializer function
+    # 'modem' is the CellularModem to run commands on. 'workers' threads take commands
+    # from the queue, most urgent first; the port itself is granted by the modem's lock
+    def __init__(self, modem, workers=2):
+        self.modem = modem
+        self.condition = threading.Condition()
+        # Heap of (priority, ticket, future, arguments), one per queued command
+        self.jobs = []
+        self.tickets = itertools.count()
+        self.threads = []
+        self.running = True
+        for index in range(workers):
+            thread = threading.Thread(target=self.run, name="command-scheduler-" + str(index), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    # Function for queueing a command. 'priority' defaults to the command's, see
+    # CellularModem.get_command_priority(). 'deadline' is a time from modem.millis()
+    # by which the command must have been sent, or it isn't. Returns a Future whose
+    # result is ("OK", response), ("ERROR", response) or ("TIMEOUT", response)
+    def submit(self, command, desired_response="OK\r\n", timeout=None, priority=None, deadline=None, is_command=True):
+        if priority is None:
+            priority = self.modem.get_command_priority(command)
+        future = Future()
+        with self.condition:
+            if not self.running:
+                raise RuntimeError("command scheduler stopped")
+            heapq.heappush(self.jobs, (priority, next(self.tickets), future,
+                                       (command, is_command, desired_response, timeout, priority, deadline)))
+            self.condition.notify()
+        return future
+
+    # Function for stopping the worker threads. Commands still queued are cancelled
+    def stop(self):
+        with self.condition:
+            self.running = False
+            jobs = self.jobs
+            self.jobs = []
+            self.condition.notify_all()
+        for job in jobs:
+            job[2].cancel()
+        for thread in self.threads:
+            if thread is not threading.current_thread():
+                thread.join()
+        self.threads = []
+
+    # Worker thread main loop
+    def run(self):
+        while True:
+            with self.condition:
+                while self.running and len(self.jobs) == 0:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                future, arguments = heapq.heappop(self.jobs)[2:]
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(self.modem.send_and_wait(*arguments))
+            except Exception as exp:
+                future.set_exception(exp)
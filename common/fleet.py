@@ -0,0 +1,274 @@
+'''
+  Fleet manager for gateways with several cellular modems.
+  ---
+  Runs each modem, a CellularIoT, UbloxLaraR2 or other CellularModem, in
+  a worker thread of its own, so every radio works through its own
+  command channel at the same time. Jobs are sent to the least busy of
+  the registered modems whose signal is close to the best, and the
+  fleet reports health and throughput per modem and in total. Each
+  worker boots its modem (see CellularModem.boot(), which uses a modem
+  that is already on as it is) before checking its status, and start()
+  returns once every worker has done so, so jobs can be submitted at once.
+
+  Usage:
+      fleet = Fleet()
+      fleet.discover(["/dev/ttyUSB*", "/dev/ttyS0"], CellularIoT)
+      fleet.start()
+      future = fleet.submit(lambda modem: modem.http_session().get(url))
+      print(future.result(), fleet.health())
+'''
+
+import glob
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class ModemWorker(threading.Thread):
+
+    # Seconds between status checks while idle
+    status_interval = 30
+
+    # Initializer function
+    # With 'boot', the modem is booted on the worker's thread before its first status check
+    def __init__(self, name, modem, status_interval=30, boot=True):
+        super().__init__(name=name, daemon=True)
+        self.modem = modem
+        self.status_interval = status_interval
+        self.boot = boot
+        # Set once the first status check is done
+        self.ready = threading.Event()
+        self.jobs = queue.Queue()
+        self.running = False
+        self.lock = threading.Lock()
+        # Status, from the last check
+        self.booted = False
+        self.registered = False
+        self.rssi = None
+        self.checked_at = 0
+        # Statistics
+        self.busy = False
+        self.completed = 0
+        self.failed = 0
+        self.bytes = 0
+        self.busy_time = 0.0
+        self.started_at = time.monotonic()
+
+    # Function for queueing a job: a callable taking the modem.
+    # 'size' is the number of bytes the job moves, for the throughput figures
+    def submit(self, job, size=0):
+        future = Future()
+        self.jobs.put((job, size, future))
+        return future
+
+    # Function for getting the number of jobs queued or running
+    def pending(self):
+        return self.jobs.qsize() + (1 if self.busy else 0)
+
+    # Function for stopping the worker once its queued jobs are done
+    def stop(self):
+        self.running = False
+        self.jobs.put(None)
+
+    # Worker thread main loop
+    def run(self):
+        self.running = True
+        try:
+            if self.boot:
+                self.boot_modem()
+            self.check_status()
+        finally:
+            self.ready.set()
+        while self.running:
+            try:
+                item = self.jobs.get(timeout=self.status_interval)
+            except queue.Empty:
+                if self.boot and not self.booted:
+                    self.boot_modem()
+                self.check_status()
+                continue
+            if item is None:
+                continue
+            job, size, future = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            self.busy = True
+            start = time.monotonic()
+            try:
+                result = job(self.modem)
+            except Exception as exp:
+                with self.lock:
+                    self.failed += 1
+                future.set_exception(exp)
+            else:
+                with self.lock:
+                    self.completed += 1
+                    self.bytes += size
+                future.set_result(result)
+            finally:
+                with self.lock:
+                    self.busy_time += time.monotonic() - start
+                self.busy = False
+            if time.monotonic() - self.checked_at >= self.status_interval:
+                self.check_status()
+
+    # Function for booting the modem. A modem that doesn't start stays unregistered,
+    # and is booted again at the next status check
+    def boot_modem(self):
+        try:
+            self.modem.boot()
+            self.booted = True
+        except Exception as exp:
+            self.modem.debug_print(exp)
+
+    # Function for reading the modem's registration and signal strength in one round trip
+    def check_status(self):
+        try:
+            results = self.modem.send_batch(["AT+CSQ", "AT+CEREG?", "AT+CREG?"])
+        except Exception as exp:
+            self.modem.debug_print(exp)
+            self.registered = False
+            return
+        registered = False
+        rssi = None
+        for result in results:
+            if result[0] != "OK":
+                continue
+            for line in result[1].split("\r\n"):
+                if line.startswith("+CSQ: "):
+                    value = int(line[6:].split(",")[0])
+                    # 99 means not known
+                    rssi = value if value != 99 else None
+                elif line.startswith("+CEREG: ") or line.startswith("+CREG: "):
+                    fields = line.split(": ")[1].split(",")
+                    # Registered on the home network (1) or roaming (5)
+                    if len(fields) > 1 and fields[1].strip() in ("1", "5"):
+                        registered = True
+        self.registered = registered
+        self.rssi = rssi
+        self.checked_at = time.monotonic()
+
+    # Function for getting the worker's health and throughput
+    def health(self):
+        with self.lock:
+            elapsed = max(time.monotonic() - self.started_at, 0.001)
+            jobs = self.completed + self.failed
+            return {
+                "port": getattr(getattr(self.modem, "uart", None), "port", None),
+                "alive": self.is_alive(),
+                "registered": self.registered,
+                "rssi": self.rssi,
+                "pending": self.pending(),
+                "completed": self.completed,
+                "failed": self.failed,
+                "bytes": self.bytes,
+                "bytes_per_second": self.bytes / elapsed,
+                "average_job_seconds": self.busy_time / jobs if jobs > 0 else None,
+                "utilisation": self.busy_time / elapsed
+            }
+
+
+class Fleet:
+
+    # Modems whose RSSI is within this many steps (2dB each) of the best are treated as equal
+    signal_margin = 4
+
+    # Initializer function
+    # With 'boot', each worker boots its modem first; without, the caller must have
+    def __init__(self, status_interval=30, signal_margin=4, boot=True):
+        self.status_interval = status_interval
+        self.signal_margin = signal_margin
+        self.boot = boot
+        self.workers = {}
+        self.lock = threading.Lock()
+
+    # Function for adding a modem, returning its worker. The worker is started
+    # at once if the fleet is already running
+    def add(self, modem, name=None):
+        with self.lock:
+            if name is None:
+                name = getattr(getattr(modem, "uart", None), "port", None) or "modem" + str(len(self.workers))
+            worker = ModemWorker(name, modem, self.status_interval, self.boot)
+            self.workers[name] = worker
+            if any([other.is_alive() for other in self.workers.values() if other is not worker]):
+                worker.start()
+            return worker
+
+    # Function for adding a modem for every serial device that exists.
+    # 'devices' are paths or glob patterns, eg. "/dev/ttyUSB*"; 'factory' makes
+    # a modem for a port, eg. the driver class. Returns the workers added
+    def discover(self, devices, factory):
+        added = []
+        for pattern in devices:
+            for port in sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]:
+                if os.path.exists(port) and port not in self.workers:
+                    added.append(self.add(factory(port), port))
+        return added
+
+    # Function for starting every worker and waiting, up to 'timeout' seconds in all,
+    # until each has booted its modem and checked its status. Returns the number of
+    # registered modems
+    def start(self, timeout=None):
+        with self.lock:
+            workers = list(self.workers.values())
+            for worker in workers:
+                if not worker.is_alive():
+                    worker.start()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for worker in workers:
+            worker.ready.wait(None if deadline is None else max(0, deadline - time.monotonic()))
+        return len([worker for worker in workers if worker.registered])
+
+    # Function for stopping every worker, waiting up to 'timeout' seconds for each
+    def stop(self, timeout=None):
+        with self.lock:
+            workers = list(self.workers.values())
+        for worker in workers:
+            worker.stop()
+        for worker in workers:
+            if worker.is_alive():
+                worker.join(timeout)
+
+    # Function for choosing a worker: the least busy of the registered modems
+    # whose signal is within the margin of the best. Returns None if none is registered
+    def choose(self):
+        with self.lock:
+            candidates = [worker for worker in self.workers.values() if worker.is_alive() and worker.registered]
+        if len(candidates) == 0:
+            return None
+        signals = [worker.rssi for worker in candidates if worker.rssi is not None]
+        if len(signals) > 0:
+            best = max(signals)
+            strong = [worker for worker in candidates if worker.rssi is not None and worker.rssi >= best - self.signal_margin]
+            candidates = strong
+        return min(candidates, key=lambda worker: (worker.pending(), -(worker.rssi or 0)))
+
+    # Function for queueing a job, a callable taking a modem, on the best modem.
+    # Returns a concurrent.futures.Future for the job's result. Raises IOError if
+    # no modem is registered
+    def submit(self, job, size=0):
+        worker = self.choose()
+        if worker is None:
+            raise IOError("No registered modem")
+        return worker.submit(job, size)
+
+    # Function for running a job on the best modem and waiting for its result
+    def run(self, job, size=0, timeout=None):
+        return self.submit(job, size).result(timeout)
+
+    # Function for getting the health of every modem, and totals for the fleet
+    def health(self):
+        with self.lock:
+            modems = dict([(name, worker.health()) for name, worker in self.workers.items()])
+        entries = list(modems.values())
+        return {
+            "modems": modems,
+            "registered": len([entry for entry in entries if entry["registered"]]),
+            "pending": sum([entry["pending"] for entry in entries]),
+            "completed": sum([entry["completed"] for entry in entries]),
+            "failed": sum([entry["failed"] for entry in entries]),
+            "bytes": sum([entry["bytes"] for entry in entries]),
+            "bytes_per_second": sum([entry["bytes_per_second"] for entry in entries])
+        }
@@ -0,0 +1,405 @@
+'''
+  Hardware backends for the cellular modem drivers.
+  ---
+  The drivers reach GPIO and the serial port only through these
+  backends, each of which imports its library when first used, so the
+  drivers import quickly and work on hosts without RPi.GPIO. Every GPIO
+  backend records the pins it has claimed and releases only those.
+
+  GPIO backends, chosen by name or by $MODEM_GPIO_BACKEND:
+      "rpi"     RPi.GPIO
+      "gpiod"   libgpiod's Python bindings
+      "sysfs"   the /sys/class/gpio interface
+      "none"    no GPIO, eg. a USB modem: the modem is assumed to be powered
+      "fake"    in memory, for tests and the emulator
+  With no name, the first of "rpi", "gpiod" and "sysfs" that works is used,
+  falling back to "none".
+
+  Serial ports are pyserial's, except "fd://<n>": a file descriptor that
+  is already open and set up, eg. the port pppd hands its connect program,
+  which is used as it is.
+'''
+
+import importlib
+import os
+import select
+import time
+
+# Edges to wait for
+RISING = "rising"
+FALLING = "falling"
+
+
+class GPIOBackend:
+
+    # Whether the backend drives real pins
+    has_gpio = True
+
+    # Initializer function
+    def __init__(self):
+        self.claimed = {}
+
+    # Function for claiming a pin as an output, driving it to 'initial' if given
+    def setup_output(self, pin, initial=None):
+        self.claimed[pin] = "out"
+
+    # Function for claiming a pin as an input
+    def setup_input(self, pin):
+        self.claimed[pin] = "in"
+
+    # Function for driving an output pin high (1) or low (0)
+    def output(self, pin, level):
+        pass
+
+    # Function for reading a pin. Returns 1, 0 or None if the level can't be known
+    def input(self, pin):
+        return None
+
+    # Function for waiting up to 'timeout' seconds for an edge on an input pin.
+    # Returns True if the edge came
+    def wait_for_edge(self, pin, edge, timeout):
+        return False
+
+    # Function for turning warnings about pins already in use on or off
+    def set_warnings(self, state):
+        pass
+
+    # Function for releasing the claimed pins, or just those given
+    def release(self, pins=None):
+        for pin in list(self.claimed.keys()) if pins is None else pins:
+            self.claimed.pop(pin, None)
+
+
+class RPiGPIOBackend(GPIOBackend):
+
+    # Initializer function
+    def __init__(self):
+        super().__init__()
+        self.GPIO = importlib.import_module("RPi.GPIO")
+        self.GPIO.setmode(self.GPIO.BCM)
+
+    def setup_output(self, pin, initial=None):
+        if initial is None:
+            self.GPIO.setup(pin, self.GPIO.OUT)
+        else:
+            self.GPIO.setup(pin, self.GPIO.OUT, initial=initial)
+        super().setup_output(pin, initial)
+
+    def setup_input(self, pin):
+        self.GPIO.setup(pin, self.GPIO.IN)
+        super().setup_input(pin)
+
+    def output(self, pin, level):
+        self.GPIO.output(pin, level)
+
+    def input(self, pin):
+        return 1 if self.GPIO.input(pin) else 0
+
+    def wait_for_edge(self, pin, edge, timeout):
+        kind = self.GPIO.FALLING if edge == FALLING else self.GPIO.RISING
+        return self.GPIO.wait_for_edge(pin, kind, timeout=max(1, int(timeout * 1000))) is not None
+
+    def set_warnings(self, state):
+        self.GPIO.setwarnings(state)
+
+    def release(self, pins=None):
+        pins = list(self.claimed.keys()) if pins is None else list(pins)
+        pins = [pin for pin in pins if pin in self.claimed]
+        if len(pins) > 0:
+            self.GPIO.cleanup(pins)
+        super().release(pins)
+
+
+class GpiodBackend(GPIOBackend):
+
+    # Initializer function
+    def __init__(self, chip="gpiochip0"):
+        super().__init__()
+        self.gpiod = importlib.import_module("gpiod")
+        self.chip = self.gpiod.Chip(chip)
+        self.lines = {}
+
+    # Function for requesting a line with the given type and, for outputs, default value
+    def request(self, pin, kind, default=0):
+        if pin in self.lines:
+            self.lines[pin].release()
+        line = self.chip.get_line(pin)
+        if kind == self.gpiod.LINE_REQ_DIR_OUT:
+            line.request(consumer="cellular-iot", type=kind, default_vals=[default])
+        else:
+            line.request(consumer="cellular-iot", type=kind)
+        self.lines[pin] = line
+        return line
+
+    def setup_output(self, pin, initial=None):
+        self.request(pin, self.gpiod.LINE_REQ_DIR_OUT, initial or 0)
+        super().setup_output(pin, initial)
+
+    def setup_input(self, pin):
+        self.request(pin, self.gpiod.LINE_REQ_DIR_IN)
+        super().setup_input(pin)
+
+    def output(self, pin, level):
+        self.lines[pin].set_value(1 if level else 0)
+
+    def input(self, pin):
+        return self.lines[pin].get_value()
+
+    def wait_for_edge(self, pin, edge, timeout):
+        # Edge events need the line requested for them; it goes back to a plain input after
+        kind = self.gpiod.LINE_REQ_EV_FALLING_EDGE if edge == FALLING else self.gpiod.LINE_REQ_EV_RISING_EDGE
+        line = self.request(pin, kind)
+        try:
+            seconds = int(timeout)
+            return line.event_wait(sec=seconds, nsec=int((timeout - seconds) * 1000000000))
+        finally:
+            self.request(pin, self.gpiod.LINE_REQ_DIR_IN)
+
+    def release(self, pins=None):
+        pins = list(self.claimed.keys()) if pins is None else list(pins)
+        for pin in pins:
+            line = self.lines.pop(pin, None)
+            if line is not None:
+                line.release()
+        super().release(pins)
+
+
+class SysfsGPIOBackend(GPIOBackend):
+
+    ROOT = "/sys/class/gpio"
+
+    # Initializer function
+    def __init__(self):
+        super().__init__()
+        if not os.path.isdir(self.ROOT):
+            raise IOError(self.ROOT + " not available")
+        self.exported = []
+
+    # Function for writing a value to a sysfs file
+    def write(self, path, value):
+        with open(path, "w") as file:
+            file.write(str(value))
+
+    # Function for getting the path of a pin's attribute, exporting the pin if necessary
+    def path(self, pin, name):
+        directory = self.ROOT + "/gpio" + str(pin)
+        if not os.path.isdir(directory):
+            self.write(self.ROOT + "/export", pin)
+            self.exported.append(pin)
+            # udev may take a moment to make the files writable
+            deadline = time.monotonic() + 1
+            while not os.access(directory + "/direction", os.W_OK) and time.monotonic() < deadline:
+                time.sleep(0.01)
+        return directory + "/" + name
+
+    def setup_output(self, pin, initial=None):
+        self.write(self.path(pin, "direction"), "high" if initial else "low")
+        super().setup_output(pin, initial)
+
+    def setup_input(self, pin):
+        self.write(self.path(pin, "direction"), "in")
+        super().setup_input(pin)
+
+    def output(self, pin, level):
+        self.write(self.path(pin, "value"), 1 if level else 0)
+
+    def input(self, pin):
+        with open(self.path(pin, "value")) as file:
+            return int(file.read().strip())
+
+    def wait_for_edge(self, pin, edge, timeout):
+        self.write(self.path(pin, "edge"), edge)
+        try:
+            with open(self.path(pin, "value")) as file:
+                # The first read clears the pending state; an edge then flags an exceptional condition
+                file.read()
+                poller = select.poll()
+                poller.register(file, select.POLLPRI | select.POLLERR)
+                return len(poller.poll(max(1, int(timeout * 1000)))) > 0
+        finally:
+            self.write(self.path(pin, "edge"), "none")
+
+    def release(self, pins=None):
+        pins = list(self.claimed.keys()) if pins is None else list(pins)
+        for pin in pins:
+            if pin in self.exported:
+                self.write(self.ROOT + "/unexport", pin)
+                self.exported.remove(pin)
+        super().release(pins)
+
+
+class NoGPIOBackend(GPIOBackend):
+
+    has_gpio = False
+
+
+class FakeGPIOBackend(GPIOBackend):
+
+    # Initializer function
+    def __init__(self):
+        super().__init__()
+        self.levels = {}
+
+    def setup_output(self, pin, initial=None):
+        self.levels[pin] = 1 if initial else 0
+        super().setup_output(pin, initial)
+
+    def setup_input(self, pin):
+        self.levels.setdefault(pin, 0)
+        super().setup_input(pin)
+
+    def output(self, pin, level):
+        self.levels[pin] = 1 if level else 0
+
+    def input(self, pin):
+        return self.levels.get(pin, 0)
+
+    # Function for setting the level an input pin will read: for tests
+    def set_input(self, pin, level):
+        self.levels[pin] = 1 if level else 0
+
+    # Levels never change by themselves here, so the edge has come if the pin
+    # is already at the level it leads to; otherwise the wait lasts the whole timeout
+    def wait_for_edge(self, pin, edge, timeout):
+        if self.levels.get(pin, 0) == (0 if edge == FALLING else 1):
+            return True
+        time.sleep(timeout)
+        return False
+
+    def release(self, pins=None):
+        for pin in list(self.claimed.keys()) if pins is None else pins:
+            self.levels.pop(pin, None)
+        super().release(pins)
+
+
+GPIO_BACKENDS = {
+    "rpi": RPiGPIOBackend,
+    "gpiod": GpiodBackend,
+    "sysfs": SysfsGPIOBackend,
+    "none": NoGPIOBackend,
+    "fake": FakeGPIOBackend
+}
+
+
+# Function for creating a GPIO backend by name, by $MODEM_GPIO_BACKEND or,
+# failing both, the first that works on this host
+def load_gpio_backend(name=None):
+    if name is None:
+        name = os.environ.get("MODEM_GPIO_BACKEND")
+    if name is not None:
+        return GPIO_BACKENDS[name]()
+    for name in ("rpi", "gpiod", "sysfs"):
+        try:
+            return GPIO_BACKENDS[name]()
+        except (ImportError, IOError, OSError, RuntimeError):
+            continue
+    return NoGPIOBackend()
+
+
+class FileSerial:
+
+    timeout = None # Seconds, as for pyserial: None blocks and 0 doesn't wait
+
+    # Initializer function
+    # 'fd' is an open descriptor for the port. Its termios settings, eg. its speed
+    # and flow control, belong to whoever opened it and are left alone
+    def __init__(self, fd):
+        self.fd = fd
+        self.is_open = True
+
+    # The port's speed, as set by whoever opened it
+    @property
+    def baudrate(self):
+        termios = importlib.import_module("termios")
+        speed = termios.tcgetattr(self.fd)[5]
+        for name in dir(termios):
+            if name.startswith("B") and name[1:].isdigit() and getattr(termios, name) == speed:
+                return int(name[1:])
+        return None
+
+    # Whether the port uses RTS/CTS flow control, as set by whoever opened it
+    @property
+    def rtscts(self):
+        termios = importlib.import_module("termios")
+        return (termios.tcgetattr(self.fd)[2] & termios.CRTSCTS) != 0
+
+    # The CTS line isn't visible through a descriptor alone
+    @property
+    def cts(self):
+        return False
+
+    # The number of bytes waiting to be read
+    @property
+    def in_waiting(self):
+        fcntl = importlib.import_module("fcntl")
+        termios = importlib.import_module("termios")
+        waiting = fcntl.ioctl(self.fd, termios.FIONREAD, b"\0\0\0\0")
+        return int.from_bytes(waiting, "little")
+
+    # Function for checking whether the port is open
+    def isOpen(self):
+        return self.is_open
+
+    # Function for opening the port: the descriptor is open already
+    def open(self):
+        pass
+
+    # Function for closing the port. The descriptor belongs to whoever opened it, so is left open
+    def close(self):
+        self.is_open = False
+
+    # Function for getting the descriptor, eg. to select() on
+    def fileno(self):
+        return self.fd
+
+    # Function for reading up to 'size' bytes, waiting up to self.timeout for them
+    def read(self, size=1):
+        data = b""
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        while len(data) < size:
+            remaining = None if deadline is None else max(0, deadline - time.monotonic())
+            readable = select.select([self.fd], [], [], remaining)[0]
+            if len(readable) == 0:
+                break
+            chunk = os.read(self.fd, size - len(data))
+            if len(chunk) == 0:
+                break
+            data += chunk
+        return data
+
+    # Function for writing all of 'data'. Returns its length
+    def write(self, data):
+        view = memoryview(data)
+        while len(view) > 0:
+            view = view[os.write(self.fd, view):]
+        return len(data)
+
+    # Writes aren't buffered, so there's nothing to flush
+    def flush(self):
+        pass
+
+    # Function for discarding input that has arrived but not been read
+    def reset_input_buffer(self):
+        termios = importlib.import_module("termios")
+        termios.tcflush(self.fd, termios.TCIFLUSH)
+
+
+# Function for creating, but not opening, a serial port. 'port' may be a device,
+# a pyserial URL, eg. "socket://gateway:7000" or "loop://", or "fd://<n>" for a
+# FileSerial on descriptor n, in which case the other settings are ignored
+def create_serial(port, baudrate=115200, rtscts=False, dsrdtr=False):
+    if port.startswith("fd://"):
+        return FileSerial(int(port[5:]))
+    serial = importlib.import_module("serial")
+    if port.find("://") != -1:
+        uart = serial.serial_for_url(port, do_not_open=True)
+    else:
+        uart = serial.Serial()
+        uart.port = port
+    uart.baudrate = baudrate
+    uart.parity = serial.PARITY_NONE
+    uart.stopbits = serial.STOPBITS_ONE
+    uart.bytesize = serial.EIGHTBITS
+    uart.rtscts = rtscts
+    uart.dsrdtr = dsrdtr
+    return uart
@@ -0,0 +1,151 @@
+'''
+  Persistent data connection and HTTP session base for the modem drivers.
+  ---
+  Keeps the PDP context and the modem's HTTP configuration alive across
+  requests, checks the context cheaply before each request rather than
+  re-activating it, and tears it down only once the session has been
+  idle for 'idle_timeout' seconds. Subclasses supply the modem-specific
+  commands.
+'''
+
+import time
+
+
+class HTTPSession:
+
+    modem = None
+    idle_timeout = 300 # seconds
+    context_open = False
+    last_used = 0
+
+    # Initializer function
+    def __init__(self, modem, idle_timeout=300):
+        self.modem = modem
+        self.idle_timeout = idle_timeout
+        # The URL, or host, last sent to the modem
+        self.url = None
+
+    # Function for making an HTTP GET request, opening the context if necessary.
+    # Returns a tuple: ("OK", HTTP status code or None, body) or (error state, None, response)
+    def get(self, url):
+        result = self.stream(url)
+        if result[0] != "OK":
+            return result
+        try:
+            body = b"".join(result[2])
+        except IOError as exp:
+            self.context_open = False
+            return ("ERROR", result[1], str(exp))
+        return ("OK", result[1], body.decode('utf-8', errors='ignore'))
+
+    # Function for making an HTTP POST request with 'body', str or bytes, opening the
+    # context if necessary. Returns ("OK", HTTP status code or None, "") or
+    # (error state, None, response)
+    def post(self, url, body, content_type="text/plain"):
+        if not self.ensure_context():
+            return ("ERROR", None, "PDP context not active")
+        if isinstance(body, str):
+            body = body.encode()
+        result = self.request_post(url, body, content_type)
+        self.last_used = time.monotonic()
+        if result[0] != "OK":
+            self.context_open = False
+        return result
+
+    # Function for sending the payloads queued in an Outbox in as few requests as
+    # possible, each POST carrying up to 'batch_bytes' of them, one per line.
+    # Stops at the first request that fails, leaving the rest queued.
+    # Returns the number of payloads sent
+    def upload(self, outbox, url, batch_bytes=65536, content_type="text/plain"):
+
+        def send(batch):
+            result = self.post(url, b"\n".join(batch) + b"\n", content_type)
+            return result[0] == "OK" and (result[1] is None or 200 <= result[1] < 300)
+
+        return outbox.drain(send, batch_bytes)
+
+    # Function for making an HTTP GET request whose body is read on demand.
+    # Returns a tuple: ("OK", HTTP status code or None, iterator of bytes blocks)
+    # or (error state, None, response). The iterator raises IOError if the read fails.
+    # It may hold the modem until exhausted, so read it to the end or close() it
+    def stream(self, url, block_size=1024):
+        if not self.ensure_context():
+            return ("ERROR", None, "PDP context not active")
+        result = self.request(url)
+        self.last_used = time.monotonic()
+        if result[0] != "OK":
+            # Check the context properly next time
+            self.context_open = False
+            return result
+        return ("OK", result[1], self.read_body(result[2], block_size))
+
+    # Function for making sure the PDP context is up, activating it only if necessary
+    def ensure_context(self):
+        if self.context_active():
+            if not self.context_open:
+                self.context_open = True
+                self.configure()
+            return True
+        self.context_open = False
+        self.modem.debug_print("Activating PDP context")
+        if not self.open_context():
+            return False
+        # The modem forgets the request URL with the context
+        self.url = None
+        self.context_open = True
+        self.configure()
+        self.last_used = time.monotonic()
+        return True
+
+    # Function for closing the session and deactivating the context
+    def close(self):
+        if self.context_open:
+            self.close_context()
+        self.context_open = False
+        self.url = None
+
+    # Function for closing the session if it has been idle for longer than the idle timeout
+    def close_if_idle(self):
+        if self.context_open and time.monotonic() - self.last_used >= self.idle_timeout:
+            self.modem.debug_print("Session idle, closing PDP context")
+            self.close()
+
+    # Function for pausing between requests, closing the session if it goes idle meanwhile
+    def wait(self, seconds):
+        end = time.monotonic() + seconds
+        if self.context_open:
+            idle_at = self.last_used + self.idle_timeout
+            if idle_at < end:
+                time.sleep(max(0, idle_at - time.monotonic()))
+                self.close_if_idle()
+        time.sleep(max(0, end - time.monotonic()))
+
+    # Function for checking whether the PDP context is active: override in subclasses
+    def context_active(self):
+        return self.context_open
+
+    # Function for activating the PDP context: override in subclasses
+    def open_context(self):
+        return True
+
+    # Function for deactivating the PDP context: override in subclasses
+    def close_context(self):
+        pass
+
+    # Function for setting up the HTTP profile once the context is up: override in subclasses
+    def configure(self):
+        pass
+
+    # Function for making the request itself: override in subclasses.
+    # Returns ("OK", HTTP status code or None, content length or None) on success
+    def request(self, url):
+        return ("ERROR", None, "")
+
+    # Function for making a POST request: override in subclasses.
+    # Returns ("OK", HTTP status code or None, "") on success
+    def request_post(self, url, body, content_type):
+        return ("ERROR", None, "")
+
+    # Function for reading the body of the last response: override in subclasses
+    def read_body(self, length, block_size):
+        return iter(())
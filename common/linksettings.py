@@ -0,0 +1,90 @@
+'''
+  Saved serial link settings for the cellular modem drivers.
+  ---
+  CellularModem.negotiate_link() finds the fastest baud rate, and whether
+  RTS/CTS flow control is wired, for a modem's serial port. The modem
+  keeps the result in its own profile, with AT&W, and this file keeps
+  it on the host, so the next driver created for the port starts at the
+  same settings without them being passed to its constructor.
+
+  The settings are a JSON object keyed by serial port, stored in
+  $MODEM_LINK_SETTINGS or, if that isn't set, ~/.cellular-iot/link.json:
+      {"/dev/ttyS0": {"baudrate": 921600, "rtscts": true}}
+
+  Programs that open the port themselves must use the same settings.
+  This module prints a port's as pppd options, for its options file, eg.
+  bg96/ppp/twilio, or its command line:
+      python3 common/linksettings.py /dev/ttyS0
+      sudo pppd call twilio $(python3 common/linksettings.py /dev/ttyS0)
+'''
+
+import json
+import os
+import sys
+
+DEFAULT_PATH = os.path.join("~", ".cellular-iot", "link.json")
+
+
+class LinkSettings:
+
+    # Initializer function
+    def __init__(self, path=None):
+        if path is None:
+            path = os.environ.get("MODEM_LINK_SETTINGS", DEFAULT_PATH)
+        self.path = os.path.expanduser(path)
+
+    # Function for reading every port's settings. Returns {} if there are none
+    # or the file can't be read
+    def read_all(self):
+        try:
+            with open(self.path) as file:
+                settings = json.load(file)
+        except (IOError, OSError, ValueError):
+            return {}
+        return settings if isinstance(settings, dict) else {}
+
+    # Function for getting a port's settings: a dict with "baudrate" and "rtscts",
+    # or None if none have been saved
+    def load(self, port):
+        settings = self.read_all().get(port)
+        if not isinstance(settings, dict) or "baudrate" not in settings:
+            return None
+        return {"baudrate": int(settings["baudrate"]), "rtscts": bool(settings.get("rtscts", False))}
+
+    # Function for saving a port's settings. The file is replaced in one step,
+    # so a reader never sees it half written
+    def save(self, port, baudrate, rtscts):
+        settings = self.read_all()
+        settings[port] = {"baudrate": baudrate, "rtscts": rtscts}
+        self.write_all(settings)
+
+    # Function for removing a port's settings, eg. after a factory reset of the modem
+    def forget(self, port):
+        settings = self.read_all()
+        if settings.pop(port, None) is not None:
+            self.write_all(settings)
+
+    # Function for writing every port's settings
+    def write_all(self, settings):
+        directory = os.path.dirname(self.path)
+        if len(directory) > 0 and not os.path.isdir(directory):
+            os.makedirs(directory)
+        temporary = self.path + ".tmp"
+        with open(temporary, "w") as file:
+            json.dump(settings, file, indent=2, sort_keys=True)
+        os.replace(temporary, self.path)
+
+
+# Function for getting a port's settings as pppd options, eg. ["921600", "crtscts"].
+# A port with no saved settings gets the drivers' defaults, 115200 and no flow control
+def pppd_options(settings):
+    if settings is None:
+        settings = {"baudrate": 115200, "rtscts": False}
+    return [str(settings["baudrate"]), "crtscts" if settings["rtscts"] else "nocrtscts"]
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python3 linksettings.py <serial port>")
+        sys.exit(1)
+    print(" ".join(pppd_options(LinkSettings().load(sys.argv[1]))))
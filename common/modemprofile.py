@@ -0,0 +1,162 @@
+'''
+  Modem profile shared by the blocking and asyncio cellular modem drivers.
+  ---
+  Holds everything about a modem that doesn't involve waiting for it:
+  its dialect (timeouts, URCs, commands that can't be chained or
+  retried), its serial port settings, its pins, debug output and the
+  trace of its traffic (see wiretrace). CellularModem adds a blocking
+  AT command transport and AsyncCellularModem an asyncio one. Each
+  driver declares its modem's dialect and pins in a profile class
+  derived from ModemProfile, which both its transports then share, eg.
+  CellularIoT(BG96Profile, CellularModem).
+'''
+
+import os
+import time
+import hardware
+from linksettings import LinkSettings
+from wiretrace import WireTrace
+
+
+class ModemProfile:
+
+    gpio_device = None # see gpio
+    debug = True
+    timeout = 3 # Seconds
+    http_timeout = 60 # Seconds
+    trace = None # record of the traffic with the modem, see wiretrace
+    boot_timeout = 30 # Seconds
+    link_saved = False # whether the port's settings came from linksettings
+
+    # File dump_trace() writes to if none is given and $MODEM_TRACE_FILE isn't set
+    DEFAULT_TRACE_FILE = os.path.join("~", ".cellular-iot", "trace.bin")
+
+    # Serial port used if none is given and $MODEM_SERIAL_PORT isn't set
+    DEFAULT_SERIAL_PORT = "/dev/ttyS0"
+
+    # Baud rate used if none is given and none has been saved for the port
+    DEFAULT_BAUDRATE = 115200
+
+    # Baud rates negotiate_link() tries, fastest first
+    BAUDRATES = (115200,)
+
+    # Longest command line the modem accepts
+    MAX_LINE_LENGTH = 256
+
+    # Commands that must not be chained into one command line
+    NO_CHAIN_COMMANDS = ()
+
+    # Unsolicited result codes
+    URC_PREFIXES = ()
+
+    # Maximum response times, in seconds. Commands not listed here use self.timeout
+    COMMAND_TIMEOUTS = {}
+
+    # Commands whose response time is bounded by self.http_timeout
+    HTTP_COMMANDS = ()
+
+    # Commands that must not be re-sent after a timeout, as repeating them has side effects
+    NO_RETRY_COMMANDS = ()
+
+    # Initializer function
+    # 'serial_port' defaults to $MODEM_SERIAL_PORT, eg. an emulator's pty, or DEFAULT_SERIAL_PORT.
+    # 'serial_baudrate' and 'rtscts' default to those saved for the port by negotiate_link(),
+    # or DEFAULT_BAUDRATE and no flow control.
+    # 'gpio_backend' is a hardware.GPIOBackend or the name of one, eg. "none" for a USB modem;
+    # see hardware.load_gpio_backend(). Neither the port nor the GPIO library is touched
+    # until first used
+    def __init__(self, serial_port=None, serial_baudrate=None, rtscts=None, dsrdtr=False, gpio_backend=None):
+        if serial_port is None:
+            serial_port = os.environ.get("MODEM_SERIAL_PORT", self.DEFAULT_SERIAL_PORT)
+        self.serial_settings = (serial_port, serial_baudrate, rtscts, dsrdtr)
+        self.gpio_backend = gpio_backend
+        self.trace = WireTrace()
+
+    # Function for releasing the pins this instance claimed
+    def __del__(self):
+        self.release_pins()
+
+    # Function for creating the serial port, unopened, with the settings given to the
+    # initializer or, for those not given, the ones saved for the port
+    def create_serial(self):
+        port, baudrate, rtscts, dsrdtr = self.serial_settings
+        if baudrate is None or rtscts is None:
+            saved = LinkSettings().load(port)
+            self.link_saved = saved is not None
+            if saved is None:
+                saved = {"baudrate": self.DEFAULT_BAUDRATE, "rtscts": False}
+            baudrate = saved["baudrate"] if baudrate is None else baudrate
+            rtscts = saved["rtscts"] if rtscts is None else rtscts
+        return hardware.create_serial(port, baudrate, rtscts, dsrdtr)
+
+    # The GPIO backend, loaded when first used
+    @property
+    def gpio(self):
+        if self.gpio_device is None:
+            if isinstance(self.gpio_backend, hardware.GPIOBackend):
+                self.gpio_device = self.gpio_backend
+            else:
+                self.gpio_device = hardware.load_gpio_backend(self.gpio_backend)
+        return self.gpio_device
+
+    # Function for releasing the pins this instance claimed, if any
+    def release_pins(self):
+        if self.gpio_device is not None:
+            self.gpio_device.release()
+
+    # Function for configuring the modem's pins: override in profiles
+    def setup_pins(self):
+        pass
+
+    # Function for checking, without a command, whether the modem has power: override in profiles
+    def is_powered(self):
+        return True
+
+    # Function for printing debug message. Messages are also kept in the trace
+    def debug_print(self, message):
+        self.trace.note(message)
+        if self.debug:
+            print(message)
+
+    # Function to set debug state
+    def set_debug(self, state=True):
+        self.debug = state
+
+    # Function for writing the trace of the traffic with the modem to 'path', which
+    # defaults to $MODEM_TRACE_FILE or DEFAULT_TRACE_FILE, to be read with wiretrace.py.
+    # Returns the path
+    def dump_trace(self, path=None):
+        if path is None:
+            path = os.environ.get("MODEM_TRACE_FILE", self.DEFAULT_TRACE_FILE)
+        path = os.path.expanduser(path)
+        self.trace.dump(path)
+        return path
+
+    # Function for getting time in milliseconds.
+    # Uses the monotonic clock so deadlines are unaffected by wall-clock changes
+    def millis(self):
+        return int(time.monotonic() * 1000)
+
+    # Function for getting the default command timeout in seconds
+    def get_timeout(self):
+        return self.timeout
+
+    # Function for setting the default command timeout in seconds (fractions allowed)
+    def set_timeout(self, new_timeout):
+        self.timeout = new_timeout
+
+    # Function for getting the HTTP response timeout in seconds
+    def get_http_timeout(self):
+        return self.http_timeout
+
+    # Function for setting the HTTP response timeout in seconds
+    def set_http_timeout(self, new_timeout):
+        self.http_timeout = new_timeout
+
+    # Function for getting the timeout, in seconds, to apply to a given command.
+    # Commands not in COMMAND_TIMEOUTS get 'default', or self.timeout if it's None
+    def get_command_timeout(self, command, default=None):
+        name = str(command).strip().split("=", 1)[0].split("?", 1)[0].upper()
+        if name in self.HTTP_COMMANDS:
+            return self.http_timeout + self.timeout
+        return self.COMMAND_TIMEOUTS.get(name, self.timeout if default is None else default)
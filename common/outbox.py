@@ -0,0 +1,253 @@
+'''
+  Persistent outbound queue for the cellular modem drivers.
+  ---
+  Payloads are appended to a log on disk, so queueing one never waits
+  for the radio and survives a crash or a reboot. Once the connection
+  is back they are read out in large batches and removed only when a
+  batch has been sent, so a coverage gap costs no data and each
+  reconnect is spent on a few bulk uploads rather than many small ones.
+
+  The log is a directory of numbered segment files, each a run of
+  records: a 16-byte header (payload length, time queued, CRC-32) then
+  the payload. index.json holds the position of the oldest record not
+  yet sent. Whole segments are deleted once sent, or to keep the queue
+  within its size and age limits, oldest first. Delivery is at least
+  once: a batch sent just before a crash is sent again.
+
+  Usage:
+      outbox = Outbox("/var/lib/cellular-iot/outbox", max_bytes=8 * 1048576)
+      outbox.put(json.dumps(reading))
+      session.upload(outbox, "http://example.com/readings")
+'''
+
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+
+
+class Outbox:
+
+    segment_size = 1048576 # Bytes per segment file
+    max_bytes = 16777216 # Bytes queued before the oldest segments are dropped
+    max_age = 604800 # Seconds a payload is kept; None to keep it until sent
+    sync = True # Whether each put() is flushed to the disk itself
+
+    # Record header: payload length, time queued and the payload's CRC-32
+    HEADER = struct.Struct(">IdI")
+
+    # Initializer function
+    # 'segment_size' should be well below 'max_bytes', as segments are dropped whole
+    def __init__(self, directory, max_bytes=16777216, max_age=604800, segment_size=1048576, sync=True):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.segment_size = segment_size
+        self.sync = sync
+        self.lock = threading.Lock()
+        # Statistics
+        self.dropped_bytes = 0
+        self.dropped_records = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.segments = sorted([int(name[:-4]) for name in os.listdir(directory)
+                                if name.endswith(".log") and name[:-4].isdigit()])
+        self.position = self.read_index()
+        self.writer = None
+        self.writer_size = 0
+        self.recover()
+
+    # Function for getting the path of a segment file
+    def segment_path(self, segment):
+        return os.path.join(self.directory, format(segment, "08d") + ".log")
+
+    # Function for reading the position of the oldest unsent record: (segment, offset)
+    def read_index(self):
+        try:
+            with open(os.path.join(self.directory, "index.json")) as file:
+                index = json.load(file)
+            position = (int(index["segment"]), int(index["offset"]))
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            position = (0, 0)
+        if len(self.segments) > 0 and position[0] not in self.segments:
+            position = (self.segments[0], 0) if position[0] < self.segments[0] else position
+        return position
+
+    # Function for saving the position of the oldest unsent record. The file is
+    # replaced in one step, so a crash leaves the old index or the new one
+    def write_index(self):
+        path = os.path.join(self.directory, "index.json")
+        with open(path + ".tmp", "w") as file:
+            json.dump({"segment": self.position[0], "offset": self.position[1]}, file)
+            file.flush()
+            if self.sync:
+                os.fsync(file.fileno())
+        os.replace(path + ".tmp", path)
+
+    # Function for cutting a record left half written by a crash off the newest segment,
+    # and opening it for appending
+    def recover(self):
+        if len(self.segments) == 0:
+            return
+        segment = self.segments[-1]
+        path = self.segment_path(segment)
+        end = 0
+        with open(path, "rb") as file:
+            for record in self.scan(file, 0):
+                end = record[0]
+        if end < os.path.getsize(path):
+            with open(path, "r+b") as file:
+                file.truncate(end)
+        self.writer = open(path, "ab")
+        self.writer_size = end
+
+    # Function for reading the records of an open segment from 'offset', yielding
+    # (offset after the record, time queued, payload). Stops at a damaged or partial record
+    def scan(self, file, offset):
+        file.seek(offset)
+        while True:
+            header = file.read(self.HEADER.size)
+            if len(header) < self.HEADER.size:
+                return
+            length, queued, checksum = self.HEADER.unpack(header)
+            payload = file.read(length)
+            if len(payload) < length or zlib.crc32(payload) != checksum:
+                return
+            offset += self.HEADER.size + length
+            yield (offset, queued, payload)
+
+    # Function for starting a new segment
+    def roll(self):
+        if self.writer is not None:
+            self.writer.close()
+        segment = self.segments[-1] + 1 if len(self.segments) > 0 else 1
+        self.segments.append(segment)
+        if len(self.segments) == 1:
+            self.position = (segment, 0)
+        self.writer = open(self.segment_path(segment), "ab")
+        self.writer_size = 0
+
+    # Function for queueing a payload, str or bytes. Only the disk is touched
+    def put(self, payload):
+        if isinstance(payload, str):
+            payload = payload.encode()
+        record = self.HEADER.pack(len(payload), time.time(), zlib.crc32(payload)) + payload
+        with self.lock:
+            if self.writer is None or (self.writer_size > 0 and self.writer_size + len(record) > self.segment_size):
+                self.roll()
+            self.writer.write(record)
+            self.writer.flush()
+            if self.sync:
+                os.fsync(self.writer.fileno())
+            self.writer_size += len(record)
+            self.evict()
+
+    # Function for getting the number of bytes queued, headers included
+    def size(self):
+        with self.lock:
+            return self.queued_bytes()
+
+    # Function for checking whether anything is queued
+    def empty(self):
+        return self.size() == 0
+
+    # Function for counting the bytes queued; call with the lock held
+    def queued_bytes(self):
+        total = 0
+        for segment in self.segments:
+            if segment >= self.position[0]:
+                total += self.writer_size if segment == self.segments[-1] else os.path.getsize(self.segment_path(segment))
+        return total - self.position[1]
+
+    # Function for dropping the oldest segments while the queue is over its size
+    # limit, or they hold nothing younger than the age limit. The segment being
+    # written is never dropped; call with the lock held
+    def evict(self):
+        oldest = None if self.max_age is None else time.time() - self.max_age
+        total = self.queued_bytes()
+        while len(self.segments) > 1:
+            segment = self.segments[0]
+            path = self.segment_path(segment)
+            size = os.path.getsize(path)
+            if not (total > self.max_bytes or (oldest is not None and os.path.getmtime(path) < oldest)):
+                break
+            if segment >= self.position[0]:
+                dropped = size - (self.position[1] if segment == self.position[0] else 0)
+                self.dropped_bytes += dropped
+                total -= dropped
+            self.remove_segment(segment)
+        if len(self.segments) > 0 and self.position[0] < self.segments[0]:
+            self.position = (self.segments[0], 0)
+            self.write_index()
+
+    # Function for deleting a segment file
+    def remove_segment(self, segment):
+        self.segments.remove(segment)
+        try:
+            os.remove(self.segment_path(segment))
+        except OSError:
+            pass
+
+    # Function for reading the oldest queued payloads, up to 'max_bytes' of them
+    # but always at least one. Payloads older than the age limit are skipped.
+    # Returns (payloads, position), where the position is passed to commit()
+    # once the payloads have been sent
+    def read_batch(self, max_bytes=65536):
+        with self.lock:
+            self.evict()
+            oldest = None if self.max_age is None else time.time() - self.max_age
+            batch = []
+            size = 0
+            position = self.position
+            for segment in [item for item in self.segments if item >= self.position[0]]:
+                offset = self.position[1] if segment == self.position[0] else 0
+                with open(self.segment_path(segment), "rb") as file:
+                    for end, queued, payload in self.scan(file, offset):
+                        if len(batch) > 0 and size + len(payload) > max_bytes:
+                            return (batch, position)
+                        position = (segment, end)
+                        if oldest is not None and queued < oldest:
+                            self.dropped_records += 1
+                            continue
+                        batch.append(payload)
+                        size += len(payload)
+                if segment != self.segments[-1]:
+                    # Move past a segment that has been read to its end
+                    position = (segment + 1, 0)
+            return (batch, position)
+
+    # Function for marking everything before 'position', from read_batch(), as sent
+    def commit(self, position):
+        with self.lock:
+            if position <= self.position:
+                return
+            self.position = position
+            self.write_index()
+            for segment in [item for item in self.segments[:-1] if item < position[0]]:
+                self.remove_segment(segment)
+
+    # Function for sending the queue in batches of up to 'max_bytes'. 'send' is a
+    # callable taking a list of payloads, as bytes, and returning True once they
+    # have been delivered. Stops at the first batch not delivered, which stays
+    # queued. Returns the number of payloads sent
+    def drain(self, send, max_bytes=65536):
+        sent = 0
+        while True:
+            batch, position = self.read_batch(max_bytes)
+            if len(batch) == 0:
+                # Only expired payloads, if any, were read
+                self.commit(position)
+                return sent
+            if not send(batch):
+                return sent
+            self.commit(position)
+            sent += len(batch)
+
+    # Function for closing the segment being written
+    def close(self):
+        with self.lock:
+            if self.writer is not None:
+                self.writer.close()
+                self.writer = None
@@ -0,0 +1,69 @@
+'''
+  Receive buffer for modem responses.
+  ---
+  Holds raw bytes as received. Data is consumed from a read offset
+  rather than by copying the remainder down, and searches for a
+  terminator resume where the previous search stopped, so a response
+  costs time linear in its size however it is split across reads.
+'''
+
+
+class ResponseBuffer:
+
+    # Compact the storage once this many consumed bytes have built up
+    COMPACT_SIZE = 4096
+
+    # Initializer function
+    def __init__(self):
+        self.data = bytearray()
+        self.start = 0
+        self.scanned = 0
+        self.terminator = None
+
+    def __len__(self):
+        return len(self.data) - self.start
+
+    # Function for adding received bytes
+    def append(self, data):
+        self.data += data
+
+    # Function for removing and returning everything up to and including 'terminator',
+    # or None if the terminator hasn't arrived yet
+    def take_until(self, terminator=b"\n"):
+        # Resume the search where the last one for the same terminator stopped,
+        # allowing for a terminator split across two reads
+        offset = self.start
+        if terminator == self.terminator:
+            offset = max(offset, self.scanned - len(terminator) + 1)
+        index = self.data.find(terminator, offset)
+        if index == -1:
+            self.scanned = len(self.data)
+            self.terminator = terminator
+            return None
+        return self.take(index + len(terminator) - self.start)
+
+    # Function for removing and returning up to 'count' bytes
+    def take(self, count):
+        end = min(self.start + count, len(self.data))
+        with memoryview(self.data) as view:
+            chunk = bytes(view[self.start:end])
+        self.start = end
+        self.scanned = end
+        if self.start >= self.COMPACT_SIZE and self.start * 2 >= len(self.data):
+            del self.data[:self.start]
+            self.start = 0
+            self.scanned = 0
+        return chunk
+
+    # Function for removing and returning everything in the buffer
+    def take_all(self):
+        return self.take(len(self))
+
+    # Function for removing and returning every complete line in the buffer
+    def take_lines(self):
+        lines = []
+        while True:
+            line = self.take_until(b"\n")
+            if line is None:
+                return lines
+            lines.append(line)
@@ -0,0 +1,122 @@
+'''
+  Retry policy and circuit breaker for the cellular modem drivers.
+  ---
+  RetryPolicy bounds how often a timed-out command is re-sent, spacing
+  attempts with exponential backoff plus jitter, and re-sends only
+  commands that are safe to repeat: a repeated AT+QHTTPGET or AT+UHTTPC
+  would make a second HTTP request. CircuitBreaker counts consecutive
+  timeouts and, past a threshold, fails commands at once until the modem
+  has been recovered or the recovery period has passed.
+'''
+
+import random
+import time
+
+
+class RetryPolicy:
+
+    max_attempts = 3
+    base_delay = 0.5 # Seconds
+    max_delay = 8 # Seconds
+    jitter = 0.5 # Fraction of the delay
+
+    # Initializer function
+    # 'excluded' lists commands that must never be re-sent, in addition to those
+    # the modem profile declares
+    def __init__(self, max_attempts=3, base_delay=0.5, max_delay=8, jitter=0.5, excluded=()):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.excluded = tuple(excluded)
+        self.random = random.Random()
+
+    # Function for checking whether a command may be re-sent after a timeout.
+    # Queries and tests never change the modem's state, so are always safe;
+    # others are safe unless excluded. A chained command line, eg.
+    # 'AT+CSQ;+QIACT=1', is safe only if every command in it is
+    def is_safe(self, command, excluded=()):
+        text = str(command).strip().upper()
+        if not text.startswith("AT"):
+            return False
+        for part in self.split_commands(text):
+            if part.endswith("?"):
+                continue
+            name = part.split("=")[0]
+            if name in excluded or name in self.excluded:
+                return False
+        return True
+
+    # Function for splitting a command line at the semicolons outside quoted
+    # strings, giving each command its 'AT' prefix, eg. 'AT+CSQ;+QIACT=1'
+    # gives ['AT+CSQ', 'AT+QIACT=1']
+    def split_commands(self, text):
+        parts = []
+        start = 0
+        quoted = False
+        for index, char in enumerate(text):
+            if char == "\"":
+                quoted = not quoted
+            elif char == ";" and not quoted:
+                parts.append(text[start:index])
+                start = index + 1
+        parts.append(text[start:])
+        commands = []
+        for part in parts:
+            part = part.strip()
+            if len(part) == 0:
+                continue
+            commands.append(part if part.startswith("AT") else "AT" + part)
+        return commands
+
+    # Function for getting the pause, in seconds, before attempt 'attempt' + 1
+    def backoff(self, attempt):
+        delay = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        return max(0, delay * (1 + self.jitter * (self.random.random() * 2 - 1)))
+
+
+class CircuitBreaker:
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    failure_threshold = 5
+    recovery_timeout = 60 # Seconds
+
+    # Initializer function
+    def __init__(self, failure_threshold=5, recovery_timeout=60):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0
+        self.trips = 0
+
+    # Function for checking whether a command may be sent. Once the recovery
+    # period has passed, one trial command is let through
+    def allow(self):
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.recovery_timeout:
+            self.state = self.HALF_OPEN
+        return self.state != self.OPEN
+
+    # Function for recording a command the modem answered
+    def record_success(self):
+        self.failures = 0
+        self.state = self.CLOSED
+
+    # Function for recording a command that timed out.
+    # Returns True if the breaker has just tripped
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.failure_threshold):
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+            self.trips += 1
+            return True
+        return False
+
+    # Function for restarting the recovery period, eg. after a failed recovery attempt
+    def restart(self):
+        if self.state == self.OPEN:
+            self.opened_at = time.monotonic()
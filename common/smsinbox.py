@@ -0,0 +1,117 @@
+'''
+  SMS inbox processing for the cellular modem drivers.
+  ---
+  Fetches every waiting message in one AT+CMGL round trip, parses them
+  into records and hands them to a handler in the order they arrived,
+  then deletes the ones handled with a single chained AT+CMGD line. A
+  burst of messages is dealt with in one pass rather than one per poll,
+  and a message is only deleted once it has been handled, so none is
+  lost. The modem must be in text mode (AT+CMGF=1).
+
+  Each message is a dict:
+      {"index": 3, "status": "REC UNREAD", "sender": "+447700900123",
+       "timestamp": "24/05/01,12:00:00+04", "text": "INFO"}
+'''
+
+
+class SMSInbox:
+
+    modem = None
+    # Whether listing unread messages is enough. It isn't for the first pass, which
+    # picks up messages left by an earlier run, or after a pass is interrupted:
+    # listing marks messages read, so some may be read but not yet handled
+    unread_only = False
+
+    # Initializer function
+    def __init__(self, modem):
+        self.modem = modem
+        self.unread_only = False
+
+    # Function for listing the waiting messages, oldest first. Returns [] if there
+    # are none or the listing fails
+    def fetch(self):
+        status = "REC UNREAD" if self.unread_only else "ALL"
+        result = self.modem.send_command("AT+CMGL=\"" + status + "\"")
+        if result[0] != "OK":
+            return []
+        messages = [message for message in parse_messages(result[1])
+                    if message["status"] in ("REC UNREAD", "REC READ")]
+        # Timestamps are 'yy/MM/dd,hh:mm:ss+zz', so sort on the time, not the zone
+        messages.sort(key=lambda message: (message["timestamp"][:17], message["index"]))
+        return messages
+
+    # Function for deleting messages by index, in as few round trips as possible
+    def delete(self, indices):
+        if len(indices) > 0:
+            self.modem.send_batch(["AT+CMGD=" + str(index) for index in indices])
+
+    # Function for passing every waiting message to 'handler', oldest first, then
+    # deleting those handled. A message counts as handled once its handler has been
+    # called, so one that ends the program, eg. "EXIT", isn't acted on again.
+    # Returns the number of messages handled
+    def process(self, handler):
+        messages = self.fetch()
+        handled = []
+        self.unread_only = False
+        try:
+            for message in messages:
+                handled.append(message["index"])
+                handler(message)
+            self.unread_only = True
+        finally:
+            self.delete(handled)
+        return len(handled)
+
+
+# Function for splitting a +CMGL header's fields at commas outside quotes, removing the quotes
+def split_fields(text):
+    fields = []
+    current = ""
+    quoted = False
+    for char in text:
+        if char == "\"":
+            quoted = not quoted
+            continue
+        if char == "," and not quoted:
+            fields.append(current)
+            current = ""
+        else:
+            current += char
+    fields.append(current)
+    return fields
+
+
+# Function for parsing a text-mode AT+CMGL response into message records.
+# A message's text runs from its header to the next header or the final OK,
+# so may span several lines
+def parse_messages(response):
+    lines = response.split("\r\n")
+    # Remove the final result code, but not a message that just says OK
+    while len(lines) > 0 and lines[-1].strip() == "":
+        lines.pop()
+    if len(lines) > 0 and lines[-1].strip() == "OK":
+        lines.pop()
+    messages = []
+    message = None
+    for line in lines:
+        if line.startswith("+CMGL: "):
+            fields = split_fields(line[7:])
+            message = {
+                "index": int(fields[0]),
+                "status": fields[1] if len(fields) > 1 else "",
+                "sender": fields[2] if len(fields) > 2 else "",
+                "timestamp": fields[4] if len(fields) > 4 else "",
+                "text": []
+            }
+            messages.append(message)
+        elif message is not None:
+            message["text"].append(line)
+    for message in messages:
+        # Drop the blank lines framing the text
+        text = message["text"]
+        while len(text) > 0 and text[0] == "":
+            text.pop(0)
+        while len(text) > 0 and text[-1] == "":
+            text.pop()
+        message["text"] = "\n".join(text)
+    return messages
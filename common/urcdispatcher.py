@@ -0,0 +1,226 @@
+'''
+  Background reader for the cellular modem drivers.
+  ---
+  Owns the modem's serial port while running, splitting the incoming
+  stream into command responses, which are passed to the command in
+  flight, and unsolicited result codes (URCs), which are passed to
+  registered callbacks and queues. Between commands the reader thread
+  frames lines itself; during a command the command's thread does so.
+'''
+
+import queue
+import threading
+import time
+from responsebuffer import ResponseBuffer
+
+
+class URCDispatcher:
+
+    port = None
+    running = False
+
+    # Most URCs a subscriber's queue holds: when it is full the oldest is dropped,
+    # so a queue nobody reads doesn't grow without bound
+    QUEUE_SIZE = 32
+
+    # Initializer function
+    # 'port' is an open pyserial port, 'prefixes' the URC prefixes to watch for,
+    # 'trace' a wiretrace.WireTrace to record the input in, if any
+    def __init__(self, port, prefixes=(), log=None, trace=None):
+        self.port = port
+        self.prefixes = list(prefixes)
+        self.log = log
+        self.trace = trace
+        self.callbacks = {}
+        self.queues = {}
+        self.buffer = ResponseBuffer()
+        self.condition = threading.Condition()
+        self.command_name = None
+        self.thread = None
+
+    # Function for starting the reader thread
+    def start(self):
+        if self.running:
+            return
+        # Wake periodically so that stop() is honoured promptly
+        self.port.timeout = 0.5
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="urc-dispatcher", daemon=True)
+        self.thread.start()
+
+    # Function for stopping the reader thread
+    def stop(self):
+        self.running = False
+        with self.condition:
+            self.condition.notify_all()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+        self.thread = None
+
+    # Function for adding a URC prefix to watch for
+    def add_prefix(self, prefix):
+        if prefix not in self.prefixes:
+            self.prefixes.append(prefix)
+
+    # Function for registering a callback for a URC prefix.
+    # The callback is called on the reader thread with the URC line
+    def register(self, prefix, callback):
+        self.add_prefix(prefix)
+        self.callbacks.setdefault(prefix, []).append(callback)
+
+    # Function for removing a previously registered callback
+    def unregister(self, prefix, callback):
+        if prefix in self.callbacks and callback in self.callbacks[prefix]:
+            self.callbacks[prefix].remove(callback)
+
+    # Function for getting the queue that receives every URC with the given prefix.
+    # It holds the latest QUEUE_SIZE of them
+    def subscribe(self, prefix):
+        self.add_prefix(prefix)
+        if prefix not in self.queues:
+            self.queues[prefix] = queue.Queue(maxsize=self.QUEUE_SIZE)
+        return self.queues[prefix]
+
+    # Function for waiting up to 'timeout' seconds for a URC that arrives after the
+    # call; earlier ones still queued are discarded. To catch a URC that a command
+    # triggers, empty the subscribe() queue before the command and read it after.
+    # Returns the URC line, or None on timeout
+    def wait_for(self, prefix, timeout=None):
+        urcs = self.subscribe(prefix)
+        try:
+            while True:
+                urcs.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            return urcs.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    # Function for marking the start of a command. From now until end_command()
+    # the command's thread frames the input itself with read_until() and
+    # read_bytes(), so that raw data, eg. an HTTP body, is passed on intact
+    def begin_command(self, command=None):
+        with self.condition:
+            # Anything complete that arrived before the command is unsolicited
+            lines = self.buffer.take_lines()
+            self.command_name = ""
+            if command is not None:
+                name = str(command).strip().upper().split("=")[0].split("?")[0]
+                if name.startswith("AT+"):
+                    self.command_name = name[2:]
+        for line in lines:
+            self.process_line(line)
+
+    # Function for marking the end of a command: lines left over, such as a URC
+    # that arrived with the final result code, are dispatched
+    def end_command(self):
+        with self.condition:
+            self.command_name = None
+            lines = self.buffer.take_lines()
+        for line in lines:
+            self.process_line(line)
+
+    # Function for reading the command's input up to and including 'terminator'.
+    # Blocks for up to 'timeout' seconds; on timeout any partial data is returned
+    def read_until(self, terminator=b"\n", timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.condition:
+            while True:
+                data = self.buffer.take_until(terminator)
+                if data is not None:
+                    break
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if (remaining is not None and remaining <= 0) or not self.running:
+                    data = self.buffer.take_all()
+                    break
+                self.condition.wait(remaining)
+        if terminator == b"\n":
+            # Pass on any URC in the command's response, unless it is the response
+            self.process_line(data, False)
+        return data
+
+    # Function for reading 'count' bytes of the command's input.
+    # Blocks for up to 'timeout' seconds; on timeout fewer bytes may be returned
+    def read_bytes(self, count, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.condition:
+            while len(self.buffer) < count:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if (remaining is not None and remaining <= 0) or not self.running:
+                    break
+                self.condition.wait(remaining)
+            data = self.buffer.take(count)
+        return data
+
+    # Reader thread main loop
+    def run(self):
+        while self.running:
+            try:
+                data = self.port.read(max(1, self.port.in_waiting))
+            except Exception as exp:
+                self.print_log(exp)
+                self.running = False
+                with self.condition:
+                    self.condition.notify_all()
+                break
+            if len(data) == 0:
+                continue
+            if self.trace is not None:
+                self.trace.rx(data)
+            lines = []
+            with self.condition:
+                self.buffer.append(data)
+                if self.command_name is None:
+                    lines = self.buffer.take_lines()
+                else:
+                    self.condition.notify_all()
+            for line in lines:
+                self.process_line(line)
+
+    # Function for passing a line to URC listeners if it is a URC. Lines read by a
+    # command are not dispatched if they carry that command's own response
+    def process_line(self, line, unsolicited=True):
+        stripped = line.strip()
+        prefix = self.match_prefix(stripped)
+        if prefix is None:
+            return
+        if not unsolicited and self.command_name is not None and prefix == self.command_name:
+            return
+        self.dispatch(prefix, stripped.decode('utf-8', errors='ignore'))
+
+    # Function for finding the registered URC prefix a line, as bytes, starts with, if any
+    def match_prefix(self, line):
+        for prefix in self.prefixes:
+            if line.startswith(prefix.encode()):
+                return prefix
+        return None
+
+    # Function for passing a URC to its callbacks and queues
+    def dispatch(self, prefix, line):
+        self.print_log("URC: " + line)
+        for callback in list(self.callbacks.get(prefix, [])):
+            try:
+                callback(line)
+            except Exception as exp:
+                self.print_log(exp)
+        if prefix in self.queues:
+            self.enqueue(self.queues[prefix], line)
+
+    # Function for adding a URC to a subscriber's queue, dropping the oldest if it is full
+    def enqueue(self, urcs, line):
+        while True:
+            try:
+                urcs.put_nowait(line)
+                return
+            except queue.Full:
+                pass
+            try:
+                urcs.get_nowait()
+            except queue.Empty:
+                pass
+
+    # Function for outputting log messages
+    def print_log(self, message):
+        if self.log is not None:
+            self.log(message)
@@ -0,0 +1,190 @@
+'''
+  Wire trace for the cellular modem drivers.
+  ---
+  Records every write to and read from the modem, and the result and
+  latency of every command, in a fixed ring of preallocated slots, so it
+  can stay on in production: recording is a struct.pack_into() and a
+  copy of up to one slot's worth of data, with no allocation, formatting
+  or I/O. Each record holds a sequence number, a monotonic timestamp in
+  nanoseconds, the id of the command in flight (0 between commands), the
+  command's latency for results, the data's length and, truncated to
+  the slot, the data itself. Commands can be sampled, to record the
+  wire traffic of only one in every 'sample' commands; results and
+  traffic between commands are always recorded.
+
+  dump() writes the records, oldest first, to a compact binary file.
+  CellularModem dumps its trace when the modem stops responding, see
+  ModemProfile.dump_trace(); this module decodes a dump:
+      python3 common/wiretrace.py ~/.cellular-iot/trace.bin
+
+  Usage:
+      modem.trace.sample = 10
+      for line in modem.trace.format():
+          print(line)
+'''
+
+import itertools
+import os
+import struct
+import sys
+import time
+
+
+# Record kinds
+TX = 1
+RX = 2
+RESULT = 3
+NOTE = 4
+
+KIND_NAMES = {TX: "TX", RX: "RX", RESULT: "RESULT", NOTE: "NOTE"}
+
+# Record header: sequence, time (ns), command id, latency (us), data length, kind
+HEADER = struct.Struct("<IQIIHBx")
+
+# Dump header: magic, format version, bytes of data kept per record, record count
+FILE_HEADER = struct.Struct("<4sBHI")
+MAGIC = b"CIWT"
+VERSION = 1
+
+
+class WireTrace:
+
+    enabled = True
+    sample = 1 # record the traffic of one command in every 'sample'
+    command_id = 0 # command in flight, or 0
+    sampled = True # whether the command in flight's traffic is recorded
+    last = 0 # sequence number of the latest record
+
+    # Initializer function
+    # 'slots' records of 'slot_size' bytes each, header included, are allocated now
+    def __init__(self, slots=1024, slot_size=128, sample=1):
+        self.slots = slots
+        self.slot_size = slot_size
+        self.capacity = slot_size - HEADER.size
+        self.sample = sample
+        self.buffer = bytearray(slots * slot_size)
+        self.view = memoryview(self.buffer)
+        # next() on a count is atomic, so threads never get the same slot
+        self.sequence = itertools.count(1)
+        self.commands = itertools.count(1)
+        self.command_start = 0
+
+    # Function for recording 'data', bytes, of a given kind
+    def record(self, kind, data, latency=0):
+        sequence = next(self.sequence)
+        offset = (sequence % self.slots) * self.slot_size
+        length = len(data)
+        HEADER.pack_into(self.buffer, offset, sequence & 0xFFFFFFFF, time.monotonic_ns(),
+                         self.command_id, latency, min(length, 0xFFFF), kind)
+        if length > 0:
+            stored = min(length, self.capacity)
+            start = offset + HEADER.size
+            self.view[start:start + stored] = data if length == stored else memoryview(data)[:stored]
+        self.last = sequence
+
+    # Function for recording data written to the modem
+    def tx(self, data):
+        if self.enabled and self.sampled:
+            self.record(TX, data)
+
+    # Function for recording data read from the modem
+    def rx(self, data):
+        if self.enabled and self.sampled:
+            self.record(RX, data)
+
+    # Function for marking the start of a command: its traffic, up to end(), carries its id
+    def begin(self):
+        self.command_id = next(self.commands) & 0xFFFFFFFF
+        self.command_start = time.monotonic_ns()
+        self.sampled = self.sample <= 1 or self.command_id % self.sample == 0
+
+    # Function for recording the result, eg. "OK", and latency of the command in flight
+    def end(self, state):
+        if self.enabled and self.command_id != 0:
+            latency = (time.monotonic_ns() - self.command_start) // 1000
+            self.record(RESULT, state.encode(), min(latency, 0xFFFFFFFF))
+        self.command_id = 0
+        self.sampled = True
+
+    # Function for recording a message, eg. from ModemProfile.debug_print()
+    def note(self, message):
+        if self.enabled:
+            self.record(NOTE, str(message).encode('utf-8', errors='replace'))
+
+    # Function for getting the records still in the ring, oldest first, as tuples of
+    # (sequence, time ns, command id, latency us, length, kind, data)
+    def records(self):
+        last = self.last
+        results = []
+        for sequence in range(max(1, last - self.slots + 1), last + 1):
+            offset = (sequence % self.slots) * self.slot_size
+            fields = HEADER.unpack_from(self.buffer, offset)
+            # Skip a slot overwritten since 'last' was read
+            if fields[0] != sequence & 0xFFFFFFFF or fields[5] == 0:
+                continue
+            start = offset + HEADER.size
+            data = bytes(self.buffer[start:start + min(fields[4], self.capacity)])
+            results.append(fields + (data,))
+        return results
+
+    # Function for writing the records, oldest first, to 'path'. Returns the number written
+    def dump(self, path):
+        records = self.records()
+        directory = os.path.dirname(path)
+        if len(directory) > 0:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "wb") as file:
+            file.write(FILE_HEADER.pack(MAGIC, VERSION, self.capacity, len(records)))
+            for record in records:
+                file.write(HEADER.pack(*record[:6]))
+                file.write(record[6])
+        return len(records)
+
+    # Function for getting the records as lines of text, see format_record()
+    def format(self):
+        records = self.records()
+        start = records[0][1] if len(records) > 0 else 0
+        return [format_record(record, start) for record in records]
+
+
+# Function for reading a file written by WireTrace.dump(). Returns the records as
+# WireTrace.records() does. Raises IOError if the file isn't a trace
+def read_dump(path):
+    with open(path, "rb") as file:
+        data = file.read()
+    if len(data) < FILE_HEADER.size:
+        raise IOError(path + " is not a wire trace")
+    magic, version, capacity, count = FILE_HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION:
+        raise IOError(path + " is not a wire trace")
+    records = []
+    offset = FILE_HEADER.size
+    for index in range(count):
+        fields = HEADER.unpack_from(data, offset)
+        offset += HEADER.size
+        stored = min(fields[4], capacity)
+        records.append(fields + (data[offset:offset + stored],))
+        offset += stored
+    return records
+
+
+# Function for formatting a record as a line of text, with its time in seconds from
+# 'start' (ns), eg. "    0.012345  #17  TX      AT+CSQ\r"
+def format_record(record, start=0):
+    sequence, timestamp, command_id, latency, length, kind, data = record
+    text = repr(data)[2:-1] if kind != NOTE else data.decode('utf-8', errors='replace')
+    if length > len(data):
+        text += " ... (" + str(length) + " bytes)"
+    if kind == RESULT:
+        text += " in " + str(round(latency / 1000.0, 3)) + " ms"
+    return "{:12.6f}  #{:<6} {:<7} {}".format((timestamp - start) / 1e9, command_id, KIND_NAMES.get(kind, str(kind)), text)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python3 wiretrace.py <trace file>")
+        sys.exit(1)
+    records = read_dump(sys.argv[1])
+    start = records[0][1] if len(records) > 0 else 0
+    for record in records:
+        print(format_record(record, start))
@@ -0,0 +1,96 @@
+'''
+  In-memory stand-in for RPi.GPIO.
+  ---
+  Put the emulator directory first on PYTHONPATH and the drivers will
+  import this module instead of the real one. Pins hold whatever was
+  last written to them; inputs read low unless set with set_input(),
+  so the BG96 STATUS line reports a powered modem straight away.
+'''
+
+import time
+
+BCM = 11
+BOARD = 10
+OUT = 0
+IN = 1
+LOW = 0
+HIGH = 1
+PUD_OFF = 20
+PUD_DOWN = 21
+PUD_UP = 22
+RISING = 31
+FALLING = 32
+BOTH = 33
+
+RPI_INFO = {"TYPE": "Emulated"}
+
+mode = None
+pins = {}
+directions = {}
+
+
+# Function for choosing the pin numbering scheme
+def setmode(new_mode):
+    global mode
+    mode = new_mode
+
+
+# Function for getting the pin numbering scheme
+def getmode():
+    return mode
+
+
+# Function for enabling or disabling warnings; there are none to show
+def setwarnings(state):
+    pass
+
+
+# Function for configuring a pin, or a list of pins
+def setup(channel, direction, pull_up_down=PUD_OFF, initial=None):
+    for pin in channel if isinstance(channel, (list, tuple)) else [channel]:
+        directions[pin] = direction
+        if initial is not None:
+            pins[pin] = initial
+        elif pin not in pins:
+            pins[pin] = LOW
+
+
+# Function for driving an output pin, or a list of pins
+def output(channel, state):
+    for pin in channel if isinstance(channel, (list, tuple)) else [channel]:
+        pins[pin] = state
+
+
+# Function for reading a pin
+def input(channel):
+    return pins.get(channel, LOW)
+
+
+# Function for setting the level an input pin will read: for tests and the emulator
+def set_input(channel, state):
+    pins[channel] = state
+
+
+# Function for waiting for an edge. Levels never change by themselves here,
+# so the pin is reported at once if it is already at the level the edge leads to;
+# otherwise the wait lasts the whole timeout, in milliseconds
+def wait_for_edge(channel, edge, bouncetime=None, timeout=None):
+    level = pins.get(channel, LOW)
+    if (edge == FALLING and level == LOW) or (edge == RISING and level == HIGH) or edge == BOTH:
+        return channel
+    if timeout is not None:
+        time.sleep(timeout / 1000.0)
+    return None
+
+
+# Function for releasing pins: all of them, or just those given
+def cleanup(channel=None):
+    global mode
+    if channel is None:
+        pins.clear()
+        directions.clear()
+        mode = None
+        return
+    for pin in channel if isinstance(channel, (list, tuple)) else [channel]:
+        pins.pop(pin, None)
+        directions.pop(pin, None)
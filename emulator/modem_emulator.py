@@ -0,0 +1,1144 @@
+#!/usr/bin/env python3
+
+'''
+  Pseudo-terminal modem emulator for the BG96 and LARA-R2 drivers.
+  ---
+  Exposes a pty that speaks the subset of the Quectel BG96 or u-blox
+  LARA-R2 AT command sets used by CellularIoT and UbloxLaraR2, so the
+  drivers and scripts can be run, tested and benchmarked without a hat.
+  It can also replay a captured session transcript, record one from a
+  real modem, scale response latency and inject faults. AT+CMUX switches
+  the pty to 27.010 multiplexing, with a command parser per channel; a
+  packet data call, ATD*99#, is answered by a loopback.
+
+  Usage:
+      python3 modem_emulator.py bg96 -- python3 ../bg96/iss.py
+      python3 modem_emulator.py lara-r2 --time-scale 0 --error-rate 0.05
+      python3 modem_emulator.py record /dev/ttyS0 --output session.txt
+
+  When a command follows '--' it is run with MODEM_SERIAL_PORT set to the
+  pty, MODEM_GPIO_BACKEND set to "fake" and this directory, which holds a
+  fake RPi.GPIO, on PYTHONPATH.
+
+  Transcript format, one entry per line:
+      > AT+CSQ          a command sent to the modem
+      < +CSQ: 20,99     a line the modem sends back
+      = 150             a pause, in milliseconds, before the next line
+      # comment
+'''
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tty
+
+
+class ModemEmulator:
+
+    name = "modem"
+    manufacturer = "Emulated"
+
+    # Typical response latencies in milliseconds, scaled by time_scale.
+    # Commands not listed use DEFAULT_LATENCY
+    LATENCY = {}
+    DEFAULT_LATENCY = 10
+
+    # Index given to the first stored SMS
+    first_sms_index = 0
+
+    # Initializer function
+    # 'time_scale' multiplies every latency: 1 is realistic, 0 is as fast as possible.
+    # 'faults' may set "error_rate", "drop_rate", "garble_rate" and "spike_rate"
+    # (probabilities per command) and "spike_ms"
+    def __init__(self, time_scale=1.0, transcript=None, faults=None, seed=None, http_content=None):
+        self.time_scale = time_scale
+        self.faults = faults if faults is not None else {}
+        self.random = random.Random(seed)
+        self.http_content = http_content if http_content is not None else {}
+        self.replay = {}
+        if transcript is not None:
+            self.load_transcript(transcript)
+        self.master = None
+        self.slave = None
+        self.port = None
+        self.running = False
+        self.thread = None
+        self.write_lock = threading.Lock()
+        self.line = bytearray()
+        self.data_handler = None
+        # Takes every byte from the host instead of the command parser, eg. in transparent mode
+        self.raw_handler = None
+        # 27.010 multiplexer, see do_CMUX(), and the channel being served by this thread
+        self.mux = None
+        self.local = threading.local()
+        self.data_needed = 0
+        self.data = bytearray()
+        self.echo = True
+        self.commands = 0
+        # URCs raised while a command line runs, sent after its final result
+        self.deferred = None
+        self.reset_state()
+
+    # Function for setting the modem's state to its power-on defaults: override in subclasses
+    def reset_state(self):
+        self.echo = True
+        self.baudrate = 115200
+        self.flow_control = ["0", "0"]
+        self.files = {}
+        self.sms = {}
+        self.sms_text_mode = False
+        # Bodies of the HTTP POST requests made, as (url, body)
+        self.posts = []
+
+    # Function for creating the pty and starting the emulator thread.
+    # Returns the path of the pty for the driver to open
+    def start(self):
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name=self.name + "-emulator", daemon=True)
+        self.thread.start()
+        return self.port
+
+    # Function for stopping the emulator and closing the pty
+    def stop(self):
+        self.running = False
+        for fd in (self.master, self.slave):
+            if fd is not None:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+        self.master = None
+        self.slave = None
+
+    # Emulator thread main loop
+    def run(self):
+        while self.running:
+            try:
+                data = os.read(self.master, 4096)
+            except OSError:
+                break
+            if len(data) == 0:
+                break
+            for byte in data:
+                self.receive(byte)
+
+    # Function for processing one byte from the host
+    def receive(self, byte):
+        if self.raw_handler is not None:
+            self.raw_handler(byte)
+            return
+        if self.data_handler is not None:
+            self.data.append(byte)
+            if len(self.data) >= self.data_needed or (self.data_needed == 0 and byte == 0x1A):
+                handler = self.data_handler
+                data = bytes(self.data)
+                self.data_handler = None
+                self.data = bytearray()
+                handler(data)
+            return
+        if byte == 0x0D:
+            command = self.line.decode('utf-8', errors='ignore').strip()
+            self.line = bytearray()
+            if self.echo:
+                self.write(command.encode() + b"\r")
+            if len(command) > 0:
+                self.execute(command)
+        elif byte != 0x0A:
+            self.line.append(byte)
+
+    # Function for writing bytes to the host, on the current channel when multiplexing
+    def write(self, data):
+        if self.mux is not None:
+            self.mux.write(getattr(self.local, "channel", None), data)
+            return
+        self.write_port(data)
+
+    # Function for writing bytes to the pty itself
+    def write_port(self, data):
+        with self.write_lock:
+            if self.master is not None:
+                try:
+                    os.write(self.master, data)
+                except OSError:
+                    pass
+
+    # Function for sending response lines to the host, each framed by <CR><LF>
+    def respond(self, *lines):
+        self.write(b"".join([b"\r\n" + self.to_bytes(line) + b"\r\n" for line in lines]))
+
+    # Function for sending a URC after 'delay' milliseconds (before scaling)
+    def send_urc(self, line, delay=0):
+        delay = self.scale(delay)
+        if delay <= 0 and self.deferred is not None:
+            self.deferred.append(line)
+        elif delay <= 0:
+            self.respond(line)
+        else:
+            timer = threading.Timer(delay / 1000.0, self.respond, [line])
+            timer.daemon = True
+            timer.start()
+
+    # Function for waiting until the host has sent 'count' bytes, or a Ctrl-Z
+    # if 'count' is 0, then passing them to 'handler'
+    def expect_data(self, count, handler):
+        self.data_needed = count
+        self.data = bytearray()
+        self.data_handler = handler
+
+    # Function for converting a string to bytes
+    def to_bytes(self, value):
+        return value if isinstance(value, bytes) else str(value).encode()
+
+    # Function for applying the time scale to a latency in milliseconds
+    def scale(self, ms):
+        return ms * self.time_scale
+
+    # Function for pausing for a scaled number of milliseconds
+    def pause(self, ms):
+        ms = self.scale(ms)
+        if ms > 0:
+            time.sleep(ms / 1000.0)
+
+    # Function for running a command line, which may chain several commands
+    def execute(self, line):
+        self.commands += 1
+        if self.inject_fault():
+            return
+        if line in self.replay:
+            self.play(line)
+            return
+        if not line.upper().startswith("AT"):
+            self.respond("ERROR")
+            return
+        parts = self.split_chain(line[2:])
+        self.deferred = []
+        try:
+            for index in range(len(parts)):
+                part = parts[index]
+                self.pause(self.latency(part))
+                final = index == len(parts) - 1
+                if self.dispatch(part, final) is False:
+                    self.respond("ERROR")
+                    break
+            if len(self.deferred) > 0:
+                self.respond(*self.deferred)
+        finally:
+            self.deferred = None
+
+    # Function for splitting 'AT+A;+B' into '+A' and '+B', ignoring ';' in quotes
+    def split_chain(self, text):
+        parts = []
+        current = ""
+        quoted = False
+        for char in text:
+            if char == "\"":
+                quoted = not quoted
+            if char == ";" and not quoted:
+                parts.append(current)
+                current = ""
+            else:
+                current += char
+        parts.append(current)
+        return [part for part in parts if len(part) > 0] or [""]
+
+    # Function for getting the latency of a command in milliseconds, before scaling
+    def latency(self, command):
+        return self.LATENCY.get(self.command_name(command), self.DEFAULT_LATENCY)
+
+    # Function for getting the name of a command, eg. '+QCFG' from '+QCFG="band"'
+    def command_name(self, command):
+        return command.split("=")[0].split("?")[0].upper()
+
+    # Function for running one command of a line. Handlers are methods named after
+    # the command, eg. do_QCFG for +QCFG or do_E for E0. Intermediate commands of a
+    # chain suppress their final OK. Returns False if the command is unknown or fails
+    def dispatch(self, command, final=True):
+        name = self.command_name(command)
+        query = command.endswith("?") and command.find("=") == -1
+        test = command.endswith("=?")
+        args = []
+        if command.find("=") != -1 and not test:
+            args = self.split_args(command.split("=", 1)[1])
+        if len(name) == 0:
+            handler = self.do_AT
+        elif name[0] in "+&":
+            handler = getattr(self, "do_" + name[1:].replace("&", ""), None)
+            if name[0] == "&":
+                handler = getattr(self, "do_AMP" + name[1:], None)
+        else:
+            handler = getattr(self, "do_" + name[0], None)
+            args = [name[1:]] if len(args) == 0 else args
+        if handler is None:
+            return False
+        result = handler(args, query or test)
+        if result is False:
+            return False
+        lines = result if isinstance(result, list) else []
+        if result is None or isinstance(result, list):
+            if final:
+                lines = lines + ["OK"]
+            if len(lines) > 0:
+                self.respond(*lines)
+        return True
+
+    # Function for splitting command arguments at commas outside quotes, removing the quotes
+    def split_args(self, text):
+        args = []
+        current = ""
+        quoted = False
+        for char in text:
+            if char == "\"":
+                quoted = not quoted
+                continue
+            if char == "," and not quoted:
+                args.append(current)
+                current = ""
+            else:
+                current += char
+        args.append(current)
+        return args
+
+    # Function for deciding whether to inject a fault instead of answering.
+    # Returns True if the command has been dealt with
+    def inject_fault(self):
+        if self.random.random() < self.faults.get("drop_rate", 0):
+            return True
+        if self.random.random() < self.faults.get("error_rate", 0):
+            self.respond("ERROR")
+            return True
+        if self.random.random() < self.faults.get("garble_rate", 0):
+            self.respond(bytes([self.random.randrange(32, 127) for i in range(8)]))
+            return True
+        if self.random.random() < self.faults.get("spike_rate", 0):
+            self.pause(self.faults.get("spike_ms", 1000))
+        return False
+
+    # Function for loading a transcript: each command maps to the response blocks
+    # recorded for it, played back in order (the last is repeated when they run out)
+    def load_transcript(self, path):
+        command = None
+        with open(path) as file:
+            for line in file:
+                line = line.rstrip("\r\n")
+                if len(line) < 1 or line.startswith("#"):
+                    continue
+                kind = line[0]
+                text = line[2:] if len(line) > 1 else ""
+                if kind == ">":
+                    command = text.strip()
+                    self.replay.setdefault(command, []).append([])
+                elif command is not None and kind == "<":
+                    self.replay[command][-1].append(("line", text))
+                elif command is not None and kind == "=":
+                    self.replay[command][-1].append(("pause", float(text)))
+
+    # Function for playing back the next recorded response to a command
+    def play(self, command):
+        blocks = self.replay[command]
+        block = blocks.pop(0) if len(blocks) > 1 else blocks[0]
+        for kind, value in block:
+            if kind == "pause":
+                self.pause(value)
+            else:
+                self.respond(value)
+
+    # Function for storing a text SMS and announcing it with +CMTI
+    def inject_sms(self, sender, text, index=None):
+        if index is None:
+            index = self.first_sms_index
+            while index in self.sms:
+                index += 1
+        timestamp = time.strftime("%y/%m/%d,%H:%M:%S+00")
+        self.sms[index] = {"status": "REC UNREAD", "sender": sender, "timestamp": timestamp, "text": text}
+        self.send_urc("+CMTI: \"ME\"," + str(index))
+        return index
+
+    # Function for getting the body served for a URL: canned content if set,
+    # otherwise a current ISS position in the Open Notify format
+    def get_content(self, url):
+        for key in (url, url.split("://")[-1]):
+            if key in self.http_content:
+                return self.to_bytes(self.http_content[key])
+        return json.dumps({"message": "success", "timestamp": int(time.time()),
+                           "iss_position": {"latitude": "51.4769", "longitude": "-0.0005"}}).encode()
+
+    # Basic commands common to both modems
+    def do_AT(self, args, query):
+        return None
+
+    def do_E(self, args, query):
+        self.echo = args[0] != "0"
+
+    def do_Q(self, args, query):
+        return None
+
+    def do_H(self, args, query):
+        return None
+
+    def do_Z(self, args, query):
+        self.echo = True
+
+    # Dialling a packet data number, eg. ATD*99#, starts a data session. The far end
+    # is a loopback, returning whatever is sent, until the channel is closed
+    def do_D(self, args, query):
+        if not args[0].startswith("*99"):
+            return False
+        self.respond("CONNECT")
+        self.raw_handler = self.receive_loopback
+        return True
+
+    # Function for taking a byte from the host in a data session
+    def receive_loopback(self, byte):
+        self.write(bytes([byte]))
+
+    # Basic option multiplexing only. After OK, the pty carries frames
+    def do_CMUX(self, args, query):
+        if query:
+            return ["+CMUX: 0,0,5,31,10,3,30,10,2"]
+        if args[0] != "0":
+            return False
+        self.respond("OK")
+        self.mux = MuxEmulation(self, int(args[3]) if len(args) > 3 and len(args[3]) > 0 else 31)
+        self.raw_handler = self.mux.receive
+        return True
+
+    def do_I(self, args, query):
+        return [self.name.upper(), "Revision: EMULATED"]
+
+    def do_AMPW(self, args, query):
+        return None
+
+    def do_CMEE(self, args, query):
+        return None
+
+    def do_CPIN(self, args, query):
+        return ["+CPIN: READY"]
+
+    def do_CSQ(self, args, query):
+        return ["+CSQ: 20,99"]
+
+    def do_CREG(self, args, query):
+        return ["+CREG: 0,1"] if query else None
+
+    def do_CGREG(self, args, query):
+        return ["+CGREG: 0,1"] if query else None
+
+    def do_CEREG(self, args, query):
+        return ["+CEREG: 0,1"] if query else None
+
+    def do_COPS(self, args, query):
+        return ["+COPS: 0,0,\"Emulated\",8"] if query else None
+
+    def do_CGMI(self, args, query):
+        return [self.manufacturer]
+
+    # The pty has no baud rate, so the rate is only remembered
+    def do_IPR(self, args, query):
+        if query:
+            return ["+IPR: " + str(self.baudrate)]
+        self.baudrate = int(args[0])
+
+    def do_IFC(self, args, query):
+        if query:
+            return ["+IFC: " + ",".join(self.flow_control)]
+        self.flow_control = (args + ["0", "0"])[:2]
+
+    def do_CGDCONT(self, args, query):
+        if query:
+            return ["+CGDCONT: " + cid + ",\"IP\",\"" + apn + "\",\"0.0.0.0\",0,0" for cid, apn in sorted(self.apns.items())]
+        self.apns[args[0]] = args[2] if len(args) > 2 else ""
+
+    def do_CMGF(self, args, query):
+        if query:
+            return ["+CMGF: " + ("1" if self.sms_text_mode else "0")]
+        self.sms_text_mode = args[0] == "1"
+
+    def do_CNMI(self, args, query):
+        return None
+
+    def do_CMGR(self, args, query):
+        index = int(args[0])
+        if index not in self.sms:
+            return None
+        message = self.sms[index]
+        status = message["status"]
+        message["status"] = "REC READ"
+        return ["+CMGR: \"" + status + "\",\"" + message["sender"] + "\",,\"" + message["timestamp"] + "\"",
+                message["text"]]
+
+    # Listing unread messages marks them read, as on the real modems
+    def do_CMGL(self, args, query):
+        status = args[0] if len(args) > 0 else "REC UNREAD"
+        lines = []
+        for index in sorted(self.sms.keys()):
+            message = self.sms[index]
+            if status != "ALL" and message["status"] != status:
+                continue
+            lines.append("+CMGL: " + str(index) + ",\"" + message["status"] + "\",\"" + message["sender"]
+                         + "\",,\"" + message["timestamp"] + "\"")
+            lines.append(message["text"])
+            message["status"] = "REC READ"
+        return lines
+
+    def do_CMGD(self, args, query):
+        index = int(args[0])
+        flag = int(args[1]) if len(args) > 1 else 0
+        if flag == 0:
+            self.sms.pop(index, None)
+        elif flag == 4:
+            self.sms.clear()
+        else:
+            for key in list(self.sms.keys()):
+                if self.sms[key]["status"] == "REC READ":
+                    self.sms.pop(key)
+
+
+class BG96Emulator(ModemEmulator):
+
+    name = "bg96"
+    manufacturer = "Quectel"
+
+    LATENCY = {
+        "+QIACT": 1500,
+        "+QIDEACT": 300,
+        "+COPS": 2000,
+        "+QHTTPGET": 50,
+        "+QHTTPREAD": 50,
+        "&W": 50
+    }
+
+    # Time from AT+QHTTPGET to its +QHTTPGET URC, in milliseconds
+    HTTP_LATENCY = 800
+
+    # Time taken to connect a socket, and for data sent on one to come back from the
+    # echo server at the other end, in milliseconds
+    SOCKET_LATENCY = 100
+
+    first_sms_index = 0
+
+    # Function for setting the modem's state to its power-on defaults
+    def reset_state(self):
+        super().reset_state()
+        self.qcfg = {"band": ["0xf", "0x400a0e189f", "0xa0e189f"], "nwscanseq": ["020301"],
+                     "nwscanmode": ["0"], "iotopmode": ["2"]}
+        self.apns = {"1": "super"}
+        self.contexts = {}
+        self.http_config = {"contextid": "1", "requestheader": "0"}
+        self.http_url = None
+        self.http_body = None
+        self.sockets = {}
+        self.transparent = None
+        self.escapes = 0
+
+    def do_QCFG(self, args, query):
+        name = args[0]
+        if name not in self.qcfg:
+            return False
+        if len(args) == 1:
+            return ["+QCFG: \"" + name + "\"," + ",".join(self.qcfg[name])]
+        if name == "band":
+            for index in range(3):
+                if int(args[index + 1], 16) != 0:
+                    self.qcfg[name][index] = "0x" + args[index + 1].lower()
+        else:
+            self.qcfg[name] = [args[1]]
+
+    def do_QICSGP(self, args, query):
+        cid = args[0] if len(args) > 0 else "1"
+        if len(args) == 1:
+            return ["+QICSGP: 1,\"" + self.apns.get(cid, "") + "\",\"\",\"\",0"]
+        if len(args) > 2:
+            self.apns[cid] = args[2]
+
+    def do_QIACT(self, args, query):
+        if query:
+            return ["+QIACT: " + cid + ",1,1,\"10.64.0.1\"" for cid in sorted(self.contexts)]
+        self.contexts[args[0]] = True
+
+    def do_QIDEACT(self, args, query):
+        self.contexts.pop(args[0], None)
+
+    def do_QNWINFO(self, args, query):
+        return ["+QNWINFO: \"eMTC\",\"23410\",\"LTE BAND 20\",6300"]
+
+    def do_QHTTPCFG(self, args, query):
+        if len(args) > 1:
+            self.http_config[args[0]] = args[1]
+
+    def do_QHTTPURL(self, args, query):
+        if query:
+            return ["+QHTTPURL: \"" + (self.http_url or "") + "\""]
+
+        def store(data):
+            self.http_url = data.decode('utf-8', errors='ignore')
+            self.respond("OK")
+
+        self.respond("CONNECT")
+        self.expect_data(int(args[0]), store)
+        return True
+
+    def do_QFUPL(self, args, query):
+
+        def store(data):
+            self.files[args[0]] = data
+            self.respond("+QFUPL: " + str(len(data)) + "," + format(self.checksum(data), "x"), "OK")
+
+        self.respond("CONNECT")
+        self.expect_data(int(args[1]) if len(args) > 1 else 0, store)
+        return True
+
+    def do_QFLST(self, args, query):
+        return ["+QFLST: \"" + name + "\"," + str(len(data)) for name, data in self.files.items()]
+
+    def do_QFDEL(self, args, query):
+        if args[0] == "*":
+            self.files.clear()
+        elif self.files.pop(args[0], None) is None:
+            return False
+
+    # Function for calculating the QFUPL checksum: the XOR of the data's 16-bit words
+    def checksum(self, data):
+        value = 0
+        for index in range(0, len(data), 2):
+            value ^= (data[index] << 8) | (data[index + 1] if index + 1 < len(data) else 0)
+        return value
+
+    def do_QHTTPGET(self, args, query):
+        if self.http_url is None or self.http_config.get("contextid") not in self.contexts:
+            self.respond("OK")
+            self.send_urc("+QHTTPGET: 702", self.HTTP_LATENCY)
+            return True
+        self.http_body = self.get_content(self.http_url)
+        self.respond("OK")
+        self.send_urc("+QHTTPGET: 0,200," + str(len(self.http_body)), self.HTTP_LATENCY)
+        return True
+
+    def do_QHTTPPOST(self, args, query):
+        if self.http_url is None or self.http_config.get("contextid") not in self.contexts:
+            return False
+
+        def store(data):
+            self.posts.append((self.http_url, bytes(data)))
+            self.http_body = b"OK"
+            self.respond("OK")
+            self.send_urc("+QHTTPPOST: 0,200,2", self.HTTP_LATENCY)
+
+        self.respond("CONNECT")
+        self.expect_data(int(args[0]), store)
+        return True
+
+    def do_QHTTPREAD(self, args, query):
+        if self.http_body is None:
+            return False
+        self.write(b"\r\nCONNECT\r\n" + self.http_body + b"\r\nOK\r\n\r\n+QHTTPREAD: 0\r\n")
+        return True
+
+    # Sockets connect to an echo server: whatever is sent comes back
+    def do_QIOPEN(self, args, query):
+        context_id, connect_id = args[0], args[1]
+        self.respond("OK")
+        if context_id not in self.contexts:
+            self.send_urc("+QIOPEN: " + connect_id + ",566", self.SOCKET_LATENCY)
+        elif connect_id in self.sockets:
+            self.send_urc("+QIOPEN: " + connect_id + ",563", self.SOCKET_LATENCY)
+        else:
+            self.sockets[connect_id] = {"service": args[2], "host": args[3], "port": args[4],
+                                        "context": context_id, "buffer": bytearray()}
+            self.send_urc("+QIOPEN: " + connect_id + ",0", self.SOCKET_LATENCY)
+        return True
+
+    def do_QISEND(self, args, query):
+        if args[0] not in self.sockets or self.sockets[args[0]].get("closed"):
+            return False
+
+        def sent(data):
+            self.respond("SEND OK")
+            self.socket_reply(args[0], data)
+
+        self.write(b"\r\n> ")
+        self.expect_data(int(args[1]) if len(args) > 1 else 0, sent)
+        return True
+
+    def do_QIRD(self, args, query):
+        connection = self.sockets.get(args[0])
+        if connection is None:
+            return False
+        length = int(args[1]) if len(args) > 1 else 1500
+        data = bytes(connection["buffer"][:length])
+        del connection["buffer"][:length]
+        self.write(b"\r\n+QIRD: " + str(len(data)).encode() + b"\r\n" + data + b"\r\n\r\nOK\r\n")
+        return True
+
+    def do_QICLOSE(self, args, query):
+        self.sockets.pop(args[0], None)
+
+    def do_QISWTMD(self, args, query):
+        connection = self.sockets.get(args[0])
+        if connection is None:
+            return False
+        if args[1] != "2":
+            return None
+        # Data waiting in the buffer follows CONNECT
+        self.respond("CONNECT")
+        self.write(bytes(connection["buffer"]))
+        connection["buffer"] = bytearray()
+        self.transparent = args[0]
+        self.escapes = 0
+        self.raw_handler = self.receive_transparent
+        return True
+
+    # Function for taking a byte from the host in transparent mode: '+++' returns
+    # to command mode (the real modem also needs a second's silence either side)
+    def receive_transparent(self, byte):
+        if byte == 0x2B:
+            self.escapes += 1
+            if self.escapes == 3:
+                self.raw_handler = None
+                self.transparent = None
+                self.respond("OK")
+            return
+        data = b"+" * self.escapes + bytes([byte])
+        self.escapes = 0
+        self.socket_reply(self.transparent, data)
+
+    # Function for returning data sent on a socket, as the echo server would.
+    # In buffer mode the modem holds it, reporting it if the buffer was empty
+    def socket_reply(self, connect_id, data):
+        if self.transparent == connect_id:
+            self.write(data)
+            return
+
+        def arrive():
+            connection = self.sockets.get(connect_id)
+            if connection is None or connection.get("closed"):
+                return
+            if self.transparent == connect_id:
+                self.write(data)
+                return
+            empty = len(connection["buffer"]) == 0
+            connection["buffer"] += data
+            if empty:
+                self.respond("+QIURC: \"recv\"," + connect_id)
+
+        delay = self.scale(self.SOCKET_LATENCY)
+        if delay > 0:
+            timer = threading.Timer(delay / 1000.0, arrive)
+            timer.daemon = True
+            timer.start()
+        else:
+            arrive()
+
+    # Function for closing a socket from the far end, eg. in a test. Data waiting
+    # can still be read until the host closes the socket too
+    def close_socket(self, connect_id):
+        connection = self.sockets.get(str(connect_id))
+        if connection is None:
+            return
+        connection["closed"] = True
+        if self.transparent == str(connect_id):
+            self.raw_handler = None
+            self.transparent = None
+            self.respond("NO CARRIER")
+        else:
+            self.respond("+QIURC: \"closed\"," + str(connect_id))
+
+
+class LaraR2Emulator(ModemEmulator):
+
+    name = "lara-r2"
+    manufacturer = "u-blox"
+
+    LATENCY = {
+        "+UPSDA": 1500,
+        "+CGACT": 1500,
+        "+COPS": 2000,
+        "+UHTTPC": 50
+    }
+
+    # Time from AT+UHTTPC to its +UUHTTPCR URC, in milliseconds
+    HTTP_LATENCY = 800
+
+    first_sms_index = 1
+
+    # Function for setting the modem's state to its power-on defaults
+    def reset_state(self):
+        super().reset_state()
+        self.apns = {"1": "super"}
+        self.psd = {}
+        self.psd_active = False
+        self.http_profiles = {}
+
+    def do_CESQ(self, args, query):
+        return ["+CESQ: 99,99,255,255,20,50"]
+
+    def do_CGACT(self, args, query):
+        if query:
+            return ["+CGACT: 1," + ("1" if self.psd_active else "0")]
+        self.psd_active = args[0] == "1"
+
+    def do_UPSD(self, args, query):
+        if len(args) > 2:
+            self.psd[args[1]] = args[2]
+        elif len(args) == 2:
+            return ["+UPSD: 0," + args[1] + ",\"" + self.psd.get(args[1], "") + "\""]
+
+    def do_UPSDA(self, args, query):
+        action = args[1]
+        if action == "3":
+            self.psd_active = True
+            self.send_urc("+UUPSDA: 0,\"10.64.0.1\"", 0)
+        elif action == "4":
+            self.psd_active = False
+
+    def do_UPSND(self, args, query):
+        if args[1] == "8":
+            return ["+UPSND: 0,8," + ("1" if self.psd_active else "0")]
+        if args[1] == "0":
+            return ["+UPSND: 0,0,\"10.64.0.1\""] if self.psd_active else False
+        return False
+
+    def do_UHTTP(self, args, query):
+        profile = self.http_profiles.setdefault(args[0], {})
+        if len(args) > 2:
+            profile[args[1]] = args[2]
+        elif len(args) == 1:
+            profile.clear()
+
+    def do_UHTTPC(self, args, query):
+        profile_id = args[0]
+        profile = self.http_profiles.get(profile_id, {})
+        filename = args[3] if len(args) > 3 else "http_last_response_" + profile_id
+        self.respond("OK")
+        if not self.psd_active or "1" not in profile:
+            self.send_urc("+UUHTTPCR: " + profile_id + "," + args[1] + ",0", self.HTTP_LATENCY)
+            return True
+        if args[1] == "4":
+            # POST the file named in the fifth argument
+            if args[4] not in self.files:
+                self.send_urc("+UUHTTPCR: " + profile_id + ",4,0", self.HTTP_LATENCY)
+                return True
+            self.posts.append((profile["1"] + args[2], self.files[args[4]]))
+            self.files[filename] = b"OK"
+        else:
+            self.files[filename] = self.get_content(profile["1"] + args[2])
+        self.send_urc("+UUHTTPCR: " + profile_id + "," + args[1] + ",1", self.HTTP_LATENCY)
+        return True
+
+    def do_ULSTFILE(self, args, query):
+        if len(args) == 0 or args[0] == "0":
+            return ["+ULSTFILE: " + ",".join(["\"" + name + "\"" for name in self.files])]
+        if args[0] == "2" and args[1] in self.files:
+            return ["+ULSTFILE: " + str(len(self.files[args[1]]))]
+        return False
+
+    def do_URDFILE(self, args, query):
+        if args[0] not in self.files:
+            return False
+        data = self.files[args[0]]
+        self.write(b"\r\n+URDFILE: \"" + args[0].encode() + b"\"," + str(len(data)).encode() + b",\"" + data + b"\"\r\n\r\nOK\r\n")
+        return True
+
+    def do_URDBLOCK(self, args, query):
+        if args[0] not in self.files:
+            return False
+        offset = int(args[1])
+        data = self.files[args[0]][offset:offset + int(args[2])]
+        self.write(b"\r\n+URDBLOCK: \"" + args[0].encode() + b"\"," + str(len(data)).encode() + b",\"" + data + b"\"\r\n\r\nOK\r\n")
+        return True
+
+    def do_UDWNFILE(self, args, query):
+
+        def store(data):
+            self.files[args[0]] = data
+            self.respond("OK")
+
+        # The prompt has no line ending
+        self.write(b"\r\n>")
+        self.expect_data(int(args[1]), store)
+        return True
+
+    def do_UDELFILE(self, args, query):
+        if self.files.pop(args[0], None) is None:
+            return False
+
+
+class MuxEmulation:
+
+    FLAG = 0xF9
+
+    # Frame types, without the poll/final bit
+    SABM = 0x2F
+    UA = 0x63
+    DISC = 0x43
+    UIH = 0xEF
+
+    # Initializer function
+    # 'frame_size' is the N1 given to AT+CMUX: the longest information field sent
+    def __init__(self, emulator, frame_size=31):
+        self.emulator = emulator
+        self.frame_size = frame_size
+        self.frame = bytearray()
+        # Each open channel's command parser state, while another channel is served
+        self.channels = {}
+        # Output made while serving a channel's frame, sent once it has been handled
+        self.pending = None
+        self.errors = 0
+
+    # Function for calculating a frame check sequence, bit by bit
+    def fcs(self, data):
+        value = 0xFF
+        for byte in data:
+            value ^= byte
+            for bit in range(8):
+                value = (value >> 1) ^ 0xE0 if value & 1 else value >> 1
+        return 0xFF - value
+
+    # Function for building a frame from the modem, which is the responder:
+    # its responses have the C/R bit set, its commands, eg. UIH, clear
+    def frame_bytes(self, dlci, control, info=b"", response=False):
+        length = bytes([(len(info) << 1) | 1]) if len(info) <= 127 else bytes([(len(info) & 0x7F) << 1, len(info) >> 7])
+        header = bytes([(dlci << 2) | (0x02 if response else 0) | 0x01, control]) + length
+        return bytes([self.FLAG]) + header + bytes(info) + bytes([self.fcs(header), self.FLAG])
+
+    # Function for taking a byte from the host: frames are collected, checked and handled
+    def receive(self, byte):
+        if len(self.frame) == 0 and byte != self.FLAG:
+            return
+        if len(self.frame) == 1 and byte == self.FLAG:
+            return
+        self.frame.append(byte)
+        if len(self.frame) < 5:
+            return
+        length = self.frame[3] >> 1
+        header = 3
+        if not self.frame[3] & 0x01:
+            if len(self.frame) < 6:
+                return
+            length |= self.frame[4] << 7
+            header = 4
+        if len(self.frame) < header + length + 3:
+            return
+        frame = bytes(self.frame)
+        self.frame = bytearray()
+        if frame[-1] != self.FLAG or frame[1 + header + length] != self.fcs(frame[1:1 + header]):
+            self.errors += 1
+            return
+        self.handle(frame[1] >> 2, frame[2] & ~0x10, frame[1 + header:1 + header + length])
+
+    # Function for acting on a frame from the host
+    def handle(self, dlci, control, info):
+        if control == self.SABM:
+            if dlci > 0:
+                self.channels[dlci] = {"line": bytearray(), "echo": True, "data_handler": None, "data": bytearray(),
+                                       "data_needed": 0, "raw_handler": None}
+            self.emulator.write_port(self.frame_bytes(dlci, self.UA | 0x10, response=True))
+        elif control == self.DISC:
+            self.channels.pop(dlci, None)
+            self.emulator.write_port(self.frame_bytes(dlci, self.UA | 0x10, response=True))
+            if dlci == 0:
+                self.close()
+        elif control == self.UIH and dlci == 0:
+            self.handle_message(info)
+        elif control == self.UIH and dlci in self.channels:
+            self.serve(dlci, info)
+
+    # Function for acting on control channel messages: commands are answered with
+    # the same message as a response; CLD ends multiplexing
+    def handle_message(self, info):
+        while len(info) >= 2:
+            kind = info[0]
+            length = info[1] >> 1
+            values = info[2:2 + length]
+            info = info[2 + length:]
+            if kind & 0x02:
+                self.emulator.write_port(self.frame_bytes(0, self.UIH, bytes([kind & ~0x02, (len(values) << 1) | 1]) + values))
+                if kind == 0xC3:
+                    self.close()
+                    return
+
+    # Function for passing a frame's data to the channel's command parser
+    def serve(self, dlci, data):
+        state = self.channels[dlci]
+        emulator = self.emulator
+        for name in state:
+            setattr(emulator, name, state[name])
+        emulator.local.channel = dlci
+        self.pending = bytearray()
+        try:
+            for byte in data:
+                emulator.receive(byte)
+        finally:
+            for name in state:
+                state[name] = getattr(emulator, name)
+            emulator.raw_handler = self.receive
+            emulator.local.channel = None
+            pending = self.pending
+            self.pending = None
+            self.send(dlci, pending)
+
+    # Function for writing output to a channel. Output while serving a frame is held
+    # until it has been handled; URCs and timed replies, from other threads, go to
+    # the highest channel taking AT commands
+    def write(self, dlci, data):
+        if dlci is not None and self.pending is not None:
+            self.pending += data
+            return
+        if dlci is None:
+            commands = [key for key in self.channels if self.channels[key]["raw_handler"] is None]
+            if len(commands) == 0:
+                return
+            dlci = max(commands)
+        self.send(dlci, data)
+
+    # Function for sending data on a channel in UIH frames of up to frame_size bytes
+    def send(self, dlci, data):
+        frames = b"".join([self.frame_bytes(dlci, self.UIH, data[index:index + self.frame_size])
+                           for index in range(0, len(data), self.frame_size)])
+        if len(frames) > 0:
+            self.emulator.write_port(frames)
+
+    # Function for returning the pty to AT commands
+    def close(self):
+        self.channels = {}
+        if self.emulator.mux is self:
+            self.emulator.mux = None
+            self.emulator.raw_handler = None
+
+
+class TranscriptRecorder:
+
+    # Initializer function
+    # Relays a pty to a real modem on 'device', writing what passes to 'output'
+    def __init__(self, device, output, baudrate=115200):
+        import serial
+        self.modem = serial.Serial(device, baudrate, timeout=0.1)
+        self.output = open(output, "w")
+        self.master = None
+        self.slave = None
+        self.port = None
+        self.running = False
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    # Function for creating the pty and starting the relay threads. Returns the pty path
+    def start(self):
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self.running = True
+        threading.Thread(target=self.host_to_modem, daemon=True).start()
+        threading.Thread(target=self.modem_to_host, daemon=True).start()
+        return self.port
+
+    # Function for stopping the relay
+    def stop(self):
+        self.running = False
+        self.modem.close()
+        self.output.close()
+
+    # Function for writing a transcript entry, preceded by the pause since the last one
+    def record(self, kind, text):
+        with self.lock:
+            now = time.monotonic()
+            if kind == "<":
+                self.output.write("= " + str(int((now - self.last) * 1000)) + "\n")
+            self.output.write(kind + " " + text + "\n")
+            self.output.flush()
+            self.last = now
+
+    # Relay thread: commands from the host
+    def host_to_modem(self):
+        line = b""
+        while self.running:
+            try:
+                data = os.read(self.master, 4096)
+            except OSError:
+                break
+            self.modem.write(data)
+            line += data
+            while b"\r" in line:
+                command, line = line.split(b"\r", 1)
+                if len(command.strip()) > 0:
+                    self.record(">", command.decode('utf-8', errors='ignore').strip())
+
+    # Relay thread: responses from the modem
+    def modem_to_host(self):
+        line = b""
+        while self.running:
+            data = self.modem.read(max(1, self.modem.in_waiting))
+            if len(data) == 0:
+                continue
+            os.write(self.master, data)
+            line += data
+            while b"\n" in line:
+                text, line = line.split(b"\n", 1)
+                text = text.decode('utf-8', errors='ignore').strip()
+                if len(text) > 0:
+                    self.record("<", text)
+
+
+EMULATORS = {"bg96": BG96Emulator, "lara-r2": LaraR2Emulator}
+
+
+# Function for running a command against the emulator's pty, with fake GPIO and
+# link settings kept apart from a real modem's. Returns the command's exit code
+def run_command(port, command):
+    env = dict(os.environ)
+    env["MODEM_SERIAL_PORT"] = port
+    env.setdefault("MODEM_GPIO_BACKEND", "fake")
+    env.setdefault("MODEM_LINK_SETTINGS", os.path.join(tempfile.gettempdir(), "modem-emulator-link.json"))
+    here = os.path.dirname(os.path.abspath(__file__))
+    env["PYTHONPATH"] = here + os.pathsep + env.get("PYTHONPATH", "")
+    return subprocess.call(command, env=env)
+
+
+if __name__ == "__main__":
+    argv = sys.argv[1:]
+    command = []
+    if "--" in argv:
+        command = argv[argv.index("--") + 1:]
+        argv = argv[:argv.index("--")]
+    parser = argparse.ArgumentParser(description="Emulate a BG96 or LARA-R2 modem on a pty")
+    parser.add_argument("modem", choices=sorted(EMULATORS.keys()) + ["record"])
+    parser.add_argument("device", nargs="?", help="real modem to record from")
+    parser.add_argument("--output", default="transcript.txt", help="transcript file to record to")
+    parser.add_argument("--transcript", help="transcript file to replay")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="latency multiplier, 0 for none")
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--drop-rate", type=float, default=0)
+    parser.add_argument("--garble-rate", type=float, default=0)
+    parser.add_argument("--spike-rate", type=float, default=0)
+    parser.add_argument("--spike-ms", type=float, default=1000)
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args(argv)
+
+    if args.modem == "record":
+        if args.device is None:
+            parser.error("record needs the modem's serial device")
+        emulator = TranscriptRecorder(args.device, args.output)
+    else:
+        faults = {"error_rate": args.error_rate, "drop_rate": args.drop_rate,
+                  "garble_rate": args.garble_rate, "spike_rate": args.spike_rate, "spike_ms": args.spike_ms}
+        emulator = EMULATORS[args.modem](args.time_scale, args.transcript, faults, args.seed)
+    port = emulator.start()
+
+    if len(command) > 0:
+        code = run_command(port, command)
+        emulator.stop()
+        sys.exit(code)
+
+    print("export MODEM_SERIAL_PORT=" + port)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        emulator.stop()
@@ -0,0 +1,108 @@
+'''
+  asyncio version of the simplified Seeed LTE Hat library.
+  ---
+  Every method that talks to the modem is a coroutine, so one event loop
+  can drive the modem alongside other I/O tasks. Pins and timeout tables
+  come from LaraR2Profile, which UbloxLaraR2 uses too.
+'''
+
+import asyncio
+from lara_r2_profile import LaraR2Profile
+from asyncmodem import AsyncCellularModem
+
+
+class AsyncUbloxLaraR2(LaraR2Profile, AsyncCellularModem):
+
+    # Start up the modem, yielding to the loop until it answers
+    async def boot(self):
+        self.initialize()
+        await self.transport.open()
+        await self.wait_until_ready(self.millis() + self.boot_timeout * 1000)
+
+    # Activate a PDP context
+    async def activate_context(self):
+        return await self.command("AT+CGACT=1,1")
+
+    # Deactivate a PDP context
+    async def deactivate_context(self):
+        return await self.command("AT+CGACT=0,1")
+
+    # Make an HTTP GET request using HTTP profile 0 over an active PSD connection.
+    # Returns a tuple: ("OK", None, body) or (error state, None, response).
+    # The LARA-R2 reports success or failure, not the HTTP status code
+    async def http_get(self, host, path, filename="data.json"):
+        await self.command("AT+UHTTP=0,7," + str(self.http_timeout))
+        await self.command("AT+UHTTP=0,1,\"" + host + "\"")
+
+        # The request is acknowledged at once; the result arrives as a URC,
+        # eg. "+UUHTTPCR: 0,1,1", so the channel is free meanwhile
+        results = self.urc_queue("+UUHTTPCR")
+        while not results.empty():
+            results.get_nowait()
+        result = await self.command("AT+UHTTPC=0,1,\"" + path + "\",\"" + filename + "\"", timeout=self.timeout)
+        if result[0] != "OK":
+            return (result[0], None, result[1])
+        try:
+            urc = await asyncio.wait_for(results.get(), self.http_timeout + self.timeout)
+        except asyncio.TimeoutError:
+            return ("TIMEOUT", None, "")
+        if urc.split(",")[-1].strip() != "1":
+            return ("ERROR", None, urc)
+
+        # Read back the body, framed on the sizes the modem declares
+        try:
+            body = await self.read_file(filename)
+        except IOError as exp:
+            return ("ERROR", None, str(exp))
+        return ("OK", None, body.decode('utf-8', errors='ignore'))
+
+    # Get the size of a file in the modem's file system, or None if it can't be read
+    async def get_file_size(self, filename):
+        result = await self.command("AT+ULSTFILE=2,\"" + filename + "\"")
+        index = result[1].find("+ULSTFILE: ")
+        if result[0] != "OK" or index == -1:
+            return None
+        return int(result[1][index + 11:].split("\r\n")[0])
+
+    # Read a file from the modem's file system, as bytes, in blocks of 'block_size'.
+    # Raises IOError if the read fails
+    async def read_file(self, filename, block_size=512):
+        size = await self.get_file_size(filename)
+        if size is None:
+            raise IOError("Can't get the size of " + filename)
+        data = bytearray()
+        while len(data) < size:
+            data += await self.read_file_block(filename, len(data), min(block_size, size - len(data)))
+        return bytes(data)
+
+    # Read 'count' bytes of a file from 'offset'. As for UbloxLaraR2.read_file_block(),
+    # the block is framed on the size the modem declares, eg.
+    # +URDBLOCK: "data.json",512,"<512 bytes>", so it may hold commas, quotes or line breaks
+    async def read_file_block(self, filename, offset, count):
+        command = "AT+URDBLOCK=\"" + filename + "\"," + str(offset) + "," + str(count)
+        timeout = self.get_command_timeout(command)
+
+        async def read(line):
+            header = line[line.find(b"+URDBLOCK: ") + 11:]
+            start = header.find(b"\",") + 2
+            end = header.find(b",\"", start)
+            size = int(header[start:end])
+            block = header[end + 2:end + 2 + size]
+            if len(block) < size:
+                block += await self.transport.read_bytes(size - len(block), timeout)
+                if len(block) < size:
+                    raise TimeoutError(command + " timed out")
+            # Skip the closing quote and wait for the result code
+            while True:
+                line = await self.transport.read_line(timeout)
+                if not line.endswith(b"\n"):
+                    raise TimeoutError(command + " timed out")
+                if line.find(b"ERROR") != -1:
+                    raise IOError(command + " failed: " + line.decode('utf-8', errors='ignore').strip())
+                if line.find(b"OK") != -1:
+                    return block
+
+        result = await self.read_data(command, "+URDBLOCK: ", read, timeout)
+        if result[0] != "OK":
+            raise IOError(command + " failed: " + result[1].strip())
+        return result[1]
@@ -1,6 +1,8 @@
 from ublox_lara_r2 import *
+from outbox import Outbox
 import time
 import sys
+import os
 import json
 
 # Set up the modem
@@ -8,56 +10,48 @@ modem = UbloxLaraR2()
 modem.boot()
 modem.set_debug(False)
 modem.send_command("AT+CMEE=2")
+modem.start_urc_dispatcher()
 
 # URL of the data source
-base_url = "api.open-notify.org"
-conn_open = False
+source_url = "http://api.open-notify.org/iss-now.json"
 
 # Set the HTTP timeout to 30 seconds
-modem.send_command("AT+UHTTP=0,7,30")
+modem.set_http_timeout(30)
 
-# Set the URL parameters: length and timeout
-modem.send_command("AT+UHTTP=0,1,\"" + base_url + "\"")
+# Keep the PSD connection open between requests;
+# close it only if it goes unused for five minutes
+session = modem.http_session(apn="super", idle_timeout=300)
 
-# Set the PSD APN
-modem.send_command("AT+UPSD=0,1,\"super\"")
+# Queue the readings on disk; if $ISS_UPLOAD_URL is set, they are
+# posted there in batches, and kept while the upload fails
+outbox = Outbox(os.path.join(os.path.expanduser("~"), ".cellular-iot", "outbox"))
+upload_url = os.environ.get("ISS_UPLOAD_URL")
 
 while True:
     try:
-        # Open a data connection
-        modem.send_command("AT+UPSDA=0,3")
-        conn_open = True
-
         # Make the GET request
-        result = modem.send_command("AT+UHTTPC=0,1,\"/iss-now.json\",\"data.json\"", "UUHTTPCR")
+        result = session.get(source_url)
 
         if result[0] == "OK":
-            # Check for HTTP error code
-            result = result[1].split(": ")
-            result = result[1].split(",")
-            if result[2] == "1":
-                response = modem.send_command("AT+URDFILE=\"data.json\"", "+URDFILE:")
-                response = response[1].split(": ")
-                response = response[1].split(",")
-                response = response[2]
-                data = json.loads(response)
-
-                if data["message"] == "success":
-                    print("ISS is at",data["iss_position"]["longitude"],",",data["iss_position"]["latitude"])
-                else:
-                    print("ISS location not retrieved")
+            data = json.loads(result[2])
+
+            if data["message"] == "success":
+                print("ISS is at",data["iss_position"]["longitude"],",",data["iss_position"]["latitude"])
+                outbox.put(json.dumps({"time": time.time(), "position": data["iss_position"]}))
             else:
-                print("No ISS data retrieved",result)
+                print("ISS location not retrieved")
+        else:
+            print("No ISS data retrieved",result)
+            outbox.put(json.dumps({"time": time.time(), "error": result[0]}))
 
-        # Close the data connection
-        modem.deactivate_context()
-        conn_open = False
+        # Send whatever is queued
+        if upload_url is not None:
+            print("Uploaded",session.upload(outbox, upload_url),"readings")
 
         # Pause 1 minute
         print("*")
-        time.sleep(60)
+        session.wait(60)
     except KeyboardInterrupt:
-        if conn_open:
-            modem.deactivate_context()
+        session.close()
+        outbox.close()
         sys.exit()
-
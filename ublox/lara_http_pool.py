@@ -0,0 +1,154 @@
+'''
+  Pool of HTTP profiles for concurrent requests on the LARA-R2.
+  ---
+  The LARA-R2 has four HTTP profiles, each with its own server and
+  result file, and runs their requests side by side. The pool keeps a
+  request in flight on every profile, matching each +UUHTTPCR to the
+  profile that raised it, so fetching from several servers takes about
+  as long as the slowest request rather than all of them in turn. A
+  profile keeps the server it was last set to, and a request goes to a
+  free profile already set to its server if there is one.
+
+  Usage:
+      pool = modem.http_pool(apn="super")
+      for result in pool.get_all([first_url, second_url, third_url]):
+          print(result)
+'''
+
+import queue
+import time
+from lara_http_session import LaraR2HTTPSession
+
+
+class LaraR2HTTPPool(LaraR2HTTPSession):
+
+    profiles = 4 # HTTP profiles used, from 0
+
+    # Number of HTTP profiles the LARA-R2 has
+    MAX_PROFILES = 4
+
+    # Initializer function
+    def __init__(self, modem, apn="super", idle_timeout=300, profiles=4):
+        super().__init__(modem, apn, idle_timeout)
+        self.profiles = min(profiles, self.MAX_PROFILES)
+        # The server each profile is set to, and when it was last used
+        self.hosts = [None] * self.profiles
+        self.used = [0] * self.profiles
+        self.uses = 0
+        # Statistics
+        self.reused = 0
+
+    # Get the result file of a profile
+    def result_file(self, profile):
+        return "http_" + str(profile) + ".dat"
+
+    # Set the HTTP timeout for every profile. The modem forgets the
+    # servers with the PSD connection, so they are sent again
+    def configure(self):
+        self.modem.send_batch(["AT+UHTTP=" + str(profile) + ",7," + str(self.modem.http_timeout)
+                               for profile in range(self.profiles)])
+        self.hosts = [None] * self.profiles
+
+    # Keep profile 0's server in step when requests are made on it directly, eg. post()
+    def set_server(self, url):
+        result = super().set_server(url)
+        self.hosts[0] = self.url
+        return result
+
+    # Make a GET request on whichever profile is free
+    def get(self, url):
+        return self.get_all([url])[0]
+
+    # Make GET requests to several URLs at once, with up to one in flight on each
+    # profile. Returns a list holding a result for each URL, in order, as get() does
+    def get_all(self, urls, block_size=1024):
+        if not self.ensure_context():
+            return [("ERROR", None, "PDP context not active")] * len(urls)
+        # Discard results of requests abandoned earlier
+        while not self.results.empty():
+            self.results.get_nowait()
+        results = [None] * len(urls)
+        pending = list(range(len(urls)))
+        # Requests in flight: profile -> (URL index, deadline from modem.millis())
+        running = {}
+        # Profiles whose request timed out: a late result could be taken for a new one's
+        retired = []
+        while len(pending) > 0 or len(running) > 0:
+            while len(pending) > 0:
+                profile = self.choose_profile(urls[pending[0]], running, retired)
+                if profile is None:
+                    break
+                index = pending.pop(0)
+                result = self.start_request(profile, urls[index])
+                if result[0] != "OK":
+                    results[index] = (result[0], None, result[1])
+                    continue
+                running[profile] = (index, self.modem.millis() + (self.modem.http_timeout + self.modem.timeout) * 1000)
+            if len(running) == 0:
+                for index in pending:
+                    results[index] = ("TIMEOUT", None, "")
+                break
+
+            # Wait for the next request to finish, eg. "+UUHTTPCR: 2,1,1"
+            remaining = min([item[1] for item in running.values()]) - self.modem.millis()
+            try:
+                urc = self.results.get(timeout=max(0, remaining) / 1000.0)
+            except queue.Empty:
+                now = self.modem.millis()
+                for profile in [key for key in running if running[key][1] <= now]:
+                    results[running.pop(profile)[0]] = ("TIMEOUT", None, "")
+                    retired.append(profile)
+                continue
+            fields = urc[urc.find(":") + 1:].split(",")
+            if len(fields) < 3 or int(fields[0]) not in running or fields[1].strip() != "1":
+                continue
+            index = running.pop(int(fields[0]))[0]
+            if fields[2].strip() != "1":
+                results[index] = ("ERROR", None, urc)
+                continue
+            # Read the body while the other requests carry on
+            results[index] = self.read_result(int(fields[0]), block_size)
+
+        self.last_used = time.monotonic()
+        if len([result for result in results if result[0] != "OK"]) > 0:
+            # Check the connection properly next time
+            self.context_open = False
+        return results
+
+    # Choose a free profile for a request: one already set to its server, or
+    # else the one used longest ago. Returns None if none is free
+    def choose_profile(self, url, running, retired):
+        free = [profile for profile in range(self.profiles) if profile not in running and profile not in retired]
+        if len(free) == 0:
+            return None
+        host = self.split_url(url)[0]
+        for profile in free:
+            if self.hosts[profile] == host:
+                return profile
+        return min(free, key=lambda profile: self.used[profile])
+
+    # Start a GET request on a profile, setting its server first if need be.
+    # Returns ("OK", response) once the modem has accepted it
+    def start_request(self, profile, url):
+        host, path = self.split_url(url)
+        if self.hosts[profile] != host:
+            result = self.modem.send_command("AT+UHTTP=" + str(profile) + ",1,\"" + host + "\"")
+            if result[0] != "OK":
+                return result
+            self.hosts[profile] = host
+            if profile == 0:
+                self.url = host
+        else:
+            self.reused += 1
+        self.uses += 1
+        self.used[profile] = self.uses
+        return self.modem.send_command("AT+UHTTPC=" + str(profile) + ",1,\"" + path + "\",\""
+                                       + self.result_file(profile) + "\"", timeout=self.modem.timeout)
+
+    # Read a finished request's result file. Returns a result as get() does
+    def read_result(self, profile, block_size):
+        try:
+            body = b"".join(self.modem.read_file_blocks(self.result_file(profile), None, block_size))
+        except IOError as exp:
+            return ("ERROR", None, str(exp))
+        return ("OK", None, body.decode('utf-8', errors='ignore'))
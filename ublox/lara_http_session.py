@@ -0,0 +1,124 @@
+'''
+  Persistent PSD connection and HTTP session for the LARA-R2.
+  ---
+  Keeps PSD profile 0 active between requests, checking it with
+  AT+UPSND, and re-sends the HTTP server name only when it changes.
+  Requires the URC dispatcher, which is started if necessary.
+'''
+
+import os
+import queue
+import sys
+from urllib.parse import urlsplit
+
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from httpsession import HTTPSession
+
+
+class LaraR2HTTPSession(HTTPSession):
+
+    apn = "super"
+    filename = "data.json"
+    upload_filename = "upload.dat" # holds a POST request's body
+
+    # AT+UHTTPC content types; other types are sent as application/octet-stream
+    CONTENT_TYPES = {
+        "application/x-www-form-urlencoded": 0,
+        "text/plain": 1,
+        "application/octet-stream": 2,
+        "multipart/form-data": 3,
+        "application/json": 4,
+        "application/xml": 5
+    }
+
+    # Initializer function
+    def __init__(self, modem, apn="super", idle_timeout=300):
+        super().__init__(modem, idle_timeout)
+        self.apn = apn
+        self.results = modem.urc_queue("+UUHTTPCR")
+
+    # Check the PSD connection with a single query: +UPSND: 0,8,1 when active
+    def context_active(self):
+        result = self.modem.send_command("AT+UPSND=0,8")
+        return result[0] == "OK" and result[1].find("+UPSND: 0,8,1") != -1
+
+    # Activate the PSD connection
+    def open_context(self):
+        self.modem.send_command("AT+UPSD=0,1,\"" + self.apn + "\"")
+        result = self.modem.send_command("AT+UPSDA=0,3")
+        return result[0] == "OK"
+
+    # Deactivate the PSD connection
+    def close_context(self):
+        self.modem.send_command("AT+UPSDA=0,4")
+
+    # Set the HTTP timeout for profile 0
+    def configure(self):
+        self.modem.send_command("AT+UHTTP=0,7," + str(self.modem.http_timeout))
+
+    # Split a URL into the server name and the path and query to request
+    def split_url(self, url):
+        parts = urlsplit(url if url.find("://") != -1 else "http://" + url)
+        path = parts.path if len(parts.path) > 0 else "/"
+        if len(parts.query) > 0:
+            path += "?" + parts.query
+        return (parts.netloc, path)
+
+    # Send the server name, only if it has changed.
+    # Returns ("OK", None, path), with the path and query to request, on success
+    def set_server(self, url):
+        host, path = self.split_url(url)
+        if host != self.url:
+            result = self.modem.send_command("AT+UHTTP=0,1,\"" + host + "\"")
+            if result[0] != "OK":
+                return (result[0], None, result[1])
+            self.url = host
+        return ("OK", None, path)
+
+    # Make a GET request
+    def request(self, url):
+        result = self.set_server(url)
+        if result[0] != "OK":
+            return result
+        return self.run_command("1,\"" + result[2] + "\",\"" + self.filename + "\"")
+
+    # Make a POST request. The body is written to a file, which the modem sends
+    def request_post(self, url, body, content_type):
+        result = self.set_server(url)
+        if result[0] != "OK":
+            return result
+        path = result[2]
+        # AT+UDWNFILE won't replace a file
+        self.modem.send_command("AT+UDELFILE=\"" + self.upload_filename + "\"")
+        # No other thread's command may come between the prompt and the data
+        with self.modem.lock:
+            result = self.modem.send_command("AT+UDWNFILE=\"" + self.upload_filename + "\"," + str(len(body)), ">")
+            if result[0] != "OK":
+                return (result[0], None, result[1])
+            result = self.modem.send_data(body)
+        if result[0] != "OK":
+            return (result[0], None, result[1])
+        result = self.run_command("4,\"" + path + "\",\"" + self.filename + "\",\"" + self.upload_filename + "\","
+                                  + str(self.CONTENT_TYPES.get(content_type, 2)))
+        return result if result[0] != "OK" else ("OK", None, "")
+
+    # Run an HTTP command on profile 0 and wait for the result, eg. "+UUHTTPCR: 0,1,1"
+    def run_command(self, arguments):
+        while not self.results.empty():
+            self.results.get_nowait()
+        result = self.modem.send_command("AT+UHTTPC=0," + arguments, timeout=self.modem.timeout)
+        if result[0] != "OK":
+            return (result[0], None, result[1])
+        # Read the queue emptied above: wait_for_urc() would discard a result that
+        # arrived along with the command's OK
+        try:
+            urc = self.results.get(timeout=self.modem.http_timeout + self.modem.timeout)
+        except queue.Empty:
+            return ("TIMEOUT", None, "")
+        if urc.split(",")[-1].strip() != "1":
+            return ("ERROR", None, urc)
+        return ("OK", None, None)
+
+    # Stream the result file with AT+URDBLOCK
+    def read_body(self, length, block_size):
+        return self.modem.read_file_blocks(self.filename, length, block_size)
@@ -0,0 +1,84 @@
+'''
+  LARA-R2 profile shared by the blocking and asyncio Seeed LTE Hat drivers.
+  ---
+  The LARA-R2's dialect and the hat's pins: timeouts, URCs and the
+  commands that can't be chained or retried.
+'''
+
+import os
+import sys
+
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from modemprofile import ModemProfile
+
+
+class LaraR2Profile(ModemProfile):
+
+    http_timeout = 180 # seconds, the AT+UHTTP default
+
+    DEFAULT_SERIAL_PORT = "/dev/ttyAMA0"
+
+    # Baud rates negotiate_link() tries, fastest first
+    BAUDRATES = (921600, 460800, 230400, 115200)
+
+    # Output pins, held low at start-up
+    PINS = (17, 16, 6, 5)
+
+    # Maximum response times, in seconds, taken from the u-blox AT Commands Manual.
+    # Commands not listed here use self.timeout
+    COMMAND_TIMEOUTS = {
+        "AT": 0.3,
+        "ATE0": 0.3,
+        "AT+CMEE": 0.3,
+        "AT+IPR": 0.3,
+        "AT+IFC": 0.3,
+        "AT+CMGF": 0.3,
+        "AT+CMGR": 0.3,
+        "AT+CMGL": 5,
+        "AT+CMGD": 5,
+        "AT+CMGS": 180,
+        "AT+CESQ": 0.3,
+        "AT+COPS": 180,
+        "AT+CGACT": 150,
+        "AT+UPSD": 0.3,
+        "AT+UPSDA": 180,
+        "AT+UHTTP": 0.3,
+        "AT+URDFILE": 3,
+        "AT+URDBLOCK": 3,
+        "AT+ULSTFILE": 0.3,
+        "AT+UDWNFILE": 0.3,
+        "AT+CFUN": 180
+    }
+
+    # Commands whose response time is bounded by self.http_timeout
+    HTTP_COMMANDS = ("AT+UHTTPC",)
+
+    # Commands that must not be chained into one command line: they prompt for
+    # data, wait for a URC or take long enough to be worth handling on their own
+    NO_CHAIN_COMMANDS = ("AT+UHTTPC", "AT+UPSDA", "AT+CGACT", "AT+URDFILE", "AT+UDWNFILE",
+                         "AT+USOWR", "AT+CMGS", "AT+COPS")
+
+    # Commands that must not be re-sent after a timeout: each repeat would make
+    # another request, send more data or reset the modem again
+    NO_RETRY_COMMANDS = ("AT+UHTTPC", "AT+UDWNFILE", "AT+USOWR", "AT+USOST", "AT+CMGS", "AT+CFUN")
+
+    # Unsolicited result codes
+    URC_PREFIXES = ("+CMTI", "+UUHTTPCR", "+UUPSDA", "+UUPSDD", "+UUSORD", "+UUSORF",
+                    "+UUSOCL", "+CREG", "+CGREG", "+CEREG")
+
+    # 'port' defaults to $MODEM_SERIAL_PORT, eg. an emulator's pty, or /dev/ttyAMA0
+    # 'baudrate' and 'rtscts' default to those saved by negotiate_link(), or 115200 and off.
+    # 'gpio_backend' is as for ModemProfile, eg. "none" for a USB modem
+    def __init__(self, port=None, baudrate=None, rtscts=None, dsrdtr=False, gpio_backend=None):
+        super().__init__(port, baudrate, rtscts, dsrdtr, gpio_backend)
+
+    def initialize(self):
+        if self.debug is False:
+            self.gpio.set_warnings(False)
+        for pin in self.PINS:
+            self.gpio.setup_output(pin, 0)
+
+    # Set up the pins as part of boot(). The hat gives no way to tell whether the
+    # modem is on, so boot() asks it with AT, waiting for it to start if need be
+    def setup_pins(self):
+        self.initialize()
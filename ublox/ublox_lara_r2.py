@@ -8,80 +8,84 @@
       MIT Licence
 '''
 
-import serial
-import time
-import os
-import RPi.GPIO as GPIO
-
-
-class UbloxLaraR2():
-
-    response = ""
-    debug = True
-    timeout = 3 # seconds
-
-
-    def __init__(self, port="/dev/ttyAMA0", baudrate=115200):
-        self.ser = serial.Serial()
-        self.ser.port = port
-        self.ser.baudrate = baudrate
-        self.ser.parity = serial.PARITY_NONE
-        self.ser.stopbits = serial.STOPBITS_ONE
-        self.ser.bytesize = serial.EIGHTBITS
-        self.debug_print("CellularIoT class instantiated")
-
-    def initialize(self):
-        GPIO.setmode(GPIO.BCM)
-        if self.debug is False:
-            GPIO.setwarnings(False)
-        GPIO.setup(17, GPIO.OUT, initial=GPIO.LOW)
-        GPIO.setup(16, GPIO.OUT, initial=GPIO.LOW)
-        GPIO.setup(6, GPIO.OUT, initial=GPIO.LOW)
-        GPIO.setup(5, GPIO.OUT, initial=GPIO.LOW)
-
-    # Start up the modem
-    def boot(self):
-        self.initialize()
-        while True:
-            result = self.send_command("AT")
-            if result[0] == "OK": return
-            time.sleep(1)
-
-    # Send a command or date out via serial
-    def send(self, command):
-        if self.ser.isOpen() is False:
-            self.ser.open()
-        command = str(command) + "\r"
-        self.ser.reset_input_buffer()
-        self.ser.write(command.encode())
-
-    # Sending a specific AT command to the modem
-    def send_command(self, command, desired_response="OK\r\n", timeout=None):
-        if timeout is None:
-            timeout = self.timeout
-        self.response = ""
-        self.send(command)
-        timer = self.millis()
-        while True:
-            if self.millis() - timer > timeout:
-                # Re-issue command on timeout
-                # TODO or return an error?
-                self.response = ""
-                self.send(command)
-                timer = self.millis()
-            while self.ser.in_waiting > 0:
-                try:
-                    self.response += self.ser.read(self.ser.in_waiting).decode('utf-8', errors='ignore')
-                    self.delay(100)
-                except Exception as exp:
-                    self.debug_print(exp.Message)
-            if self.response.find(desired_response) != -1:
-                self.debug_print(self.response)
-                return ("OK", self.response)
-            if self.response.find("ERROR") != -1:
-                self.debug_print(self.response)
-                return ("ERROR", self.response)
-                break
+from lara_r2_profile import LaraR2Profile
+from cellularmodem import CellularModem
+
+
+class UbloxLaraR2(LaraR2Profile, CellularModem):
+
+    # The port's original name
+    @property
+    def ser(self):
+        return self.uart
+
+    # Reset the modem (AT+CFUN=16), eg. when it stops responding, and wait for it to restart
+    def reset(self):
+        self.send_command("AT+CFUN=16")
+        self.delay(1000)
+        self.wait_until_ready(self.millis() + self.boot_timeout * 1000)
+
+    # Get the size of a file in the modem's file system, or None if it can't be read
+    def get_file_size(self, filename):
+        result = self.send_command("AT+ULSTFILE=2,\"" + filename + "\"")
+        index = result[1].find("+ULSTFILE: ")
+        if result[0] != "OK" or index == -1:
+            return None
+        return int(result[1][index + 11:].split("\r\n")[0])
+
+    # Read a file from the modem's file system in blocks, yielding each as bytes.
+    # The file is read with AT+URDBLOCK, so only one block is held in memory.
+    # Raises IOError if the read fails
+    def read_file_blocks(self, filename, size=None, block_size=512):
+        if size is None:
+            size = self.get_file_size(filename)
+            if size is None:
+                raise IOError("Can't get the size of " + filename)
+        offset = 0
+        while offset < size:
+            block = self.read_file_block(filename, offset, min(block_size, size - offset))
+            offset += len(block)
+            yield block
+
+    # Read 'count' bytes of a file from 'offset'. The block is framed on the size the
+    # modem declares, eg. +URDBLOCK: "data.json",512,"<512 bytes>", so it may hold
+    # commas, quotes or line breaks
+    def read_file_block(self, filename, offset, count):
+        command = "AT+URDBLOCK=\"" + filename + "\"," + str(offset) + "," + str(count)
+        timeout = self.get_command_timeout(command)
+        self.hold_input(command)
+        try:
+            self.send(command)
+            while True:
+                line = self.read_until(b"\n", timeout)
+                if len(line) == 0:
+                    raise TimeoutError(command + " timed out")
+                index = line.find(b"+URDBLOCK: ")
+                if index != -1:
+                    break
+                if line.find(b"ERROR") != -1:
+                    raise IOError(command + " failed: " + line.decode('utf-8', errors='ignore').strip())
+            header = line[index + 11:]
+            start = header.find(b"\",") + 2
+            end = header.find(b",\"", start)
+            size = int(header[start:end])
+            block = header[end + 2:end + 2 + size]
+            if len(block) < size:
+                block += self.read_bytes(size - len(block), timeout)
+                if len(block) < size:
+                    raise TimeoutError(command + " timed out")
+            # Skip the closing quote and wait for the result code
+            while True:
+                line = self.read_line(timeout)
+                if len(line) == 0:
+                    raise TimeoutError(command + " timed out")
+                if line.find("ERROR") != -1:
+                    raise IOError(command + " failed: " + line.strip())
+                if line.find("OK") != -1:
+                    break
+            return block
+        finally:
+            self.release_input()
 
     # Activate a PDP context
     def activate_context(self):
@@ -91,19 +95,12 @@ class UbloxLaraR2():
     def deactivate_context(self):
         self.send_command("AT+CGACT=0,1")
 
-    # Output debug messages if the debug flag is set
-    def debug_print(self, message):
-        if self.debug:
-            print(message)
-
-    # Set the debug flag
-    def set_debug(self, state=True):
-        self.debug = state
-
-    # Getting a time in miliseconds
-    def millis(self):
-        return int(time.time())
+    # Get an HTTP session that keeps the PSD connection open between requests
+    def http_session(self, apn=None, idle_timeout=300):
+        from lara_http_session import LaraR2HTTPSession
+        return LaraR2HTTPSession(self, apn if apn is not None else "super", idle_timeout)
 
-    # Delay in miliseconds
-    def delay(self, ms):
-        time.sleep(float(ms / 1000.0))
+    # Get an HTTP session that runs requests on up to 'profiles' HTTP profiles at once
+    def http_pool(self, apn=None, profiles=4, idle_timeout=300):
+        from lara_http_pool import LaraR2HTTPPool
+        return LaraR2HTTPPool(self, apn if apn is not None else "super", idle_timeout, profiles)